@@ -11,6 +11,14 @@ class Color(object):
     def components(self):
         return self.__rgb
     
+    def __eq__(self, other):
+        if not isinstance(other, Color):
+            return False
+        return tuple(self.__rgb) == tuple(other.components())
+    
+    def __hash__(self):
+        return hash(tuple(self.__rgb))
+    
     def __repr__(self):
         return "Color<%s>" % self.hex()
     
@@ -29,6 +29,15 @@ class I18nText(object):
     def __iter__(self):
         return iter(self.__strings.keys())
     
+    def __eq__(self, other):
+        if not isinstance(other, I18nText):
+            return False
+        return set(self) == set(other) and all(self[locale] == other[locale] for locale in self)
+    
+    def __hash__(self):
+        # texts are mutable, so one must not change while it is a key or in a set
+        return hash(frozenset(self.__strings.items()))
+    
     def __repr__(self):
         return 'I18nText(%s)' % self.__strings
     
@@ -221,9 +221,12 @@ class InlineComboboxEditor(Ttk.Combobox):
         self.destroy()
 
 class PropertyInspector(Tk.Frame):
+    MAX_SEARCH_HITS = 1000  # rows highlighted and expanded at once; the rest are only counted
+    
     def __init__(self, master=None, **keys):
         Tk.Frame.__init__(self, master, **keys)
         self.__properties = {}
+        self.__clear_search_index()
         
         self.treeview = Ttk.Treeview(self)
         self.treeview.pack(side=Tk.LEFT, fill=Tk.BOTH, expand=True)
@@ -240,15 +243,124 @@ class PropertyInspector(Tk.Frame):
         self.treeview.column('value')
         self.treeview.heading('type', text='Type')
         self.treeview.heading('value', text='Value')
+        self.treeview.tag_configure('search', background='#ffff80')
     
     def insert(self, rowid, index, property):
+        parent = rowid
         rowid = self.treeview.insert(rowid, index, text=property.name, values=(property.type.name(), property.format()))
         self.__properties[rowid] = property
+        self.__index_row(rowid, parent, property.name, property.type.name(), property.format())
+        return rowid
+    
+    def insert_node(self, rowid, index, text, type, value='', **keys):
+        # a row without a property (a container node), still found by search
+        parent = rowid
+        rowid = self.treeview.insert(rowid, index, text=text, values=(type, value), **keys)
+        self.__index_row(rowid, parent, text, type, value)
         return rowid
     
     def delete_all(self):
         self.treeview.delete(*self.treeview.get_children())
         self.__properties = {}
+        self.__clear_search_index()
+    
+    def delete_children(self, rowid):
+        # the search texts of the deleted rows are blanked, so that the positions of the other rows stay valid
+        rows = []
+        stack = list(self.treeview.get_children(rowid))
+        while len(stack) > 0:
+            row = stack.pop()
+            rows.append(row)
+            stack.extend(self.treeview.get_children(row))
+        self.treeview.delete(*self.treeview.get_children(rowid))
+        deleted = set(rows)
+        for row in rows:
+            self.__properties.pop(row, None)
+            self.__parents.pop(row, None)
+            position = self.__search_positions.pop(row, None)
+            if position is not None:
+                self.__search_texts[position] = ''
+        self.__search_hits = [i for i in self.__search_hits if self.__search_rows[i] not in deleted]
+        self.__shown_hits = [row for row in self.__shown_hits if row not in deleted]
+        self.__opened_by_search -= deleted
+        if len(self.__search_rows) > 2 * len(self.__search_positions):
+            self.__compact_search_index()
+    
+    def search(self, query):
+        # returns the number of matching rows; a query that extends the previous one only rescans the previous hits
+        query = query.strip().lower()
+        if query == '':
+            hits = []
+        elif self.__search_query != '' and query.startswith(self.__search_query):
+            hits = [i for i in self.__search_hits if query in self.__search_texts[i]]
+        else:
+            hits = [i for i, text in enumerate(self.__search_texts) if query in text]
+        self.__search_query = query
+        self.__search_hits = hits
+        self.__show_search_hits([self.__search_rows[i] for i in hits[:self.MAX_SEARCH_HITS]])
+        return len(hits)
+    
+    def next_search_hit(self):
+        rows = self.__shown_hits
+        if len(rows) == 0:
+            return
+        selection = self.treeview.selection()
+        position = rows.index(selection[0]) + 1 if len(selection) > 0 and selection[0] in rows else 0
+        rowid = rows[position % len(rows)]
+        self.treeview.selection_set(rowid)
+        self.treeview.see(rowid)
+    
+    def __clear_search_index(self):
+        self.__search_rows = []
+        self.__search_texts = []
+        self.__search_positions = {}
+        self.__parents = {}
+        self.__search_query = ''
+        self.__search_hits = []
+        self.__shown_hits = []
+        self.__opened_by_search = set()
+    
+    def __index_row(self, rowid, parent, text, type, value):
+        self.__parents[rowid] = parent
+        self.__search_positions[rowid] = len(self.__search_rows)
+        self.__search_rows.append(rowid)
+        self.__search_texts.append(self.search_text(text, type, value))
+        self.__search_query = ''  # the row is not among the previous hits, so the next search scans everything
+    
+    def __compact_search_index(self):
+        # drops the blanked texts of deleted rows once they are the majority
+        positions = [i for i, rowid in enumerate(self.__search_rows) if self.__search_positions.get(rowid) == i]
+        moved = dict((old, new) for new, old in enumerate(positions))
+        self.__search_rows = [self.__search_rows[i] for i in positions]
+        self.__search_texts = [self.__search_texts[i] for i in positions]
+        self.__search_positions = dict((rowid, i) for i, rowid in enumerate(self.__search_rows))
+        self.__search_hits = [moved[i] for i in self.__search_hits if i in moved]
+    
+    def search_text(self, text, type, value):
+        # what search matches for a row; subclasses can match rows that are not in the tree yet the same way
+        return ('%s\t%s\t%s' % (text, type, value)).lower()
+    
+    def __show_search_hits(self, rows):
+        # only the paths to the hits are expanded; rows opened by an earlier search are closed again
+        for rowid in self.__shown_hits:
+            self.treeview.item(rowid, tags=())
+        paths = set()
+        for rowid in rows:
+            self.treeview.item(rowid, tags=('search',))
+            parent = self.__parents[rowid]
+            while parent != '' and parent not in paths:
+                paths.add(parent)
+                parent = self.__parents.get(parent, '')
+        for rowid in self.__opened_by_search - paths:
+            self.treeview.item(rowid, open=False)
+        for rowid in paths - self.__opened_by_search:
+            if not self.treeview.item(rowid, 'open'):
+                self.treeview.item(rowid, open=True)
+                self.__opened_by_search.add(rowid)
+        self.__opened_by_search &= paths
+        self.__shown_hits = rows
+        if len(rows) > 0:
+            self.treeview.see(rows[0])
     
     def __treeview_selected(self, event):
         rowid = self.treeview.identify_row(event.y)
@@ -269,4 +381,5 @@ class PropertyInspector(Tk.Frame):
         for rowid in self.__properties:
             if self.__properties[rowid] == property:
                 self.treeview.item(rowid, values=(property.type.name(), property.format()))
+                self.__search_texts[self.__search_positions[rowid]] = self.search_text(property.name, property.type.name(), property.format())
         property.unbind(command)
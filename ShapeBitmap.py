@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ShapeLibrary import RawShapeLibraryEntry
+import argparse
+import hashlib
+import os
+import os.path
+import weakref
+
+class BlobHandle(object):
+    CHUNK_SIZE = 1 << 16
+    handles = weakref.WeakValueDictionary()  # every live handle by id, so that the ones into a file can be detached before it is replaced
+    
+    def __init__(self, path, offset, length):
+        self.__path = path
+        self.__offset = offset
+        self.__length = length
+        self.__digest = None
+        self.__data = None
+        BlobHandle.handles[id(self)] = self
+    
+    @property
+    def path(self):
+        return self.__path
+    
+    @property
+    def offset(self):
+        return self.__offset
+    
+    def __len__(self):
+        return self.__length
+    
+    @property
+    def loaded(self):
+        # a loaded handle holds its bytes and no longer reads its file
+        return self.__data is not None
+    
+    def chunks(self, path=None):
+        # the first complete read records the digest, and every later one is checked against it
+        if self.__data is not None:
+            yield self.__data
+            return
+        sha1 = hashlib.sha1()
+        with open(self.__path if path is None else path, 'rb') as f:
+            f.seek(self.__offset)
+            remaining = self.__length
+            while remaining > 0:
+                data = f.read(min(self.CHUNK_SIZE, remaining))
+                if data == b'':
+                    raise IOError('bitmap at offset %d is truncated' % self.__offset)
+                remaining -= len(data)
+                sha1.update(data)
+                yield data
+        if self.__digest is None:
+            self.__digest = sha1.hexdigest()
+        elif sha1.hexdigest() != self.__digest:
+            raise IOError('bitmap at offset %d of %s has changed' % (self.__offset, self.__path if path is None else path))
+    
+    def read(self):
+        return b''.join(self.chunks())
+    
+    def digest(self):
+        if self.__digest is None:
+            sha1 = hashlib.sha1()
+            for data in self.chunks():
+                sha1.update(data)
+            self.__digest = sha1.hexdigest()
+        return self.__digest
+    
+    def load(self):
+        if self.__data is None:
+            self.__data = self.read()
+    
+    def relocate(self, path, offset):
+        self.__path = path
+        self.__offset = offset
+        self.__data = None
+    
+    def __eq__(self, other):
+        if not isinstance(other, BlobHandle):
+            return False
+        if not self.loaded and not other.loaded and self.__path == other.path and self.__offset == other.offset:
+            return self.__length == len(other)
+        return self.__length == len(other) and self.digest() == other.digest()
+    
+    def __hash__(self):
+        return hash((self.__length, self.digest()))
+    
+    def __setstate__(self, state):
+        # unpickled handles are registered like new ones
+        self.__dict__.update(state)
+        BlobHandle.handles[id(self)] = self
+    
+    def __repr__(self):
+        return 'BlobHandle(%r, %d, %d)' % (self.__path, self.__offset, self.__length)
+
+def detach_blobs(path, keep=()):
+    # loads every live handle into path (but those in keep) into memory, before path is replaced or removed
+    path = os.path.abspath(path)
+    keep = set(id(handle) for handle in keep)
+    for handle in list(BlobHandle.handles.values()):
+        if not handle.loaded and id(handle) not in keep and os.path.abspath(handle.path) == path:
+            handle.load()
+
+def bitmap_digest(bitmap):
+    if isinstance(bitmap, bytes):
+        return hashlib.sha1(bitmap).hexdigest()
+    return bitmap.digest()
+
+def export_bitmap(bitmap, path):
+    with open(path, 'wb') as f:
+        if isinstance(bitmap, bytes):
+            f.write(bitmap)
+        else:
+            for data in bitmap.chunks():
+                f.write(data)
+
+def import_bitmap(path):
+    return BlobHandle(path, 0, os.path.getsize(path))
+
+def image_shapes(entry):
+    if isinstance(entry, RawShapeLibraryEntry):
+        return []
+    return [shape for shape in entry.shape.walk() if shape.type == 'TMyImage']
+
+
+if __name__ == '__main__':
+    from ShapeLibraryIO import ShapeLibraryReader, ShapeLibraryWriter
+    from ShapeLibraryPack import export_path
+    
+    parser = argparse.ArgumentParser(description='Export or import TMyImage bitmaps of a LabaNotator shape library.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help='write each distinct bitmap to a .bmp file')
+    export_parser.add_argument('library')
+    export_parser.add_argument('directory')
+    import_parser = subparsers.add_parser('import', help='replace a bitmap of an entry with an image file')
+    import_parser.add_argument('library')
+    import_parser.add_argument('entry')
+    import_parser.add_argument('image')
+    import_parser.add_argument('--index', type=int, default=0, help='which TMyImage shape of the entry (default: 0)')
+    args = parser.parse_args()
+    
+    sl = ShapeLibraryReader().read(args.library)
+    if args.command == 'export':
+        os.makedirs(args.directory, exist_ok=True)
+        exported = set()
+        for entry in sl.entries:
+            for i, shape in enumerate(image_shapes(entry)):
+                digest = bitmap_digest(shape['Bitmap'])
+                if digest in exported:
+                    continue
+                exported.add(digest)
+                try:
+                    path = export_path(args.directory, '%s-%d.bmp' % (entry.name, i))
+                except ValueError:
+                    parser.error('unsafe entry name "%s"' % entry.name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                export_bitmap(shape['Bitmap'], path)
+                print(path)
+    else:
+        entries = [entry for entry in sl.entries if entry.name == args.entry]
+        if len(entries) == 0:
+            parser.error('no entry named "%s"' % args.entry)
+        shapes = image_shapes(entries[0])
+        if not 0 <= args.index < len(shapes):
+            parser.error('entry "%s" has %d TMyImage shapes' % (args.entry, len(shapes)))
+        shapes[args.index]['Bitmap'] = import_bitmap(args.image)
+        ShapeLibraryWriter().write(args.library, sl)
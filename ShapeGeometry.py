@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import math
+
+class BoundingBox(object):
+    def __init__(self, x0, y0, x1, y1):
+        self.__x0 = x0
+        self.__y0 = y0
+        self.__x1 = x1
+        self.__y1 = y1
+    
+    @classmethod
+    def of(cls, points):
+        if len(points) == 0:
+            return None
+        return cls(min(x for x, y in points), min(y for x, y in points), max(x for x, y in points), max(y for x, y in points))
+    
+    @property
+    def x0(self):
+        return self.__x0
+    
+    @property
+    def y0(self):
+        return self.__y0
+    
+    @property
+    def x1(self):
+        return self.__x1
+    
+    @property
+    def y1(self):
+        return self.__y1
+    
+    @property
+    def width(self):
+        return self.__x1 - self.__x0
+    
+    @property
+    def height(self):
+        return self.__y1 - self.__y0
+    
+    @property
+    def center(self):
+        return ((self.__x0 + self.__x1) / 2, (self.__y0 + self.__y1) / 2)
+    
+    def corners(self):
+        return [(self.__x0, self.__y0), (self.__x1, self.__y0), (self.__x1, self.__y1), (self.__x0, self.__y1)]
+    
+    def union(self, other):
+        if other is None:
+            return self
+        return BoundingBox(min(self.__x0, other.x0), min(self.__y0, other.y0), max(self.__x1, other.x1), max(self.__y1, other.y1))
+    
+    def contains(self, x, y):
+        return self.__x0 <= x <= self.__x1 and self.__y0 <= y <= self.__y1
+    
+    def intersects(self, other):
+        return self.__x0 <= other.x1 and other.x0 <= self.__x1 and self.__y0 <= other.y1 and other.y0 <= self.__y1
+    
+    def __eq__(self, other):
+        if not isinstance(other, BoundingBox):
+            return False
+        return (self.__x0, self.__y0, self.__x1, self.__y1) == (other.x0, other.y0, other.x1, other.y1)
+    
+    def __hash__(self):
+        return hash((self.__x0, self.__y0, self.__x1, self.__y1))
+    
+    def __repr__(self):
+        return 'BoundingBox(%g, %g, %g, %g)' % (self.__x0, self.__y0, self.__x1, self.__y1)
+
+def transform_points(shape, points, around=None):
+    # rotation (degrees) and flips are applied around the center of the shape's own points,
+    # or of around (points itself by default) for a shape without points, such as a group
+    own = shape.points if len(shape.points) > 0 else (points if around is None else around)
+    if len(own) == 0:
+        return []
+    cx, cy = BoundingBox.of(own).center
+    angle = math.radians(shape['Rotation'] or 0.0)
+    cos, sin = math.cos(angle), math.sin(angle)
+    sx = -1 if shape['FlipHorizontal'] else 1
+    sy = -1 if shape['FlipVertical'] else 1
+    return [(cx + (x - cx) * sx * cos - (y - cy) * sy * sin, cy + (x - cx) * sx * sin + (y - cy) * sy * cos) for x, y in points]
+
+def children_corners(shape):
+    points = []
+    for subshape in shape.children:
+        if subshape.bounds is not None:
+            points.extend(subshape.bounds.corners())
+    return points
+
+def shape_bounds(shape):
+    return BoundingBox.of(transform_points(shape, list(shape.points) + children_corners(shape)))
+
+class SpatialIndex(object):
+    MAX_CELLS_PER_ITEM = 64
+    
+    def __init__(self, cell_size=None):
+        self.__cell_size = cell_size
+        self.__items = []
+        self.__cells = None
+        self.__large = None
+    
+    @classmethod
+    def from_entry(cls, entry):
+        index = cls()
+        for shape in entry.shape.walk():
+            index.insert(shape.bounds, shape)
+        return index
+    
+    @classmethod
+    def from_library(cls, sl):
+        index = cls()
+        for entry in sl.entries:
+            if not hasattr(entry, 'shape'):
+                continue  # a RawShapeLibraryEntry kept undecoded by a tolerant reader
+            for shape in entry.shape.walk():
+                index.insert(shape.bounds, (entry, shape))
+        return index
+    
+    def __len__(self):
+        return len(self.__items)
+    
+    def insert(self, bounds, item):
+        if bounds is None:
+            return
+        self.__items.append((bounds, item))
+        self.__cells = None
+    
+    def query_point(self, x, y):
+        return [item for bounds, item in self.__candidates(x, y, x, y) if bounds.contains(x, y)]
+    
+    def query_rect(self, rect):
+        return [item for bounds, item in self.__candidates(rect.x0, rect.y0, rect.x1, rect.y1) if bounds.intersects(rect)]
+    
+    def __candidates(self, x0, y0, x1, y1):
+        if self.__cells is None:
+            self.__build()
+        i0, i1 = int(math.floor(x0 / self.__size)), int(math.floor(x1 / self.__size))
+        j0, j1 = int(math.floor(y0 / self.__size)), int(math.floor(y1 / self.__size))
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self.__items):
+            return self.__items
+        seen = set()
+        candidates = list(self.__large)
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                for number in self.__cells.get((i, j), []):
+                    if number not in seen:
+                        seen.add(number)
+                        candidates.append(self.__items[number])
+        return candidates
+    
+    def __build(self):
+        self.__size = self.__cell_size
+        if self.__size is None:
+            extents = [max(bounds.width, bounds.height) for bounds, item in self.__items]
+            self.__size = max(sum(extents) / len(extents), 1e-6) if len(extents) > 0 else 1.0
+        self.__cells = {}
+        self.__large = []
+        for number, (bounds, item) in enumerate(self.__items):
+            i0, i1 = int(math.floor(bounds.x0 / self.__size)), int(math.floor(bounds.x1 / self.__size))
+            j0, j1 = int(math.floor(bounds.y0 / self.__size)), int(math.floor(bounds.y1 / self.__size))
+            if (i1 - i0 + 1) * (j1 - j0 + 1) > self.MAX_CELLS_PER_ITEM:
+                self.__large.append((bounds, item))
+                continue
+            for i in range(i0, i1 + 1):
+                for j in range(j0, j1 + 1):
+                    self.__cells.setdefault((i, j), []).append(number)
@@ -3,6 +3,7 @@
 
 import MicrosoftLocale
 from Color import Color
+from ShapeGeometry import shape_bounds
 
 class ShapeLibrary(object):
     def __init__(self):
@@ -46,12 +47,15 @@ class ShapeLibrary(object):
         return "\n\n".join("%s" % entry for entry in self.__entries)
 
 class ShapeLibraryEntry(object):
-    def __init__(self, name, width, height, i18n_name, shape):
+    def __init__(self, name, width, height, i18n_name, shape, source=None):
         self.__name = name
         self.__width = width
         self.__height = height
         self.__i18n_name = i18n_name
         self.__shape = shape
+        self.__source = source
+        self.__dirty = source is None
+        shape.entry = self
     
     @property
     def name(self):
@@ -59,7 +63,8 @@ class ShapeLibraryEntry(object):
     
     @name.setter
     def name(self, value):
-        self.__name = name
+        self.__name = value
+        self.mark_dirty()
     
     @property
     def width(self):
@@ -68,6 +73,7 @@ class ShapeLibraryEntry(object):
     @width.setter
     def width(self, value):
         self.__width = value
+        self.mark_dirty()
     
     @property
     def height(self):
@@ -76,6 +82,7 @@ class ShapeLibraryEntry(object):
     @height.setter
     def height(self, value):
         self.__height = value
+        self.mark_dirty()
     
     @property
     def i18n_name(self):
@@ -84,24 +91,72 @@ class ShapeLibraryEntry(object):
     @i18n_name.setter
     def i18n_name(self, value):
         self.__i18n_name = value
+        self.mark_dirty()
     
     @property
     def shape(self):
         return self.__shape
     
     @property
-    def number_of_descendants(self):
-        return self.__number_of_descendants(self.__shape)
+    def source(self):
+        # the ShapeLibraryRecord the entry was read from; None for entries created in memory
+        return self.__source
+    
+    @property
+    def dirty(self):
+        # a clean entry is written by copying its source record instead of encoding it
+        return self.__dirty
+    
+    def mark_dirty(self):
+        self.__dirty = True
     
-    def __number_of_descendants(self, shape):
-        return 1 + sum(self.__number_of_descendants(subshape) for subshape in shape.children)
+    def mark_clean(self, source):
+        # called by ShapeLibraryWriter once the entry is stored at source
+        self.__source = source
+        self.__dirty = False
+    
+    @property
+    def bounds(self):
+        return self.__shape.bounds
+    
+    @property
+    def number_of_descendants(self):
+        return self.__shape.number_of_descendants
     
     def __str__(self):
         return '"%s" (%dx%d %s) %s' % (self.__name, self.__width, self.__height, self.__i18n_name, self.__shape)
 
+class RawShapeLibraryEntry(object):
+    # an entry that could not be decoded, kept as its whole record (name and length prefix included) and written back unchanged
+    def __init__(self, name, record, error=None):
+        self.__name = name
+        self.__record = record
+        self.__error = error
+    
+    @property
+    def name(self):
+        return self.__name
+    
+    @property
+    def record(self):
+        return self.__record
+    
+    @property
+    def error(self):
+        return self.__error
+    
+    def __str__(self):
+        return '"%s" (undecoded, %d bytes: %s)' % (self.__name, len(self.__record), self.__error)
+
 class Shape(object):
+    GEOMETRY_PROPERTIES = ['Points', 'Rotation', 'FlipHorizontal', 'FlipVertical', 'ChildShapes']
+    
     def __init__(self):
         self.__properties = {}
+        self.__parent = None
+        self.__bounds = None
+        self.__number_of_descendants = 1
+        self.__entry = None
     
     def __iter__(self):
         return iter(sorted(self.__properties.keys()))
@@ -112,8 +167,86 @@ class Shape(object):
         return None
     
     def __setitem__(self, name, value):
-        self.__properties[name] = value
+        if name == 'ChildShapes':
+            for subshape in self.children:
+                subshape.__parent = None
+            for subshape in value:
+                subshape.__parent = self
+            self.__properties[name] = value
+            self.__add_descendants(1 + sum(subshape.__number_of_descendants for subshape in value) - self.__number_of_descendants)
+        else:
+            self.__properties[name] = value
+        if name in self.GEOMETRY_PROPERTIES:
+            self.invalidate_bounds()
+        entry = self.entry
+        if entry is not None:
+            entry.mark_dirty()
+    
+    def _load(self, properties):
+        # for the decoder: fills a new shape without the bookkeeping of __setitem__, as it has no entry and no cached bounds yet
+        self.__properties = properties
+    
+    def _load_children(self, children):
+        # for the decoder, once the children are loaded; bottom-up, so descendant counts are summed once
+        for subshape in children:
+            subshape.__parent = self
+        self.__properties['ChildShapes'] = children
+        self.__number_of_descendants = 1 + sum(subshape.__number_of_descendants for subshape in children)
+    
+    def invalidate_bounds(self):
+        # a cached parent implies cached children, so the walk can stop at the first uncached shape
+        shape = self
+        while shape is not None and shape.__bounds is not None:
+            shape.__bounds = None
+            shape = shape.__parent
+    
+    def __add_descendants(self, delta):
+        # subtree sizes are kept up to date on the way up, so counting never walks the tree
+        shape = self
+        while shape is not None and delta != 0:
+            shape.__number_of_descendants += delta
+            shape = shape.__parent
+    
+    def walk(self):
+        stack = [self]
+        while len(stack) > 0:
+            shape = stack.pop()
+            yield shape
+            stack.extend(reversed(shape.children))
     
+    @property
+    def parent(self):
+        return self.__parent
+    
+    @property
+    def number_of_descendants(self):
+        return self.__number_of_descendants
+    
+    @property
+    def entry(self):
+        # the ShapeLibraryEntry of the tree, kept on its root
+        shape = self
+        while shape.__parent is not None:
+            shape = shape.__parent
+        return shape.__entry
+    
+    @entry.setter
+    def entry(self, value):
+        self.__entry = value
+    
+    @property
+    def bounds(self):
+        if self.__bounds is None:
+            # children first, without recursing; cached subtrees are not entered
+            pending = []
+            stack = [self]
+            while len(stack) > 0:
+                shape = stack.pop()
+                pending.append(shape)
+                stack.extend(subshape for subshape in shape.children if subshape.__bounds is None)
+            for shape in reversed(pending):
+                shape.__bounds = shape_bounds(shape)
+        return self.__bounds
     
     @property
     def type(self):
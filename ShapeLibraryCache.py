@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ShapeLibraryIO import ShapeLibraryReader
+from UserCache import user_cache_directory
+import argparse
+import hashlib
+import os
+import os.path
+import pickle
+import threading
+
+class ShapeLibraryCache(object):
+    # each snapshot holds two pickles: a small header (path, size, mtime, sha1), then the decoded ShapeLibrary
+    VERSION = 5  # 2: entries remember their source record, 3: with its digest, 4: or the file signature to take it from,
+                 # 5: bitmap handles may hold their bytes
+    MAX_BYTES = 256 << 20
+    
+    def __init__(self, directory=None, max_bytes=MAX_BYTES, reader=None, verify=False):
+        self.__directory = user_cache_directory('libraries') if directory is None else directory
+        self.__max_bytes = max_bytes
+        self.__reader = ShapeLibraryReader() if reader is None else reader
+        self.__verify = verify
+    
+    def read(self, path):
+        # the cached snapshot if it is still valid, otherwise a fresh read that is then stored
+        sl = self.load(path)
+        if sl is None:
+            stat = os.stat(path)
+            sl = self.__reader.read(path)
+            self.store(path, sl, stat)
+        return sl
+    
+    def load(self, path):
+        snapshot = self.path(path)
+        try:
+            stat = os.stat(path)
+            with open(snapshot, 'rb') as f:
+                header = pickle.load(f)
+                if not self.__is_valid(header, path, stat, snapshot):
+                    return None
+                sl = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError, TypeError, ValueError):
+            self.invalidate(path)
+            return None
+        os.utime(snapshot)  # the snapshot mtime is its last use, for the eviction order
+        return sl
+    
+    def store(self, path, sl, stat=None):
+        # stat is the state of the file when it was read; a file changed since then is not cached
+        stat = os.stat(path) if stat is None else stat
+        sha1 = self.__file_sha1(path)
+        current = os.stat(path)
+        if (current.st_size, current.st_mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            return False
+        header = {'version': self.VERSION, 'path': os.path.abspath(path), 'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha1': sha1}
+        snapshot = self.path(path)
+        temporary = '%s.%d.%d.tmp' % (snapshot, os.getpid(), threading.get_ident())
+        try:
+            with open(temporary, 'wb') as f:
+                pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(sl, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, snapshot)
+        except (RecursionError, pickle.PicklingError):
+            # extremely deep shape trees are not worth a snapshot; they are parsed every time
+            os.unlink(temporary)
+            return False
+        self.evict()
+        return True
+    
+    def invalidate(self, path):
+        try:
+            os.unlink(self.path(path))
+        except FileNotFoundError:
+            pass
+    
+    def path(self, path):
+        key = hashlib.sha1(os.path.normcase(os.path.abspath(path)).encode('utf-8')).hexdigest()
+        return os.path.join(self.__directory, key + '.pickle')
+    
+    def evict(self):
+        # least recently used snapshots go first until the cache fits max_bytes
+        snapshots = []
+        for filename in os.listdir(self.__directory):
+            if filename.endswith('.pickle'):
+                try:
+                    stat = os.stat(os.path.join(self.__directory, filename))
+                except FileNotFoundError:
+                    continue
+                snapshots.append((stat.st_mtime_ns, stat.st_size, filename))
+        total = sum(size for mtime, size, filename in snapshots)
+        for mtime, size, filename in sorted(snapshots):
+            if total <= self.__max_bytes:
+                break
+            try:
+                os.unlink(os.path.join(self.__directory, filename))
+            except FileNotFoundError:
+                pass
+            total -= size
+    
+    def clear(self):
+        for filename in os.listdir(self.__directory):
+            if filename.endswith('.pickle'):
+                os.unlink(os.path.join(self.__directory, filename))
+    
+    def __is_valid(self, header, path, stat, snapshot):
+        if not isinstance(header, dict) or header.get('version') != self.VERSION or header.get('path') != os.path.abspath(path):
+            return False
+        if header['size'] != stat.st_size:
+            return False
+        if header['mtime'] == stat.st_mtime_ns and not self.__verify:
+            return True
+        # touched but maybe not changed (copied, restored, saved unchanged): the content hash decides
+        if self.__file_sha1(path) != header['sha1']:
+            return False
+        if header['mtime'] != stat.st_mtime_ns:
+            header['mtime'] = stat.st_mtime_ns
+            self.__rewrite_header(snapshot, header)
+        return True
+    
+    def __rewrite_header(self, snapshot, header):
+        with open(snapshot, 'rb') as f:
+            pickle.load(f)
+            payload = f.read()
+        temporary = '%s.%d.%d.tmp' % (snapshot, os.getpid(), threading.get_ident())
+        with open(temporary, 'wb') as f:
+            pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+            f.write(payload)
+        os.replace(temporary, snapshot)
+    
+    def __file_sha1(self, path):
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for data in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(data)
+        return sha1.hexdigest()
+
+
+if __name__ == '__main__':
+    import time
+    
+    parser = argparse.ArgumentParser(description='Read LabaNotator shape libraries through the decoded-library cache and report the timings.')
+    parser.add_argument('libraries', nargs='*', metavar='library')
+    parser.add_argument('--clear', action='store_true', help='remove all snapshots first')
+    args = parser.parse_args()
+    
+    cache = ShapeLibraryCache()
+    if args.clear:
+        cache.clear()
+    for path in args.libraries:
+        started = time.perf_counter()
+        hit = cache.load(path)
+        if hit is None:
+            cache.read(path)
+        print('%s: %s in %.3f s' % (path, 'cache hit' if hit is not None else 'parsed and stored', time.perf_counter() - started))
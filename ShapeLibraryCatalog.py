@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ShapeLibrary import RawShapeLibraryEntry
+from ShapeLibraryIO import BufferFile, ShapeLibraryFormatError, ShapeLibraryReader, ShapeLibraryScanner, find_libraries
+import argparse
+import mmap
+import os
+import os.path
+import sqlite3
+import struct
+import sys
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS libraries (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    sha1 TEXT NOT NULL,  -- ShapeLibraryIndex.digest, of the header and entry digests
+    readonly INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    library_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    shape_count INTEGER NOT NULL,
+    sha1 TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS shapes (
+    id INTEGER PRIMARY KEY,
+    entry_id INTEGER NOT NULL,
+    parent_id INTEGER,
+    position INTEGER NOT NULL,
+    depth INTEGER NOT NULL,
+    shape_type TEXT NOT NULL,
+    shape_name TEXT,
+    shape_ref INTEGER,
+    shape_auto_number INTEGER,
+    parent_shape_ref INTEGER,
+    rotation REAL,
+    fill_color TEXT,
+    stroke_color TEXT,
+    stroke_type INTEGER,
+    stroke_width INTEGER,
+    font_name TEXT,
+    font_color TEXT,
+    font_size INTEGER,
+    text TEXT,
+    flip_horizontal INTEGER,
+    flip_vertical INTEGER,
+    bitmap_size INTEGER
+);
+CREATE TABLE IF NOT EXISTS points (
+    shape_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    x REAL NOT NULL,
+    y REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS strings (
+    library_id INTEGER NOT NULL,
+    owner TEXT NOT NULL,
+    owner_id INTEGER NOT NULL,
+    locale TEXT NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_library ON entries (library_id);
+CREATE INDEX IF NOT EXISTS entries_name ON entries (name);
+CREATE INDEX IF NOT EXISTS entries_sha1 ON entries (sha1);
+CREATE INDEX IF NOT EXISTS shapes_entry ON shapes (entry_id);
+CREATE INDEX IF NOT EXISTS shapes_type ON shapes (shape_type);
+CREATE INDEX IF NOT EXISTS shapes_name ON shapes (shape_name);
+CREATE INDEX IF NOT EXISTS points_shape ON points (shape_id);
+CREATE INDEX IF NOT EXISTS strings_library ON strings (library_id);
+CREATE INDEX IF NOT EXISTS strings_text ON strings (text);
+'''
+
+class ShapeLibraryCatalog(object):
+    def __init__(self, path):
+        self.__connection = sqlite3.connect(path)
+        self.__connection.executescript(SCHEMA)
+        self.__reader = ShapeLibraryReader(tolerant=True)  # undecodable entries are left out of the catalog
+        self.__scanner = ShapeLibraryScanner()
+    
+    def close(self):
+        self.__connection.close()
+    
+    def query(self, sql, parameters=()):
+        return self.__connection.execute(sql, parameters).fetchall()
+    
+    def refresh(self, paths):
+        # failed lists (path, message) of the libraries that could not be read; their catalog rows are left as they were
+        updated, unchanged, failed = [], [], []
+        seen = set()
+        for path in find_libraries(paths):
+            path = os.path.abspath(path)
+            seen.add(path)
+            try:
+                changed = self.__refresh_library(path)
+            except (IOError, OSError, ValueError, struct.error) as e:
+                # ShapeLibraryFormatError is an IOError; a malformed header can also fail to unpack or decode
+                failed.append((path, str(e)))
+                continue
+            if changed:
+                updated.append(path)
+            else:
+                unchanged.append(path)
+        removed = []
+        for library_id, path in self.query('SELECT id, path FROM libraries'):
+            if path not in seen and not os.path.exists(path):
+                with self.__connection:
+                    self.__delete_library(library_id)
+                removed.append(path)
+        return updated, unchanged, removed, failed
+    
+    def __refresh_library(self, path):
+        stat = os.stat(path)
+        rows = self.query('SELECT id, size, mtime, sha1 FROM libraries WHERE path = ?', (path,))
+        if len(rows) > 0 and rows[0][1] == stat.st_size and rows[0][2] == stat.st_mtime:
+            return False
+        # scanned and decoded from one mapping of the file; the scan's digests tell whether it changed at all
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise ShapeLibraryFormatError('bad magic', 0)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                index = self.__scanner.scan_buffer(path, buffer)
+                sha1 = index.digest
+                if len(rows) > 0 and rows[0][3] == sha1:
+                    with self.__connection:
+                        self.__connection.execute('UPDATE libraries SET size = ?, mtime = ? WHERE id = ?', (stat.st_size, stat.st_mtime, rows[0][0]))
+                    return False
+                sl = self.__reader.read(path, file=BufferFile(buffer))
+                self.__reader.diagnostics.clear()  # the skipped entries are simply missing from the catalog
+        digests = [record.digest for record in index.records]
+        with self.__connection:
+            if len(rows) > 0:
+                self.__delete_library(rows[0][0])
+            self.__insert_library(path, stat, sha1, sl, digests)
+        return True
+    
+    def __delete_library(self, library_id):
+        execute = self.__connection.execute
+        execute('DELETE FROM points WHERE shape_id IN (SELECT shapes.id FROM shapes JOIN entries ON shapes.entry_id = entries.id WHERE entries.library_id = ?)', (library_id,))
+        execute('DELETE FROM shapes WHERE entry_id IN (SELECT id FROM entries WHERE library_id = ?)', (library_id,))
+        execute('DELETE FROM entries WHERE library_id = ?', (library_id,))
+        execute('DELETE FROM strings WHERE library_id = ?', (library_id,))
+        execute('DELETE FROM libraries WHERE id = ?', (library_id,))
+    
+    def __insert_library(self, path, stat, sha1, sl, digests):
+        # ids are allocated here so that parent links and points can be inserted in bulk
+        cursor = self.__connection.execute('INSERT INTO libraries (path, size, mtime, sha1, readonly) VALUES (?, ?, ?, ?, ?)', (path, stat.st_size, stat.st_mtime, sha1, int(sl.readonly)))
+        library_id = cursor.lastrowid
+        entry_id = self.query('SELECT COALESCE(MAX(id), 0) FROM entries')[0][0]
+        shape_id = self.query('SELECT COALESCE(MAX(id), 0) FROM shapes')[0][0]
+        entries, shapes, points, strings = [], [], [], []
+        strings.extend((library_id, 'library', library_id, locale.name, sl.name[locale]) for locale in sl.name)
+        for position, entry in enumerate(sl.entries):
+            if isinstance(entry, RawShapeLibraryEntry):
+                continue  # undecoded; its position stays unused
+            entry_id += 1
+            entries.append((entry_id, library_id, position, entry.name, entry.width, entry.height, entry.number_of_descendants, digests[position]))
+            strings.extend((library_id, 'entry', entry_id, locale.name, entry.i18n_name[locale]) for locale in entry.i18n_name)
+            stack = [(entry.shape, None, 0, 0)]
+            while len(stack) > 0:
+                shape, parent_id, index, depth = stack.pop()
+                shape_id += 1
+                shapes.append(self.__shape_row(shape_id, entry_id, parent_id, index, depth, shape))
+                points.extend((shape_id, i, x, y) for i, (x, y) in enumerate(shape.points))
+                if shape['_Reserved23'] is not None:
+                    strings.extend((library_id, 'shape', shape_id, locale.name, shape['_Reserved23'][locale]) for locale in shape['_Reserved23'])
+                stack.extend((subshape, shape_id, i, depth + 1) for i, subshape in reversed(list(enumerate(shape.children))))
+        executemany = self.__connection.executemany
+        executemany('INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)', entries)
+        executemany('INSERT INTO shapes VALUES (%s)' % ', '.join(['?'] * 22), shapes)
+        executemany('INSERT INTO points VALUES (?, ?, ?, ?)', points)
+        executemany('INSERT INTO strings VALUES (?, ?, ?, ?, ?)', strings)
+    
+    def __shape_row(self, shape_id, entry_id, parent_id, position, depth, shape):
+        def hex(color):
+            return None if color is None else color.hex()
+        bitmap = shape['Bitmap']
+        return (shape_id, entry_id, parent_id, position, depth, shape.type, shape.name,
+            shape['ShapeRef'], shape['ShapeAutoNumber'], shape['ParentShapeRef'], shape['Rotation'],
+            hex(shape['FillColor']), hex(shape['StrokeColor']), shape['StrokeType'], shape['StrokeWidth'],
+            shape['FontName'], hex(shape['FontColor']), shape['FontSize'], shape['Text'],
+            shape['FlipHorizontal'], shape['FlipVertical'], None if bitmap is None else len(bitmap))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load LabaNotator shape libraries into a SQLite catalog, reprocessing only changed files.')
+    parser.add_argument('database')
+    parser.add_argument('paths', nargs='*', metavar='path', help='.lib files or directories to catalog')
+    parser.add_argument('--query', help='SQL to run against the catalog after refreshing')
+    args = parser.parse_args()
+    
+    catalog = ShapeLibraryCatalog(args.database)
+    try:
+        updated, unchanged, removed, failed = catalog.refresh(args.paths)
+        for path, message in failed:
+            print('%s: %s' % (path, message), file=sys.stderr)
+        print('%d updated, %d unchanged, %d removed, %d failed' % (len(updated), len(unchanged), len(removed), len(failed)))
+        if args.query is not None:
+            for row in catalog.query(args.query):
+                print('\t'.join(str(value) for value in row))
+    finally:
+        catalog.close()
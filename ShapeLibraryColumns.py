@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ShapeLibraryIO import ShapeLibraryFormatError, ShapeLibraryScanner, find_libraries
+from ShapeLibraryLayout import TAIL_LENGTHS, ShapeLayoutParser
+import argparse
+import array
+import mmap
+import os
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SHAPE_TYPES = list(TAIL_LENGTHS)  # the type column holds indexes into this list
+
+FLIP_HORIZONTAL = 0x01
+FLIP_VERTICAL = 0x02
+LOCKED = 0x04
+ROTATABLE = 0x08
+RESIZABLE = 0x10
+PARENT_CENTER = 0x20
+
+class ShapeColumns(object):
+    # every shape of the libraries added as one row of parallel typed arrays; colors are 0xRRGGBB,
+    # parent is a row number (-1 for entry roots) and points_start/points_count count points (x, y pairs) into the shared points buffer
+    COLUMNS = [
+        ('entry', 'i'),
+        ('type', 'b'),
+        ('depth', 'i'),
+        ('parent', 'i'),
+        ('rotation', 'f'),
+        ('fill_color', 'I'),
+        ('font_color', 'I'),
+        ('font_size', 'i'),
+        ('text_style', 'b'),
+        ('stroke_color', 'I'),
+        ('stroke_type', 'b'),
+        ('stroke_width', 'i'),
+        ('flags', 'B'),
+        ('points_start', 'q'),
+        ('points_count', 'i'),
+    ]
+    
+    def __init__(self):
+        self.__columns = dict((name, array.array(typecode)) for name, typecode in self.COLUMNS)
+        self.__points = array.array('f')  # x0, y0, x1, y1, ...
+        self.__libraries = []
+        self.__entries = []  # (library, entry name) per entry row
+        self.__errors = []  # (path, message) of the libraries build skipped
+        self.__parser = ShapeLayoutParser()
+        self.__scanner = ShapeLibraryScanner(digests=False)
+    
+    @classmethod
+    def build(cls, paths):
+        # paths are .lib files or directories; unreadable libraries are skipped and listed in errors
+        columns = cls()
+        for path in find_libraries(paths):
+            try:
+                columns.add_library(path)
+            except (IOError, OSError) as e:
+                columns.errors.append((path, str(e)))
+        return columns
+    
+    def add_library(self, path):
+        # decodes straight from the mapped file; no Shape objects are created
+        # rows go to separate arrays first, so that a library that fails halfway leaves nothing behind
+        columns = dict((name, array.array(typecode)) for name, typecode in self.COLUMNS)
+        points = array.array('f')
+        entries = []
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise ShapeLibraryFormatError('bad magic', 0)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                index = self.__scanner.scan_buffer(path, buffer)
+                for record in index.records:
+                    self.__add_entry(buffer, record, columns, points, entries)
+        self.__libraries.append(path)
+        self.__entries.extend(entries)
+        for name, values in columns.items():
+            self.__columns[name].extend(values)
+        self.__points.extend(points)
+    
+    @property
+    def libraries(self):
+        return self.__libraries
+    
+    @property
+    def entries(self):
+        return self.__entries
+    
+    @property
+    def errors(self):
+        return self.__errors
+    
+    @property
+    def points(self):
+        return self.__points
+    
+    def column(self, name):
+        return self.__columns[name]
+    
+    def view(self, name):
+        # a numpy array sharing the column's memory; the column cannot grow while the view is alive
+        if numpy is None:
+            raise ImportError('numpy is not installed')
+        values = self.__points if name == 'points' else self.__columns[name]
+        return numpy.frombuffer(values, dtype=values.typecode)
+    
+    def shape_points(self, row):
+        start = self.__columns['points_start'][row]
+        values = self.__points[2 * start:2 * (start + self.__columns['points_count'][row])]
+        return list(zip(values[0::2], values[1::2]))
+    
+    def type_code(self, type):
+        return SHAPE_TYPES.index(type)
+    
+    def type_counts(self):
+        counts = [0] * len(SHAPE_TYPES)
+        if numpy is not None:
+            counts = numpy.bincount(self.view('type'), minlength=len(SHAPE_TYPES)).tolist()
+        else:
+            for code in self.__columns['type']:
+                counts[code] += 1
+        return dict((type, count) for type, count in zip(SHAPE_TYPES, counts) if count > 0)
+    
+    def __len__(self):
+        return len(self.__columns['type'])
+    
+    def __add_entry(self, buffer, record, columns, points, entries):
+        # row numbers and point positions count the rows already in the table
+        entry = self.__parser.parse_entry(buffer, record.contents_offset, record.length)
+        entry_row = len(self.__entries) + len(entries)
+        entries.append((len(self.__libraries), record.name))
+        first = len(self) + len(columns['type'])
+        for shape in entry.shapes:
+            flip_horizontal, flip_vertical = shape.flips(buffer)
+            locked, rotatable, resizable, parent_center = shape.options(buffer)
+            columns['entry'].append(entry_row)
+            columns['type'].append(SHAPE_TYPES.index(shape.type))
+            columns['depth'].append(shape.depth)
+            columns['parent'].append(-1 if shape.parent < 0 else first + shape.parent)
+            columns['rotation'].append(shape.rotation(buffer))
+            columns['fill_color'].append(self.__pack_color(shape.fill_color(buffer)))
+            columns['font_color'].append(self.__pack_color(shape.font_color(buffer)))
+            columns['font_size'].append(shape.font_size(buffer))
+            columns['text_style'].append(shape.text_style(buffer))
+            columns['stroke_color'].append(self.__pack_color(shape.stroke_color(buffer)))
+            columns['stroke_type'].append(shape.stroke_type(buffer))
+            columns['stroke_width'].append(shape.stroke_width(buffer))
+            columns['flags'].append(
+                (FLIP_HORIZONTAL if flip_horizontal else 0) | (FLIP_VERTICAL if flip_vertical else 0) |
+                (LOCKED if locked else 0) | (ROTATABLE if rotatable else 0) |
+                (RESIZABLE if resizable else 0) | (PARENT_CENTER if parent_center else 0))
+            columns['points_start'].append((len(self.__points) + len(points)) // 2)
+            columns['points_count'].append(shape.points_count)
+            self.__add_points(buffer, shape.points_offset, shape.points_count, points)
+    
+    def __add_points(self, buffer, offset, count, points):
+        # the file stores little-endian float32 pairs, which are copied as they are
+        values = array.array('f')
+        values.frombytes(buffer[offset:offset + 8 * count])
+        if sys.byteorder == 'big':
+            values.byteswap()
+        points.extend(values)
+    
+    def __pack_color(self, rgb):
+        return (rgb[0] << 16) | (rgb[1] << 8) | rgb[2]
+
+
+if __name__ == '__main__':
+    import time
+    
+    parser = argparse.ArgumentParser(description='Load every shape of LabaNotator shape libraries into a columnar table and print a summary.')
+    parser.add_argument('paths', nargs='+', metavar='path', help='.lib file or directory')
+    args = parser.parse_args()
+    
+    started = time.perf_counter()
+    columns = ShapeColumns.build(args.paths)
+    for path, message in columns.errors:
+        print('%s: %s' % (path, message), file=sys.stderr)
+    print('%d libraries, %d entries, %d shapes, %d points in %.3f s' % (len(columns.libraries), len(columns.entries), len(columns), len(columns.points) // 2, time.perf_counter() - started))
+    for type, count in sorted(columns.type_counts().items()):
+        print('    %s: %d' % (type, count))
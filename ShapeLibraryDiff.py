@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ShapeLibraryIO import ShapeLibraryScanner, ShapeLibraryReader
+import argparse
+import bisect
+import sys
+
+class EntryChange(object):
+    ADDED = 'added'
+    REMOVED = 'removed'
+    MOVED = 'moved'
+    CHANGED = 'changed'
+    
+    def __init__(self, kind, name, old_index, new_index, differences=None):
+        self.__kind = kind
+        self.__name = name
+        self.__old_index = old_index
+        self.__new_index = new_index
+        self.__differences = [] if differences is None else differences
+    
+    @property
+    def kind(self):
+        return self.__kind
+    
+    @property
+    def name(self):
+        return self.__name
+    
+    @property
+    def old_index(self):
+        return self.__old_index
+    
+    @property
+    def new_index(self):
+        return self.__new_index
+    
+    @property
+    def differences(self):
+        return self.__differences
+    
+    def __repr__(self):
+        return 'EntryChange(%r, %r, %r, %r)' % (self.__kind, self.__name, self.__old_index, self.__new_index)
+
+def record_keys(records):
+    # entries are matched by name; repeated names are told apart by their occurrence number
+    occurrences = {}
+    keys = []
+    for record in records:
+        occurrences[record.name] = occurrences.get(record.name, 0) + 1
+        keys.append((record.name, occurrences[record.name]))
+    return keys
+
+def longest_increasing_subsequence(values):
+    tails, tail_indices, previous = [], [], [None] * len(values)
+    for i, value in enumerate(values):
+        j = bisect.bisect_left(tails, value)
+        if j > 0:
+            previous[i] = tail_indices[j - 1]
+        if j == len(tails):
+            tails.append(value)
+            tail_indices.append(i)
+        else:
+            tails[j] = value
+            tail_indices[j] = i
+    result = set()
+    i = tail_indices[-1] if len(tail_indices) > 0 else None
+    while i is not None:
+        result.add(i)
+        i = previous[i]
+    return result
+
+def diff_values(path, old, new, differences):
+    if old == new:
+        return
+    if hasattr(old, 'children') and hasattr(new, 'children'):
+        diff_shapes(path, old, new, differences)
+    elif isinstance(old, list) and isinstance(new, list) and any(hasattr(value, 'children') for value in old[:1] + new[:1]):
+        if len(old) != len(new):
+            differences.append(('%s.length' % path, len(old), len(new)))
+        for i in range(min(len(old), len(new))):
+            diff_values('%s[%d]' % (path, i), old[i], new[i], differences)
+    else:
+        differences.append((path, old, new))
+
+def diff_shapes(path, old, new, differences):
+    for key in sorted(set(old) | set(new)):
+        diff_values(key if path == '' else '%s.%s' % (path, key), old[key], new[key], differences)
+    return differences
+
+def diff_entries(old, new):
+    differences = []
+    for name, old_value, new_value in [('Width', old.width, new.width), ('Height', old.height, new.height), ('I18nName', old.i18n_name, new.i18n_name)]:
+        diff_values(name, old_value, new_value, differences)
+    diff_shapes('Shape', old.shape, new.shape, differences)
+    return differences
+
+def diff_indexes(old, new, reader=None):
+    reader = ShapeLibraryReader() if reader is None else reader
+    old_positions = dict((key, i) for i, key in enumerate(record_keys(old.records)))
+    changes = []
+    matches = []
+    for j, key in enumerate(record_keys(new.records)):
+        i = old_positions.pop(key, None)
+        if i is None:
+            changes.append(EntryChange(EntryChange.ADDED, key[0], None, j))
+        else:
+            matches.append((i, j))
+    for key, i in old_positions.items():
+        changes.append(EntryChange(EntryChange.REMOVED, key[0], i, None))
+    in_order = longest_increasing_subsequence([i for i, j in matches])
+    for n, (i, j) in enumerate(matches):
+        old_record, new_record = old.records[i], new.records[j]
+        if n not in in_order:
+            changes.append(EntryChange(EntryChange.MOVED, new_record.name, i, j))
+        if old_record.digest != new_record.digest:
+            # only entries whose bytes differ are decoded
+            differences = diff_entries(reader.read_record(old_record), reader.read_record(new_record))
+            changes.append(EntryChange(EntryChange.CHANGED, new_record.name, i, j, differences))
+    changes.sort(key=lambda change: (change.new_index if change.new_index is not None else change.old_index, change.kind))
+    return changes
+
+def diff_libraries(old_path, new_path):
+    scanner = ShapeLibraryScanner()
+    return diff_indexes(scanner.scan(old_path), scanner.scan(new_path))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the entries of two LabaNotator shape libraries.')
+    parser.add_argument('old')
+    parser.add_argument('new')
+    args = parser.parse_args()
+    
+    scanner = ShapeLibraryScanner()
+    old, new = scanner.scan(args.old), scanner.scan(args.new)
+    changes = diff_indexes(old, new)
+    if old.header_digest != new.header_digest:
+        print('! library header (name or read-only flag) differs')
+    for change in changes:
+        if change.kind == EntryChange.ADDED:
+            print('+ %s (#%d)' % (change.name, change.new_index))
+        elif change.kind == EntryChange.REMOVED:
+            print('- %s (#%d)' % (change.name, change.old_index))
+        elif change.kind == EntryChange.MOVED:
+            print('> %s (#%d -> #%d)' % (change.name, change.old_index, change.new_index))
+        else:
+            print('* %s (#%d)' % (change.name, change.new_index))
+            for path, old_value, new_value in change.differences:
+                print('    %s: %s -> %s' % (path, old_value, new_value))
+    sys.exit(1 if len(changes) > 0 or old.header_digest != new.header_digest else 0)
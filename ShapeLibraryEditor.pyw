@@ -3,8 +3,12 @@
 
 import tkinter as Tk
 from tkinter import filedialog
+from tkinter.messagebox import showwarning
 from ShapeLibrary import *
 from ShapeLibraryIO import *
+from ShapeLibraryCache import ShapeLibraryCache
+from ShapeThumbnail import ThumbnailCache
+import base64
 import os.path
 
 class ScrollableListbox(Tk.Frame):
@@ -29,6 +33,13 @@ class ShapeLibraryEntryList(Tk.Frame):
         self.__scrollable_listbox = ScrollableListbox(self)
         self.__scrollable_listbox.listbox.configure(activestyle=Tk.NONE)
         self.__scrollable_listbox.pack(side=Tk.TOP, fill=Tk.BOTH, expand=True)
+        self.__scrollable_listbox.listbox.bind("<<ListboxSelect>>", self.__show_preview)
+        
+        self.__preview_image = None
+        self.__preview_label = Tk.Label(self)
+        self.__preview_label.pack(side=Tk.TOP)
+        self.__thumbnail_cache = ThumbnailCache()
+        self.__dispatch_thumbnails()
         
         self.__open_button = Tk.Button(self, text='Open...')
         self.__open_button.pack(side=Tk.LEFT, padx=5, pady=5)
@@ -82,11 +93,16 @@ class ShapeLibraryEntryList(Tk.Frame):
         if path == '':
             return
         self.__path = path
-        reader = ShapeLibraryReader()
-        self.__shape_library = reader.read(self.__path)
+        # an unchanged file is reopened from its decoded snapshot
+        self.__shape_library = ShapeLibraryCache(reader=ShapeLibraryReader(tolerant=True)).read(self.__path)
         self.__scrollable_listbox.listbox.delete(0, Tk.END)
         self.__scrollable_listbox.listbox.insert(Tk.END, *[entry.name for entry in self.__shape_library.entries])
         self.__name_label.configure(text=self.__path)
+        for entry in self.__shape_library.entries:
+            self.__thumbnail_cache.request(entry)
+        raw_entries = [entry for entry in self.__shape_library.entries if isinstance(entry, RawShapeLibraryEntry)]
+        if len(raw_entries) > 0:
+            showwarning('Undecoded entries', '%d entries could not be decoded. They are kept unchanged when the library is saved.\n\n%s' % (len(raw_entries), '\n'.join('%s: %s' % (entry.name, entry.error) for entry in raw_entries)))
     
     def __save_file(self, event):
         if self.__path == None:
@@ -104,6 +120,24 @@ class ShapeLibraryEntryList(Tk.Frame):
         self.__path = path
         self.__save_file(event)
     
+    def __dispatch_thumbnails(self):
+        self.__thumbnail_cache.dispatch()
+        self.after(100, self.__dispatch_thumbnails)
+    
+    def __show_preview(self, event):
+        index = self.get_selected_index()
+        if index == None:
+            return
+        entry = self.get_entry(index)
+        self.__thumbnail_cache.request(entry, lambda png: self.__set_preview(entry, png))
+    
+    def __set_preview(self, entry, png):
+        index = self.get_selected_index()
+        if index == None or self.get_entry(index) is not entry:
+            return
+        self.__preview_image = Tk.PhotoImage(data=base64.b64encode(png))
+        self.__preview_label.configure(image=self.__preview_image)
+    
     def __move_up(self, event):
         selected_index = self.get_selected_index()
         if selected_index == None or selected_index == 0:
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ShapeLibraryIO import ShapeLibraryReader, ShapeLibraryScanner, find_libraries
+import argparse
+import collections
+import threading
+
+class EntryCacheStats(object):
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @property
+    def hit_ratio(self):
+        requests = self.hits + self.misses
+        return 0.0 if requests == 0 else self.hits / requests
+    
+    def to_dict(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'hit_ratio': self.hit_ratio}
+    
+    def __str__(self):
+        return '%d hits, %d misses (%.1f%% hit ratio), %d evictions' % (self.hits, self.misses, 100.0 * self.hit_ratio, self.evictions)
+
+class ShapeLibraryEntryCache(object):
+    # decoded entries keyed by record (path, offset, name, digest); the least recently used clean ones are dropped
+    # beyond the budget and decoded again from their record on the next access, pinned and dirty (edited) ones are always kept
+    MAX_BYTES = 64 << 20
+    SHAPE_BYTES = 2048  # rough memory of one decoded Shape beyond its encoded bytes, measured with tracemalloc
+    
+    def __init__(self, max_entries=None, max_bytes=MAX_BYTES, reader=None):
+        # None for either budget means no limit of that kind
+        self.__max_entries = max_entries
+        self.__max_bytes = max_bytes
+        self.__reader = ShapeLibraryReader() if reader is None else reader
+        self.__entries = collections.OrderedDict()
+        self.__pinned = set()
+        self.__bytes = 0
+        self.__lock = threading.RLock()
+        self.__stats = EntryCacheStats()
+    
+    @property
+    def stats(self):
+        return self.__stats
+    
+    @property
+    def size(self):
+        # estimated bytes held, see SHAPE_BYTES
+        return self.__bytes
+    
+    def get(self, record):
+        # safe to call from several threads; two threads missing the same record both decode it
+        return self.__get(record, False)
+    
+    def pin(self, record):
+        # edited entries are kept anyway while they are dirty; this keeps one regardless
+        return self.__get(record, True)
+    
+    def peek(self, record):
+        # the cached entry or None; nothing is decoded or counted
+        with self.__lock:
+            cached = self.__entries.get(self.key(record))
+            return None if cached is None else cached[0]
+    
+    def put(self, record, entry):
+        # an entry that is now stored at record, such as one a writer has just saved there
+        with self.__lock:
+            key = self.key(record)
+            cached = self.__entries.pop(key, None)
+            if cached is not None:
+                self.__bytes -= cached[1]
+            self.__add(key, entry, self.estimate(record, entry))
+    
+    def unpin(self, record):
+        with self.__lock:
+            self.__pinned.discard(self.key(record))
+            self.__evict()
+    
+    def is_pinned(self, record):
+        key = self.key(record)
+        return key in self.__pinned or self.__is_dirty(key)
+    
+    def discard(self, record):
+        with self.__lock:
+            key = self.key(record)
+            self.__pinned.discard(key)
+            cached = self.__entries.pop(key, None)
+            if cached is not None:
+                self.__bytes -= cached[1]
+    
+    def clear(self):
+        # pinned and dirty entries stay
+        with self.__lock:
+            for key in list(self.__entries):
+                if key not in self.__pinned and not self.__is_dirty(key):
+                    self.__bytes -= self.__entries.pop(key)[1]
+    
+    def key(self, record):
+        # the digest covers the contents only, so a renamed entry needs the name to be told apart
+        return (record.path, record.offset, record.name, record.digest)
+    
+    def estimate(self, record, entry):
+        if not hasattr(entry, 'number_of_descendants'):
+            return record.length  # a RawShapeLibraryEntry from a tolerant reader is just its bytes
+        return record.length + self.SHAPE_BYTES * entry.number_of_descendants
+    
+    def __contains__(self, record):
+        return self.key(record) in self.__entries
+    
+    def __len__(self):
+        return len(self.__entries)
+    
+    def __get(self, record, pin):
+        key = self.key(record)
+        with self.__lock:
+            cached = self.__entries.get(key)
+            if cached is not None:
+                self.__entries.move_to_end(key)
+                self.__stats.hits += 1
+                if pin:
+                    self.__pinned.add(key)
+                return cached[0]
+            self.__stats.misses += 1
+        entry = self.__reader.read_record(record)
+        with self.__lock:
+            cached = self.__entries.get(key)
+            if cached is not None:
+                entry = cached[0]  # decoded meanwhile by another thread
+            if pin:
+                self.__pinned.add(key)
+            if cached is None:
+                self.__add(key, entry, self.estimate(record, entry))
+        return entry
+    
+    def __add(self, key, entry, size):
+        self.__entries[key] = (entry, size)
+        self.__bytes += size
+        self.__evict()
+    
+    def __evict(self):
+        for key in list(self.__entries):
+            if not self.__over_budget():
+                break
+            if key in self.__pinned or self.__is_dirty(key):
+                continue
+            self.__bytes -= self.__entries.pop(key)[1]
+            self.__stats.evictions += 1
+    
+    def __is_dirty(self, key):
+        cached = self.__entries.get(key)
+        return cached is not None and getattr(cached[0], 'dirty', False)  # RawShapeLibraryEntry has no dirty flag
+    
+    def __over_budget(self):
+        return (self.__max_entries is not None and len(self.__entries) > self.__max_entries) or (self.__max_bytes is not None and self.__bytes > self.__max_bytes)
+
+
+if __name__ == '__main__':
+    import random
+    import time
+    
+    parser = argparse.ArgumentParser(description='Access the entries of LabaNotator shape libraries at random through a bounded entry cache and report hits, misses and evictions.')
+    parser.add_argument('paths', nargs='+', metavar='path', help='.lib file or directory')
+    parser.add_argument('--max-entries', type=int, default=None, help='number of decoded entries kept (default: no limit)')
+    parser.add_argument('--max-megabytes', type=float, default=ShapeLibraryEntryCache.MAX_BYTES / (1 << 20), help='estimated memory of the decoded entries kept (default: 64)')
+    parser.add_argument('--accesses', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    
+    scanner = ShapeLibraryScanner()
+    records = [record for path in find_libraries(args.paths) for record in scanner.scan(path).records]
+    cache = ShapeLibraryEntryCache(args.max_entries, int(args.max_megabytes * (1 << 20)))
+    generator = random.Random(args.seed)
+    started = time.perf_counter()
+    for i in range(args.accesses if len(records) > 0 else 0):
+        cache.get(generator.choice(records))
+    print('%d records, %d accesses in %.3f s' % (len(records), args.accesses, time.perf_counter() - started))
+    print('%s; %d entries (%.1f MB estimated) cached' % (cache.stats, len(cache), cache.size / (1 << 20)))
@@ -3,13 +3,31 @@
 
 from ShapeLibrary import *
 from MicrosoftLocale import Locale, I18nText
+from ShapeBitmap import BlobHandle, detach_blobs
 import struct
 import math
 import io
 import os
 import os.path
+import hashlib
+import mmap
+import time
+
+class ShapeLibraryFormatError(IOError):
+    def __init__(self, message, offset=None):
+        self.reason = message
+        if offset is not None:
+            message = '%s at offset %d' % (message, offset)
+        IOError.__init__(self, message)
+        self.offset = offset
 
 class ShapeLibraryStreamReader(io.BufferedReader):
+    def __init__(self, raw, path=None, signature=None):
+        # signature is the file_signature of path when reading started
+        io.BufferedReader.__init__(self, raw)
+        self.path = path
+        self.signature = signature
+    
     def read_int8(self):
         return struct.unpack('b', self.read(1))[0]
     
@@ -31,6 +49,12 @@ class ShapeLibraryStreamReader(io.BufferedReader):
         length = struct.unpack('<q', self.read(8))[0]
         return self.read(length)
     
+    def read_blob64(self):
+        length = struct.unpack('<q', self.read(8))[0]
+        offset = self.tell()
+        self.seek(offset + length)
+        return BlobHandle(self.path, offset, length)
+    
     def read_color_rgb(self):
         return Color(struct.unpack('BBB', self.read(3)))
     
@@ -72,6 +96,13 @@ class ShapeLibraryStreamWriter(io.BufferedWriter):
         self.write(struct.pack('<q', len(value)))
         self.write(value)
     
+    def write_blob64(self, value, path=None):
+        if isinstance(value, bytes):
+            return self.write_pascal64(value)
+        self.write(struct.pack('<q', len(value)))
+        for data in value.chunks(path):
+            self.write(data)
+    
     def write_color_rgb(self, value):
         return self.write(struct.pack('BBB', *value.components()))
     
@@ -87,154 +118,663 @@ class ShapeLibraryStreamWriter(io.BufferedWriter):
         return True  # todo
 
 
-class ShapeLibraryReader(object):
-    def read(self, path):
-        sl = ShapeLibrary()
+def file_signature(path):
+    # size and modification time, to tell whether a file is still the one that was read; None if it cannot be stat'ed
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+class ShapeLibraryRecord(object):
+    def __init__(self, path, name, offset, contents_offset, length, digest=None, signature=None):
+        # without a digest, a record with the file_signature of path is hashed on first use, as long as the file still has that signature
+        self.__path = path
+        self.__name = name
+        self.__offset = offset
+        self.__contents_offset = contents_offset
+        self.__length = length
+        self.__digest = digest
+        self.__signature = signature
+    
+    @property
+    def path(self):
+        return self.__path
+    
+    @property
+    def name(self):
+        return self.__name
+    
+    @property
+    def offset(self):
+        return self.__offset
+    
+    @property
+    def contents_offset(self):
+        return self.__contents_offset
+    
+    @property
+    def length(self):
+        return self.__length
+    
+    @property
+    def end(self):
+        return self.__contents_offset + self.__length
+    
+    @property
+    def digest(self):
+        if self.__digest is None and self.__signature is not None:
+            self.__digest = self.__read_digest()
+            self.__signature = None
+        return self.__digest
+    
+    def check(self, contents):
+        # whether contents, just read from the record's place in the file, are still what the record was taken from
+        if self.__digest is None:
+            if self.__signature is None or file_signature(self.__path) != self.__signature:
+                return False
+            self.__digest = hashlib.sha1(contents).hexdigest()
+            self.__signature = None
+            return True
+        return hashlib.sha1(contents).hexdigest() == self.__digest
+    
+    def __read_digest(self):
+        if file_signature(self.__path) != self.__signature:
+            return None
+        sha1 = hashlib.sha1()
+        try:
+            with open(self.__path, 'rb') as f:
+                f.seek(self.__contents_offset)
+                remaining = self.__length
+                while remaining > 0:
+                    data = f.read(min(remaining, ShapeLibraryReader.CHUNK_SIZE))
+                    if data == b'':
+                        return None
+                    sha1.update(data)
+                    remaining -= len(data)
+        except (IOError, OSError):
+            return None
+        return sha1.hexdigest()
+    
+    def read(self, path=None):
+        # the whole record, name and length prefix included, exactly as stored in the file (or in path, a copy of it)
+        with open(self.__path if path is None else path, 'rb') as f:
+            f.seek(self.__offset)
+            return f.read(self.end - self.__offset)
+    
+    def __repr__(self):
+        return 'ShapeLibraryRecord(%r, %r, %d, %d)' % (self.__path, self.__name, self.__offset, self.__length)
+
+class ShapeLibraryIndex(object):
+    def __init__(self, path, size, header_length, header_digest, records):
+        self.__path = path
+        self.__size = size
+        self.__header_length = header_length
+        self.__header_digest = header_digest
+        self.__records = records
+    
+    @property
+    def path(self):
+        return self.__path
+    
+    @property
+    def size(self):
+        return self.__size
+    
+    @property
+    def header_length(self):
+        return self.__header_length
+    
+    @property
+    def header_digest(self):
+        return self.__header_digest
+    
+    @property
+    def records(self):
+        return self.__records
+    
+    @property
+    def digest(self):
+        # of the header and every entry, for an index scanned with digests; equal for files with the same contents
+        sha1 = hashlib.sha1(self.__header_digest.encode('ascii'))
+        for record in self.__records:
+            sha1.update(record.name.encode('iso-8859-1') + b'\0' + record.digest.encode('ascii'))
+        return sha1.hexdigest()
+
+class ShapeLibraryScanner(object):
+    # walks the entry framing (name, length) without decoding anything
+    def __init__(self, digests=True):
+        self.__digests = digests
+    
+    def scan(self, path):
         with open(path, 'rb') as f:
-            reader = ShapeLibraryStreamReader(f)
-            if reader.read(10) != b'TCADLIBX.k':
-                raise IOError('bad magic')
-            sl.readonly = reader.read_int8()
-            sl.name = reader.read_i18n_text()
-            while True:
-                if reader.is_eos():
-                    break
-                entry = self.__read_shape_library_entry(reader)
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                raise ShapeLibraryFormatError('bad magic', 0)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                return self.scan_buffer(path, buffer)
+    
+    def scan_buffer(self, path, buffer, start=0, end=None):
+        end = len(buffer) if end is None else end
+        view = memoryview(buffer)
+        try:
+            if bytes(view[start:start + 10]) != b'TCADLIBX.k':
+                raise ShapeLibraryFormatError('bad magic', start)
+            position = self.skip_i18n_text(buffer, start + 11, end)
+            header_digest = hashlib.sha1(view[start:position]).hexdigest()
+            header_length = position - start
+            records = []
+            while position < end:
+                offset = position
+                length = self.__unpack('<B', buffer, position, end)[0]
+                if length > 127:
+                    raise ShapeLibraryFormatError('bad entry name length', position)
+                name = bytes(self.__slice(view, position + 1, length, end)).decode('iso-8859-1')
+                position += 1 + length
+                length = self.__unpack('<l', buffer, position, end)[0]
+                position += 4
+                if length < 0:
+                    raise ShapeLibraryFormatError('negative length of entry "%s"' % name, position - 4)
+                with self.__slice(view, position, length, end) as contents:
+                    digest = hashlib.sha1(contents).hexdigest() if self.__digests else None
+                records.append(ShapeLibraryRecord(path, name, offset, position, length, digest))
+                position += length
+            return ShapeLibraryIndex(path, end - start, header_length, header_digest, records)
+        finally:
+            view.release()
+    
+    def skip_i18n_text(self, buffer, position, end):
+        count = self.__unpack('<l', buffer, position, end)[0]
+        position += 4
+        for i in range(count * 2):
+            length = self.__unpack('<l', buffer, position, end)[0]
+            if length < 0:
+                raise ShapeLibraryFormatError('negative string length', position)
+            if position + 4 + length > end:
+                raise ShapeLibraryFormatError('string of %d bytes is truncated' % length, position + 4)
+            position += 4 + length
+        return position
+    
+    def __unpack(self, format, buffer, position, end):
+        if position + struct.calcsize(format) > end:
+            raise ShapeLibraryFormatError('unexpected end of file', position)
+        return struct.unpack_from(format, buffer, position)
+    
+    def __slice(self, view, position, length, end):
+        if position + length > end:
+            raise ShapeLibraryFormatError('record of %d bytes is truncated' % length, position)
+        return view[position:position + length]
+
+def find_libraries(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, subdirectories, filenames in os.walk(path):
+                for filename in sorted(filenames):
+                    if filename.lower().endswith('.lib'):
+                        yield os.path.join(directory, filename)
+        else:
+            yield path
+
+class BufferFile(io.RawIOBase):
+    # a read-only file over a buffer (such as an mmap) with a position of its own, for ShapeLibraryReader to read a mapped file without another handle
+    def __init__(self, buffer):
+        io.RawIOBase.__init__(self)
+        self.__buffer = buffer
+        self.__position = 0
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def readinto(self, b):
+        data = self.__buffer[self.__position:self.__position + len(b)]
+        b[:len(data)] = data
+        self.__position += len(data)
+        return len(data)
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.__position
+        elif whence == io.SEEK_END:
+            offset += len(self.__buffer)
+        if offset < 0:
+            raise ValueError('negative seek position %d' % offset)
+        self.__position = offset
+        return offset
+    
+    def tell(self):
+        return self.__position
+
+class ShapeLibraryStream(object):
+    def __init__(self, shape_library_reader, path, offset=0, length=None, file=None):
+        # offset and length select a library stored inside a larger file; file is an open file-like object of path
+        # to read from instead of opening path again, and is closed with the stream
+        self.__shape_library_reader = shape_library_reader
+        self.__file = open(path, 'rb') if file is None else file
+        self.__end = None if length is None else offset + length
+        try:
+            self.__reader = ShapeLibraryStreamReader(self.__file, path, file_signature(path))
+            self.__reader.seek(offset)
+            self.__library = shape_library_reader.read_header(self.__reader)
+        except:
+            self.__file.close()
+            raise
+    
+    @property
+    def library(self):
+        return self.__library
+    
+    def __iter__(self):
+        while not self.__reader.is_eos() and (self.__end is None or self.__reader.tell() < self.__end):
+            yield self.__shape_library_reader.read_entry(self.__reader)
+    
+    def close(self):
+        self.__file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class ShapeLibraryDiagnostic(object):
+    def __init__(self, path, offset, name, message):
+        self.path = path
+        self.offset = offset
+        self.name = name
+        self.message = message
+    
+    def __str__(self):
+        return '%s:%d: entry "%s": %s' % (self.path, self.offset, self.name, self.message)
+
+class ShapeLibraryReader(object):
+    CHUNK_SIZE = 1 << 20
+    
+    def __init__(self, stats=None, tolerant=False):
+        # a tolerant reader keeps entries it cannot decode as RawShapeLibraryEntry and records a diagnostic
+        self.__stats = stats
+        self.__tolerant = tolerant
+        self.__diagnostics = []
+    
+    @property
+    def stats(self):
+        return self.__stats
+    
+    @property
+    def tolerant(self):
+        return self.__tolerant
+    
+    @property
+    def diagnostics(self):
+        # accumulated over everything this reader has read, like stats
+        return self.__diagnostics
+    
+    def read(self, path, offset=0, length=None, file=None):
+        started = time.perf_counter()
+        with self.open(path, offset, length, file) as stream:
+            sl = stream.library
+            if self.__stats is not None:
+                self.__stats.add_time('header', time.perf_counter() - started)
+                started = time.perf_counter()
+            for entry in stream:
                 sl.add(entry)
+        if self.__stats is not None:
+            self.__stats.add_time('entries', time.perf_counter() - started)
+        return sl
+    
+    def open(self, path, offset=0, length=None, file=None):
+        return ShapeLibraryStream(self, path, offset, length, file)
+    
+    def read_record(self, record, file=None):
+        # file, as for open, is closed afterwards
+        with open(record.path, 'rb') if file is None else file as f:
+            reader = ShapeLibraryStreamReader(f, record.path, file_signature(record.path))
+            reader.seek(record.offset)
+            return self.read_entry(reader)
+    
+    def read_header(self, reader):
+        sl = ShapeLibrary()
+        start = reader.tell()
+        if reader.read(10) != b'TCADLIBX.k':
+            raise IOError('bad magic')
+        sl.readonly = reader.read_int8()
+        sl.name = reader.read_i18n_text()
+        if self.__stats is not None:
+            self.__stats.count_library(sl, reader.tell() - start)
         return sl
     
-    def __read_shape_library_entry(self, reader):
+    def read_entry(self, reader):
+        offset = reader.tell()
         name = reader.read_pascal8().decode('iso-8859-1')
-        contents = reader.read_pascal32()
-        reader = ShapeLibraryStreamReader(io.BytesIO(contents))
+        length = reader.read_int32()
+        start = reader.tell()
+        if length < 0:
+            raise ShapeLibraryFormatError('negative length of entry "%s"' % name, start - 4)
+        # the digest is only taken if it is asked for (by the writer, before it copies a clean entry back)
+        source = ShapeLibraryRecord(reader.path, name, offset, start, length, signature=reader.signature)
+        if not self.__tolerant:
+            entry = self.__read_entry_contents(reader, source)
+        else:
+            checkpoint = None if self.__stats is None else self.__stats.checkpoint()
+            try:
+                entry = self.__read_entry_contents(reader, source)
+                if reader.tell() != start + length:
+                    raise IOError('%d bytes of the record are left undecoded' % (start + length - reader.tell()))
+            except Exception as e:
+                # the length prefix still frames the record, so it is kept undecoded and reading goes on
+                reader.seek(offset)
+                entry = RawShapeLibraryEntry(name, reader.read(start + length - offset), str(e))
+                self.__diagnostics.append(ShapeLibraryDiagnostic(reader.path, offset, name, str(e)))
+                if self.__stats is not None:
+                    self.__stats.rollback(checkpoint)
+                    self.__stats.count_raw_entry(entry, len(entry.record))
+                return entry
+        reader.seek(start + length)
+        if self.__stats is not None:
+            self.__stats.count_entry(entry, 5 + len(name) + length)
+        return entry
+    
+    def __read_entry_contents(self, reader, source):
+        # decoded in place so that bitmaps can be skipped instead of loaded
         width = reader.read_int32()
         height = reader.read_int32()
         localizedName = reader.read_i18n_text()
         shapeCount = reader.read_int32()
         shape = self.__read_shape(reader)
-        return ShapeLibraryEntry(name, width, height, localizedName, shape)
+        if reader.tell() > source.end:
+            raise IOError('entry "%s" overruns its record' % source.name)
+        return ShapeLibraryEntry(source.name, width, height, localizedName, shape, source)
     
     def __read_shape(self, reader):
-        shape = Shape()
+        # shapes are stored in pre-order; an explicit stack keeps deep nesting off the call stack
+        root, childShapeCount = self.__read_counted_shape_fields(reader)
+        stack = [(root, [], childShapeCount)]
+        while len(stack) > 0:
+            shape, children, childShapeCount = stack[-1]
+            if len(children) < childShapeCount:
+                subshape, subshapeCount = self.__read_counted_shape_fields(reader)
+                children.append(subshape)
+                stack.append((subshape, [], subshapeCount))
+                continue
+            stack.pop()
+            if shape.type in ['TMyGroup', 'TMyCombine']:
+                shape._load_children(children)
+        return root
+    
+    def __read_counted_shape_fields(self, reader):
+        if self.__stats is None:
+            shape, childShapeCount = self.__read_shape_fields(reader)
+        else:
+            start = reader.tell()
+            shape, childShapeCount = self.__read_shape_fields(reader)
+            self.__stats.count_shape(shape, reader.tell() - start)
+        if shape.type not in ['TMyGroup', 'TMyCombine']:
+            childShapeCount = 0
+        return shape, childShapeCount
+    
+    def __read_shape_fields(self, reader):
+        # everything but the child shapes, which follow the fields of a group or combine
+        properties = {}
         shapeType = reader.read(16).decode('iso-8859-1').rstrip()
-        shape['ShapeType'] = shapeType
-        shape['_Reserved01'] = reader.read(4)  #  00 00 00 00
-        shape['ShapeAutoNumber'] = reader.read_int32()
-        shape['ShapeRef'] = reader.read_int32()
-        shape['_Reserved02'] = reader.read(4) #  00 00 00 00
-        shape['ParentShapeRef'] = reader.read_int32()  # root = -1, child = parent shape ref
+        properties['ShapeType'] = shapeType
+        properties['_Reserved01'] = reader.read(4)  #  00 00 00 00
+        properties['ShapeAutoNumber'] = reader.read_int32()
+        properties['ShapeRef'] = reader.read_int32()
+        properties['_Reserved02'] = reader.read(4) #  00 00 00 00
+        properties['ParentShapeRef'] = reader.read_int32()  # root = -1, child = parent shape ref
         childShapeCount = reader.read_int32()
-        shape['ChildShapeRefs'] = [reader.read_int32() for i in range(0, childShapeCount)]
-        shape['_Reserved03'] = reader.read(4) #  00 00 00 00 
+        properties['ChildShapeRefs'] = [reader.read_int32() for i in range(0, childShapeCount)]
+        properties['_Reserved03'] = reader.read(4) #  00 00 00 00 
         pointsCount = reader.read_int32()
-        shape['Points'] = [(reader.read_float32(), reader.read_float32()) for i in range(0, pointsCount)]
-        shape['_Reserved04'] = reader.read(4)  # 00 00 00 00
-        shape['_Reserved05'] = reader.read_float32()  # vary for rotation
-        shape['_Reserved06'] = reader.read_float32()  # vary for rotation
-        shape['_Reserved07'] = reader.read(4)  # 00 00 00 00
-        shape['Rotation'] = reader.read_float32()
-        shape['_Reserved08'] = reader.read(8)  # 00 00 00 00 00 00 00 00
-        shape['FillColor'] = reader.read_color_rgb()
-        shape['_Reserved10'] = reader.read(2)  # 00 01
-        shape['ShapeName'] = reader.read_pascal32().decode('iso-8859-1')
-        shape['_Reserved12'] = reader.read(8)  #  FF FF FF 00  00 00 00 00
-        shape['FontName'] = reader.read_pascal32().decode('iso-8859-1')
-        shape['_Reserved13'] = reader.read(1)  # 01
-        shape['FontColor'] = reader.read_color_rgb()
-        shape['_Reserved14'] = reader.read(5)  # FF F0 FF FF FF (g) or 00 E3 FF FF FF
-        shape['FontSize'] = reader.read_int32()
-        shape['_Reserved15'] = reader.read(5)  # 00 60 00 00 00
+        properties['Points'] = [(reader.read_float32(), reader.read_float32()) for i in range(0, pointsCount)]
+        properties['_Reserved04'] = reader.read(4)  # 00 00 00 00
+        properties['_Reserved05'] = reader.read_float32()  # vary for rotation
+        properties['_Reserved06'] = reader.read_float32()  # vary for rotation
+        properties['_Reserved07'] = reader.read(4)  # 00 00 00 00
+        properties['Rotation'] = reader.read_float32()
+        properties['_Reserved08'] = reader.read(8)  # 00 00 00 00 00 00 00 00
+        properties['FillColor'] = reader.read_color_rgb()
+        properties['_Reserved10'] = reader.read(2)  # 00 01
+        properties['ShapeName'] = reader.read_pascal32().decode('iso-8859-1')
+        properties['_Reserved12'] = reader.read(8)  #  FF FF FF 00  00 00 00 00
+        properties['FontName'] = reader.read_pascal32().decode('iso-8859-1')
+        properties['_Reserved13'] = reader.read(1)  # 01
+        properties['FontColor'] = reader.read_color_rgb()
+        properties['_Reserved14'] = reader.read(5)  # FF F0 FF FF FF (g) or 00 E3 FF FF FF
+        properties['FontSize'] = reader.read_int32()
+        properties['_Reserved15'] = reader.read(5)  # 00 60 00 00 00
         textStyle = reader.read_int8()
-        shape['TextBold'] = (textStyle & 1) != 0
-        shape['TextItalic'] = (textStyle & 2) != 0
-        shape['TextUnderline'] = (textStyle & 4) != 0
-        shape['TextStrikethrough'] = (textStyle & 8) != 0
-        shape['_Reserved17'] = reader.read(13)  # 00 00 00 00 00 00 00 00 17 00 00 00 00
-        shape['StrokeColor'] = reader.read_color_rgb()
-        shape['_Reserved21'] = reader.read(2)  # 00 04
-        shape['StrokeType'] = reader.read_int8()
-        shape['StrokeWidth'] = reader.read_int32()
-        shape['_Reserved23'] = reader.read_i18n_text()
-        shape['FlipHorizontal'] = reader.read_boolean8()
-        shape['FlipVertical'] = reader.read_boolean8()
-        shape['_Reserved24'] = reader.read(1)  #  01
+        properties['TextBold'] = (textStyle & 1) != 0
+        properties['TextItalic'] = (textStyle & 2) != 0
+        properties['TextUnderline'] = (textStyle & 4) != 0
+        properties['TextStrikethrough'] = (textStyle & 8) != 0
+        properties['_Reserved17'] = reader.read(13)  # 00 00 00 00 00 00 00 00 17 00 00 00 00
+        properties['StrokeColor'] = reader.read_color_rgb()
+        properties['_Reserved21'] = reader.read(2)  # 00 04
+        properties['StrokeType'] = reader.read_int8()
+        properties['StrokeWidth'] = reader.read_int32()
+        properties['_Reserved23'] = reader.read_i18n_text()
+        properties['FlipHorizontal'] = reader.read_boolean8()
+        properties['FlipVertical'] = reader.read_boolean8()
+        properties['_Reserved24'] = reader.read(1)  #  01
         commentCount = reader.read_int32()
-        shape['Comments'] = [reader.read_pascal32().decode('iso-8859-1') for _ in range(0, commentCount)]
-        shape['_Reserved25'] = reader.read(10)  # 00 0A 00 00 00 00 0A 00 00 00
-        shape['Locked'] = reader.read_boolean8()
-        shape['_Reserved29'] = reader.read(3)  # 00 00 01
-        shape['Rotatable'] = reader.read_boolean8()
-        shape['Resizable'] = reader.read_boolean8()
-        shape['ParentCenter'] = reader.read_boolean8()
+        properties['Comments'] = [reader.read_pascal32().decode('iso-8859-1') for _ in range(0, commentCount)]
+        properties['_Reserved25'] = reader.read(10)  # 00 0A 00 00 00 00 0A 00 00 00
+        properties['Locked'] = reader.read_boolean8()
+        properties['_Reserved29'] = reader.read(3)  # 00 00 01
+        properties['Rotatable'] = reader.read_boolean8()
+        properties['Resizable'] = reader.read_boolean8()
+        properties['ParentCenter'] = reader.read_boolean8()
         
         #  Text Additional
         if shapeType == 'TMyText':
-            shape['_Reserved36(TMyText)'] = reader.read(6)  # 00 01 01 00 00 00
-            shape['Text'] = reader.read_pascal32().decode('iso-8859-1')
-            shape['_Reserved42(TMyText)'] = reader.read(1)  # 00
-            shape['TextAlign'] = reader.read_int8()
-            shape['TextWrap'] = reader.read_int8()
+            properties['_Reserved36(TMyText)'] = reader.read(6)  # 00 01 01 00 00 00
+            properties['Text'] = reader.read_pascal32().decode('iso-8859-1')
+            properties['_Reserved42(TMyText)'] = reader.read(1)  # 00
+            properties['TextAlign'] = reader.read_int8()
+            properties['TextWrap'] = reader.read_int8()
         
         if shapeType == 'TMyLine' or shapeType == 'TMyPolygon' or shapeType == 'TMyPolyLine' or shapeType == 'TMyFreeLine':
-            shape['ArrowDegree'] = reader.read_int32()
-            shape['ArrowLength'] = reader.read_int8()
-            shape['ArrowOffset'] = reader.read_int8()
-            shape['ArrowStyle'] = reader.read_int8()
+            properties['ArrowDegree'] = reader.read_int32()
+            properties['ArrowLength'] = reader.read_int8()
+            properties['ArrowOffset'] = reader.read_int8()
+            properties['ArrowStyle'] = reader.read_int8()
         
         if shapeType == 'TMyImage':
-            shape['Bitmap'] = reader.read_pascal64()
+            properties['Bitmap'] = reader.read_blob64()
         
         if shapeType == 'TMyGroup':
-            shape['_Reserved36(TMyGroup)'] = reader.read(16)
-            shape['ChildShapes'] = [self.__read_shape(reader) for i in range(0, childShapeCount)]
+            properties['_Reserved36(TMyGroup)'] = reader.read(16)
         
         if shapeType == 'TMyCombine':
-            shape['_Reserved36(TMyCombine)'] = reader.read(16)
-            shape['ChildShapes'] = [self.__read_shape(reader) for i in range(0, childShapeCount)]
+            properties['_Reserved36(TMyCombine)'] = reader.read(16)
         
         if shapeType == 'TMyElliArc':
-            shape['_Reserved36(TMyElliArc)'] = reader.read(2)  # 00 00
+            properties['_Reserved36(TMyElliArc)'] = reader.read(2)  # 00 00
         
         if shapeType == 'TMySpiral':
-            shape['_Reserved36(TMySpiral)'] = reader.read(4)  # 00 00 00 00
-            shape['Distance'] = reader.read_float32()
+            properties['_Reserved36(TMySpiral)'] = reader.read(4)  # 00 00 00 00
+            properties['Distance'] = reader.read_float32()
         
         if shapeType == 'TMySinusLine':
-            shape['Period'] = reader.read_int32()
+            properties['Period'] = reader.read_int32()
         
-        return shape
+        shape = Shape()
+        shape._load(properties)
+        return shape, childShapeCount
 
 
 class ShapeLibraryWriter(object):
-    def write(self, path, sl):
-        if os.path.exists(path):
-            if os.path.exists(path + '.bak'):
-                os.unlink(path + '.bak')
-            os.rename(path, path + '.bak')
-        with open(path, 'wb') as f:
-            writer = ShapeLibraryStreamWriter(f)
-            writer.write(b'TCADLIBX.k')
-            writer.write_boolean8(sl.readonly)
-            writer.write_i18n_text(sl.name)
-            for entry in sl.entries:
-                self.__write_shape_library_entry(writer, entry)
-            writer.flush()
+    def __init__(self, stats=None):
+        self.__stats = stats
+        self.__relocations = None
+        self.__sources = None
+        self.__source_files = {}
+        self.__path = None
     
-    def __write_shape_library_entry(self, writer, entry):
-        writer.write_pascal8(entry.name.encode('iso-8859-1'))
+    @property
+    def stats(self):
+        return self.__stats
+    
+    def write(self, path, sl, entries=None):
+        # entries may be any iterable, so that entries can be streamed instead of held in sl
+        if entries is None:
+            entries = sl.entries
+        # written next to the old file, which stays intact (and is what lazy bitmaps and clean entries are read from) until the new one is complete
+        temporary = path + '.tmp'
+        self.__relocations = []
+        # entries of sl are pointed at their new records afterwards; streamed ones are not held on to, they turn dirty
+        self.__sources = [] if entries is sl.entries else None
+        self.__path = path
+        try:
+            try:
+                with open(temporary, 'wb') as f:
+                    started = time.perf_counter()
+                    writer = ShapeLibraryStreamWriter(f)
+                    writer.write(b'TCADLIBX.k')
+                    writer.write_boolean8(sl.readonly)
+                    writer.write_i18n_text(sl.name)
+                    if self.__stats is not None:
+                        self.__stats.count_library(sl, writer.tell())
+                        self.__stats.add_time('header', time.perf_counter() - started)
+                        started = time.perf_counter()
+                    try:
+                        for entry in entries:
+                            self.__write_shape_library_entry(writer, entry)
+                    finally:
+                        self.__close_source_files()
+                    writer.flush()
+                    if self.__stats is not None:
+                        self.__stats.add_time('entries', time.perf_counter() - started)
+            except:
+                if os.path.exists(temporary):
+                    os.unlink(temporary)
+                raise
+            # handles into the old file (or the old backup) that this write does not relocate, such as those of entries
+            # moved to another library, would read the wrong bytes afterwards
+            written = [bitmap for bitmap, offset in self.__relocations]
+            detach_blobs(path, written)
+            detach_blobs(path + '.bak')
+            if os.path.exists(path):
+                os.replace(path, path + '.bak')
+            os.replace(temporary, path)
+            for bitmap, offset in self.__relocations:
+                bitmap.relocate(path, offset)
+            for entry, source in self.__written_sources(file_signature(path)):
+                entry.mark_clean(source)
+        finally:
+            self.__relocations = None
+            self.__sources = None
+    
+    def encode_entry(self, entry):
         g = io.BytesIO()
         subwriter = ShapeLibraryStreamWriter(g)
-        subwriter.write_int32(entry.width)
-        subwriter.write_int32(entry.height)
-        subwriter.write_i18n_text(entry.i18n_name)
-        subwriter.write_int32(entry.number_of_descendants)
-        self.__write_shape(subwriter, entry.shape)
+        self.__write_entry_contents(subwriter, entry)
         subwriter.flush()
-        contents = g.getvalue()
-        writer.write_int32(len(contents))
-        writer.write(contents)
+        return g.getvalue()
+    
+    def __write_shape_library_entry(self, writer, entry):
+        if isinstance(entry, RawShapeLibraryEntry):
+            writer.write(entry.record)
+            if self.__stats is not None:
+                self.__stats.count_raw_entry(entry, len(entry.record))
+            return
+        offset = writer.tell()
+        if not entry.dirty and self.__copy_entry(writer, entry):
+            length = entry.source.length
+            digest = entry.source.digest
+            if self.__stats is not None:
+                self.__stats.count_copied_entry(entry, entry.source.end - entry.source.offset)
+        else:
+            writer.write_pascal8(entry.name.encode('iso-8859-1'))
+            start = writer.tell()
+            writer.write_int32(0)
+            self.__write_entry_contents(writer, entry)
+            end = writer.tell()
+            writer.seek(start)
+            writer.write_int32(end - start - 4)
+            writer.seek(end)
+            length = end - start - 4
+            digest = None  # hashed from the written file when it is needed
+            if self.__stats is not None:
+                self.__stats.count_entry(entry, 1 + len(entry.name) + end - start)
+        if self.__sources is not None:
+            self.__sources.append((entry, offset, offset + 5 + len(entry.name), length, digest))
+        elif entry.source is not None and os.path.abspath(entry.source.path) == os.path.abspath(self.__path):
+            entry.mark_dirty()  # its source is the file being replaced
+    
+    def __copy_entry(self, writer, entry):
+        # a clean entry is copied byte for byte from where it was read, unless that record has changed since
+        source = entry.source
+        try:
+            f = self.__source_file(source.path)
+            f.seek(source.offset)
+            data = f.read(source.end - source.offset)
+        except (IOError, OSError):
+            return False
+        name = entry.name.encode('iso-8859-1')
+        prefix = struct.pack('<B', len(name)) + name + struct.pack('<l', source.length)
+        if len(data) != source.end - source.offset or data[:len(prefix)] != prefix or not source.check(memoryview(data)[len(prefix):]):
+            return False
+        offset = writer.tell()
+        writer.write(data)
+        if self.__relocations is not None:
+            for shape in entry.shape.walk():
+                bitmap = shape['Bitmap']
+                if isinstance(bitmap, BlobHandle) and os.path.abspath(bitmap.path) == os.path.abspath(source.path) and source.offset <= bitmap.offset < source.end:
+                    self.__relocations.append((bitmap, bitmap.offset - source.offset + offset))
+        return True
+    
+    def __written_sources(self, signature):
+        # the records of the entries as written, so that they can be copied by the next write; signature is that of the new file
+        if self.__sources is None:
+            return []
+        return [(entry, ShapeLibraryRecord(self.__path, entry.name, offset, contents_offset, length, digest, signature)) for entry, offset, contents_offset, length, digest in self.__sources]
+    
+    def __source_file(self, path):
+        # one handle per source file for the whole write
+        key = os.path.abspath(path)
+        if key not in self.__source_files:
+            self.__source_files[key] = open(path, 'rb')
+        return self.__source_files[key]
+    
+    def __close_source_files(self):
+        for f in self.__source_files.values():
+            f.close()
+        self.__source_files = {}
+    
+    def __write_entry_contents(self, writer, entry):
+        writer.write_int32(entry.width)
+        writer.write_int32(entry.height)
+        writer.write_i18n_text(entry.i18n_name)
+        writer.write_int32(entry.number_of_descendants)
+        self.__write_shape(writer, entry.shape)
+    
+    def __write_bitmap(self, writer, bitmap):
+        if isinstance(bitmap, bytes):
+            writer.write_pascal64(bitmap)
+            return
+        if self.__relocations is not None:
+            self.__relocations.append((bitmap, writer.tell() + 8))
+        writer.write_blob64(bitmap)
     
     def __write_shape(self, writer, shape):
+        stack = [shape]
+        while len(stack) > 0:
+            shape = stack.pop()
+            if self.__stats is None:
+                self.__write_shape_fields(writer, shape)
+            else:
+                start = writer.tell()
+                self.__write_shape_fields(writer, shape)
+                self.__stats.count_shape(shape, writer.tell() - start)
+            if shape.type in ['TMyGroup', 'TMyCombine']:
+                stack.extend(reversed(shape.children))
+    
+    def __write_shape_fields(self, writer, shape):
         writer.write(shape.type.ljust(16).encode('iso-8859-1'))
         writer.write(shape['_Reserved01'])
         writer.write_int32(shape['ShapeAutoNumber'])
@@ -287,7 +827,7 @@ class ShapeLibraryWriter(object):
         
         if shape.type == 'TMyText':
             writer.write(shape['_Reserved36(TMyText)'])
-            writer.write_pascal32(shape['text'].encode('iso-8859-1'))
+            writer.write_pascal32(shape['Text'].encode('iso-8859-1'))
             writer.write(shape['_Reserved42(TMyText)'])
             writer.write_int8(shape['TextAlign'])
             writer.write_int8(shape['TextWrap'])
@@ -299,17 +839,13 @@ class ShapeLibraryWriter(object):
             writer.write_int8(shape['ArrowStyle'])
         
         if shape.type == 'TMyImage':
-            writer.write_pascal64(shape['Bitmap'])
+            self.__write_bitmap(writer, shape['Bitmap'])
         
         if shape.type == 'TMyGroup':
             writer.write(shape['_Reserved36(TMyGroup)'])
-            for subshape in shape.children:
-                self.__write_shape(writer, subshape)
         
         if shape.type == 'TMyCombine':
             writer.write(shape['_Reserved36(TMyCombine)'])
-            for subshape in shape.children:
-                self.__write_shape(writer, subshape)
         
         if shape.type == 'TMyElliArc':
             writer.write(shape['_Reserved36(TMyElliArc)'])
@@ -320,5 +856,5 @@ class ShapeLibraryWriter(object):
         
         if shape.type == 'TMySinusLine':
             writer.write_int32(shape['Period'])
-    
-    
+
+
@@ -6,6 +6,7 @@ import tkinter.ttk as Ttk
 from tkinter.colorchooser import askcolor
 from tkinter.messagebox import showerror
 from tkinter import filedialog
+import hashlib
 import os.path
 import re
 
@@ -15,6 +16,10 @@ from Color import Color
 from MicrosoftLocale import Locale
 from I18nTextView import I18nTextView
 from PropertyInspector import *
+from ShapeThumbnail import ThumbnailCache
+from ShapeLibraryEntryCache import ShapeLibraryEntryCache
+from ShapeBitmap import export_bitmap, import_bitmap
+import base64
 
 class I18nTextEditor(Tk.Toplevel):
     def __init__(self, master, property, **keys):
@@ -39,6 +44,49 @@ class I18nTextEditor(Tk.Toplevel):
     def __cancel(self):
         self.destroy()
 
+class BitmapEditor(Tk.Toplevel):
+    def __init__(self, master, property, **keys):
+        Tk.Toplevel.__init__(self, master, **keys)
+        self.__property = property
+        self.title('Bitmap')
+        self.label = Tk.Label(self, text=property.format())
+        self.label.pack(padx=5, pady=5)
+        self.footer = Tk.Frame(self)
+        self.footer.pack(side=Tk.BOTTOM)
+        self.export_button = Tk.Button(self.footer, text='Export...', command=self.__export)
+        self.export_button.pack(side=Tk.LEFT, padx=5, pady=5)
+        self.import_button = Tk.Button(self.footer, text='Import...', command=self.__import)
+        self.import_button.pack(side=Tk.LEFT, padx=5, pady=5)
+        self.close_button = Tk.Button(self.footer, text='Close', command=self.destroy)
+        self.close_button.pack(side=Tk.LEFT, padx=5, pady=5)
+        self.grab_set()
+    
+    def __export(self):
+        path = filedialog.asksaveasfilename(parent=self, title="Export bitmap", defaultextension='.bmp', filetypes = (("Bitmap files","*.bmp"),("All files","*.*")))
+        if path == '':
+            return
+        export_bitmap(self.__property.value, path)
+    
+    def __import(self):
+        path = filedialog.askopenfilename(parent=self, title="Import bitmap", filetypes = (("Bitmap files","*.bmp"),("All files","*.*")))
+        if path == '':
+            return
+        self.__property.parse(path)
+        self.destroy()
+
+class BitmapPropertyType(PropertyType):
+    def name(self):
+        return 'Bitmap'
+    
+    def parse(self, path):
+        return import_bitmap(path)
+    
+    def format(self, value):
+        return '%d bytes' % len(value)
+    
+    def editor(self, master, property):
+        BitmapEditor(master, property)
+
 class I18nTextPropertyType(PropertyType):
     def name(self):
         return 'I18nText'
@@ -126,15 +174,121 @@ class StringListPropertyType(PropertyType):
         return InlineEntryEditor(master, property)
 
 class ShapeLibraryInspector(PropertyInspector):
+    # entries are decoded through an entry cache when their node is opened, and their rows are dropped again when it is closed,
+    # so that only the open entries and the edited ones (which the cache keeps while they are dirty) have to stay in memory
     def __init__(self, master=None, **keys):
         PropertyInspector.__init__(self, master, **keys)
         self.__shape_library = ShapeLibrary()
+        self.__records = []
+        self.__entry_cache = ShapeLibraryEntryCache(reader=ShapeLibraryReader(tolerant=True))
+        self.__entry_nodes = {}  # node: position of its entry
+        self.__loaded = set()  # entry nodes whose rows are in the tree; their entries are pinned
+        self.__loaded_by_search = set()  # loaded for search hits and unloaded once the search has closed them again
+        self.__entry_texts = {}  # position: search texts of the rows of an entry that is not loaded
+        self.__thumbnail_cache = ThumbnailCache(size=16)
+        self.__thumbnails = {}
+        self.treeview.bind('<<TreeviewOpen>>', self.__node_opened, add=True)
+        self.treeview.bind('<<TreeviewClose>>', self.__node_closed, add=True)
+        self.__dispatch_thumbnails()
     
-    def set_shape_library(self, shapeLibrary):
+    def set_shape_library(self, shapeLibrary, records):
+        # shapeLibrary holds the header only; records are the entries of the file, as scanned
         self.__shape_library = shapeLibrary
+        self.__records = records
+        self.__entry_cache = ShapeLibraryEntryCache(reader=ShapeLibraryReader(tolerant=True))
         self.delete_all()
+        self.__entry_nodes = {}
+        self.__loaded = set()
+        self.__loaded_by_search = set()
+        self.__entry_texts = {}
+        self.__thumbnails = {}
         self.__add_shape_library_node('', 'Shape Library', self.__shape_library)
     
+    def save(self, path):
+        # entries that were never decoded (or were dropped again) are written as their records, unchanged
+        decoded = {}
+        ShapeLibraryWriter().write(path, self.__shape_library, self.__entries(decoded))
+        records = ShapeLibraryScanner().scan(path).records
+        for node in self.__loaded:
+            self.__entry_cache.unpin(self.__records[self.__entry_nodes[node]])
+        for position, entry in decoded.items():
+            if not isinstance(entry, RawShapeLibraryEntry):
+                entry.mark_clean(records[position])
+        self.__entry_cache.clear()
+        for position, entry in decoded.items():
+            self.__entry_cache.put(records[position], entry)
+        self.__records = records
+        for node in self.__loaded:
+            self.__entry_cache.pin(records[self.__entry_nodes[node]])
+    
+    def search(self, query):
+        # the rows of entries that are not loaded are matched by their texts; entries with hits are loaded (up to
+        # MAX_SEARCH_HITS hits), and the hits of the others are only counted
+        query = query.strip().lower()
+        unloaded_hits = 0
+        if query != '':
+            budget = self.MAX_SEARCH_HITS
+            for node, position in sorted(self.__entry_nodes.items(), key=lambda item: item[1]):
+                if node in self.__loaded:
+                    continue
+                hits = sum(1 for text in self.__unloaded_entry_texts(position) if query in text)
+                if hits == 0:
+                    continue
+                if budget > 0 and self.__load_entry_node(node):
+                    self.__loaded_by_search.add(node)
+                    budget -= hits
+                else:
+                    unloaded_hits += hits
+        count = PropertyInspector.search(self, query) + unloaded_hits
+        for node in list(self.__loaded_by_search):
+            if not self.treeview.item(node, 'open'):
+                self.__unload_entry_node(node)
+        return count
+    
+    def __unloaded_entry_texts(self, position):
+        # decoded through the entry cache once; the texts are kept, the entry need not be
+        if position not in self.__entry_texts:
+            try:
+                entry = self.__entry_cache.get(self.__records[position])
+            except (IOError, OSError):
+                entry = None
+            texts = []
+            if isinstance(entry, ShapeLibraryEntry):
+                for type, target, name, value in self.__entry_properties(entry):
+                    texts.append(self.search_text(name, type.name(), type.format(value)))
+                # the rows __add_shape_node would insert
+                for shape in entry.shape.walk():
+                    texts.append(self.search_text(shape.name, 'Shape<%s>' % shape.type, ''))
+                    for key in shape:
+                        if key == 'ChildShapes':
+                            if len(shape.children) > 0:
+                                texts.append(self.search_text('ChildShapes', '[Shape]', ''))
+                        else:
+                            type = self.__create_property_type(key, shape[key])
+                            texts.append(self.search_text(key, type.name(), type.format(shape[key])))
+            self.__entry_texts[position] = texts
+        return self.__entry_texts[position]
+    
+    def __entries(self, decoded):
+        f = None
+        try:
+            for position, record in enumerate(self.__records):
+                entry = self.__entry_cache.peek(record)
+                if entry is None:
+                    if f is None:
+                        f = open(record.path, 'rb')
+                    f.seek(record.offset)
+                    data = f.read(record.end - record.offset)
+                    if hashlib.sha1(data[record.contents_offset - record.offset:]).hexdigest() != record.digest:
+                        raise IOError('%s has changed since it was opened' % record.path)
+                    entry = RawShapeLibraryEntry(record.name, data)
+                else:
+                    decoded[position] = entry
+                yield entry
+        finally:
+            if f is not None:
+                f.close()
+    
     def __create_property_type(self, name, value):
         if name == 'Comments':
             return StringListPropertyType()
@@ -142,6 +296,8 @@ class ShapeLibraryInspector(PropertyInspector):
             return IntegerListPropertyType()
         elif name == 'Points':
             return PointsPropertyType()
+        elif name == 'Bitmap':
+            return BitmapPropertyType()
         elif name == 'StrokeType':
             return EnumPropertyType('StrokeStyle', { 0: 'Solid', 1: 'Dash', 2: 'Dot', 3: 'Dash Dot', 4: 'Dash Dot Dot', 5: 'Clear' })
         elif name == 'ShapeType':
@@ -204,34 +360,88 @@ class ShapeLibraryInspector(PropertyInspector):
     
     def __add_shape_library_node(self, parentNode, name, value):
         sl = self.__shape_library
-        node = self.treeview.insert(parentNode, Tk.END, text='<root>', values=('ShapeLibrary', ''), open=True)
+        node = self.insert_node(parentNode, Tk.END, '<root>', 'ShapeLibrary', open=True)
         self.insert(node, Tk.END, self.__create_property(I18nTextPropertyType(), sl, 'Name', sl.name))
         self.insert(node, Tk.END, self.__create_property(BooleanPropertyType(), sl, 'ReadOnly', sl.readonly))
-        subnode = self.treeview.insert(node, Tk.END, text='ShapeLibraryEntries', values=('[ShapeLibraryEntry]', ''), open=True)
-        for entry in self.__shape_library.entries:
-            self.__add_shape_library_entry_node(subnode, entry)
-    
-    def __add_shape_library_entry_node(self, parentNode, entry):
-        node = self.treeview.insert(parentNode, Tk.END, text=entry.name, values=('ShapeLibraryEntry', ''))
-        self.insert(node, Tk.END, self.__create_property(StringPropertyType(), entry, 'Name', entry.name))
-        self.insert(node, Tk.END, self.__create_property(IntegerPropertyType(), entry, 'Width', entry.width))
-        self.insert(node, Tk.END, self.__create_property(IntegerPropertyType(), entry, 'Height', entry.height))
-        self.insert(node, Tk.END, self.__create_property(I18nTextPropertyType(), entry, 'I18nName', entry.i18n_name))
+        subnode = self.insert_node(node, Tk.END, 'ShapeLibraryEntries', '[ShapeLibraryEntry]', open=True)
+        for position, record in enumerate(self.__records):
+            self.__add_shape_library_entry_node(subnode, position, record)
+    
+    def __add_shape_library_entry_node(self, parentNode, position, record):
+        node = self.insert_node(parentNode, Tk.END, record.name, 'ShapeLibraryEntry')
+        self.__entry_nodes[node] = position
+        self.treeview.insert(node, Tk.END)  # a placeholder, so that the node can be opened
+        self.__thumbnail_cache.request_record(record, lambda png: self.__set_thumbnail(node, png))
+    
+    def __node_opened(self, event):
+        node = self.treeview.focus()
+        self.__loaded_by_search.discard(node)  # opened by the user, so it stays loaded until it is closed
+        if node in self.__entry_nodes and node not in self.__loaded:
+            self.__load_entry_node(node)
+    
+    def __node_closed(self, event):
+        node = self.treeview.focus()
+        if node in self.__loaded:
+            self.__unload_entry_node(node)
+    
+    def __load_entry_node(self, node):
+        try:
+            entry = self.__entry_cache.pin(self.__records[self.__entry_nodes[node]])
+        except (IOError, OSError) as e:
+            showerror(title='Read Error', message=str(e))
+            return False
+        self.delete_children(node)
+        self.__loaded.add(node)
+        self.__entry_texts.pop(self.__entry_nodes[node], None)  # its rows are searched from now on, and may be edited
+        if isinstance(entry, RawShapeLibraryEntry):
+            self.treeview.item(node, values=('RawShapeLibraryEntry', entry.error))
+            return True
+        for type, target, name, value in self.__entry_properties(entry):
+            self.insert(node, Tk.END, self.__create_property(type, target, name, value))
         subnode = self.__add_shape_node(node, entry.shape)
         self.treeview.item(subnode, open=True)
+        return True
+    
+    def __unload_entry_node(self, node):
+        self.delete_children(node)
+        self.treeview.insert(node, Tk.END)
+        self.__loaded.discard(node)
+        self.__loaded_by_search.discard(node)
+        self.__entry_cache.unpin(self.__records[self.__entry_nodes[node]])
+    
+    def __entry_properties(self, entry):
+        return [
+            (StringPropertyType(), entry, 'Name', entry.name),
+            (IntegerPropertyType(), entry, 'Width', entry.width),
+            (IntegerPropertyType(), entry, 'Height', entry.height),
+            (I18nTextPropertyType(), entry, 'I18nName', entry.i18n_name),
+        ]
+    
+    def __dispatch_thumbnails(self):
+        self.__thumbnail_cache.dispatch()
+        self.after(100, self.__dispatch_thumbnails)
+    
+    def __set_thumbnail(self, node, png):
+        if not self.treeview.exists(node):
+            return
+        self.__thumbnails[node] = Tk.PhotoImage(data=base64.b64encode(png))
+        self.treeview.item(node, image=self.__thumbnails[node])
     
     def __add_shape_node(self, parentNode, shape):
-        node = self.treeview.insert(parentNode, Tk.END, text=shape.name, values=('Shape<%s>' % shape.type, ''))
-        for key in shape:
-            if key == 'ChildShapes':
-                if len(shape.children) > 0:
-                    subnode = self.treeview.insert(node, Tk.END, text='ChildShapes', values=('[Shape]', ''))
-                    for childShape in shape.children:
-                        self.__add_shape_node(subnode, childShape)
-            else:
-                property = self.__create_property(self.__create_property_type(key, shape[key]), shape, key, shape[key])
-                self.insert(node, Tk.END, property)
-        return node
+        root = None
+        stack = [(parentNode, shape)]
+        while len(stack) > 0:
+            parentNode, shape = stack.pop()
+            node = self.insert_node(parentNode, Tk.END, shape.name, 'Shape<%s>' % shape.type)
+            root = node if root is None else root
+            for key in shape:
+                if key == 'ChildShapes':
+                    if len(shape.children) > 0:
+                        subnode = self.insert_node(node, Tk.END, 'ChildShapes', '[Shape]')
+                        stack.extend((subnode, childShape) for childShape in reversed(shape.children))
+                else:
+                    self.insert(node, Tk.END, self.__create_property(self.__create_property_type(key, shape[key]), shape, key, shape[key]))
+        return root
 
 class ShapeTypePropertyType(EnumPropertyType):
     def name(self):
@@ -244,14 +454,31 @@ class ShapeTypePropertyType(EnumPropertyType):
         return value
 
 class ShapeLibraryInspectorFrame(Tk.Frame):
+    SEARCH_DELAY = 250  # milliseconds of typing pause before searching
+    
     def __init__(self, master=None, **keys):
         Tk.Frame.__init__(self, master, **keys)
         
         self.__shape_library = ShapeLibrary()
+        self.__records = []
         self.__path = None
+        self.__search_job = None
         
         self.__filename_label = Tk.Label(self, font=('MS UI Gothic', '8'))
         self.__filename_label.pack()
+        
+        self.__search_frame = Tk.Frame(self)
+        self.__search_frame.pack(side=Tk.TOP, fill=Tk.X)
+        self.__search_caption = Tk.Label(self.__search_frame, text='Search:')
+        self.__search_caption.pack(side=Tk.LEFT, padx=5)
+        self.__search_text = Tk.StringVar()
+        self.__search_text.trace_add('write', self.__search_changed)
+        self.__search_entry = Tk.Entry(self.__search_frame, textvariable=self.__search_text)
+        self.__search_entry.pack(side=Tk.LEFT, fill=Tk.X, expand=True)
+        self.__search_entry.bind('<Return>', lambda event: self.__shape_library_inspector.next_search_hit())
+        self.__search_entry.bind('<Escape>', lambda event: self.__search_text.set(''))
+        self.__search_label = Tk.Label(self.__search_frame, width=20, anchor=Tk.W)
+        self.__search_label.pack(side=Tk.LEFT, padx=5)
         self.__shape_library_inspector = ShapeLibraryInspector(self)
         self.__shape_library_inspector.pack(side=Tk.TOP, fill=Tk.BOTH, expand=True)
         
@@ -272,16 +499,17 @@ class ShapeLibraryInspectorFrame(Tk.Frame):
         if path == '':
             return
         self.__path = path
-        reader = ShapeLibraryReader()
-        self.__shape_library = reader.read(self.__path)
+        # only the header is read here; entries are decoded as they are opened
+        with ShapeLibraryReader().open(self.__path) as stream:
+            self.__shape_library = stream.library
+        self.__records = ShapeLibraryScanner().scan(self.__path).records
         self.__reload_shape_library()
     
     def __save_file(self, event):
         if self.__path == None:
             self.__save_file_as(event)
         else:
-            writer = ShapeLibraryWriter()
-            writer.write(self.__path, self.__shape_library)
+            self.__shape_library_inspector.save(self.__path)
     
     def __save_file_as(self, event):
         path = filedialog.asksaveasfilename(title = "Save file as", filetypes = (("LabaNotator library files","*.lib"),))
@@ -293,8 +521,25 @@ class ShapeLibraryInspectorFrame(Tk.Frame):
         self.__save_file(event)
     
     def __reload_shape_library(self):
-        self.__shape_library_inspector.set_shape_library(self.__shape_library)
+        self.__shape_library_inspector.set_shape_library(self.__shape_library, self.__records)
         self.__filename_label.configure(text=self.__path)
+        self.__search()
+    
+    def __search_changed(self, *args):
+        if self.__search_job is not None:
+            self.after_cancel(self.__search_job)
+        self.__search_job = self.after(self.SEARCH_DELAY, self.__search)
+    
+    def __search(self):
+        self.__search_job = None
+        query = self.__search_text.get()
+        count = self.__shape_library_inspector.search(query)
+        if query.strip() == '':
+            self.__search_label.configure(text='')
+        elif count > ShapeLibraryInspector.MAX_SEARCH_HITS:
+            self.__search_label.configure(text='%d matches (first %d shown)' % (count, ShapeLibraryInspector.MAX_SEARCH_HITS))
+        else:
+            self.__search_label.configure(text='%d matches' % count)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ShapeLibrary import *
+from ShapeLibraryIO import ShapeLibraryReader, ShapeLibraryWriter
+from MicrosoftLocale import Locale, I18nText
+from Color import Color
+import argparse
+import base64
+import json
+import re
+import sys
+
+COLOR_PROPERTIES = ['FillColor', 'FontColor', 'StrokeColor']
+I18N_TEXT_PROPERTIES = ['_Reserved23']
+BYTES_PROPERTIES = ['Bitmap']
+
+class ShapeLibraryJSONEncoder(object):
+    def encode_header(self, sl):
+        return {'name': self.__encode_i18n_text(sl.name), 'readonly': sl.readonly}
+    
+    def encode_entry(self, entry):
+        if isinstance(entry, RawShapeLibraryEntry):
+            # passed through undecoded, so that importing the JSON writes the record back unchanged
+            return {'name': entry.name, 'raw': base64.b64encode(entry.record).decode('ascii'), 'error': entry.error}
+        return {
+            'name': entry.name,
+            'width': entry.width,
+            'height': entry.height,
+            'i18n_name': self.__encode_i18n_text(entry.i18n_name),
+            'shape': self.encode_shape(entry.shape),
+        }
+    
+    def encode_shape(self, shape):
+        obj = {}
+        for key in shape:
+            value = shape[key]
+            if key == 'ChildShapes':
+                obj[key] = [self.encode_shape(subshape) for subshape in value]
+            elif isinstance(value, I18nText):
+                obj[key] = self.__encode_i18n_text(value)
+            elif isinstance(value, Color):
+                obj[key] = value.hex()
+            elif isinstance(value, bytes):
+                obj[key] = base64.b64encode(value).decode('ascii')
+            elif key in BYTES_PROPERTIES:
+                obj[key] = base64.b64encode(value.read()).decode('ascii')  # lazily loaded bitmap
+            else:
+                obj[key] = value
+        return obj
+    
+    def dump(self, path, f):
+        # one line for the library header, then one line per entry; entries are never all in memory
+        with ShapeLibraryReader().open(path) as stream:
+            f.write(json.dumps(self.encode_header(stream.library), ensure_ascii=False) + '\n')
+            for entry in stream:
+                f.write(json.dumps(self.encode_entry(entry), ensure_ascii=False) + '\n')
+    
+    def __encode_i18n_text(self, i18n_text):
+        return dict((locale.name, i18n_text[locale]) for locale in i18n_text)
+
+class ShapeLibraryJSONDecoder(object):
+    def decode_header(self, obj):
+        sl = ShapeLibrary()
+        sl.name = self.__decode_i18n_text(obj['name'])
+        sl.readonly = obj['readonly']
+        return sl
+    
+    def decode_entry(self, obj):
+        if 'raw' in obj:
+            return RawShapeLibraryEntry(obj['name'], base64.b64decode(obj['raw']), obj.get('error'))
+        return ShapeLibraryEntry(obj['name'], obj['width'], obj['height'], self.__decode_i18n_text(obj['i18n_name']), self.decode_shape(obj['shape']))
+    
+    def decode_shape(self, obj):
+        shape = Shape()
+        for key, value in obj.items():
+            if key == 'ChildShapes':
+                shape[key] = [self.decode_shape(subshape) for subshape in value]
+            elif key == 'Points':
+                shape[key] = [tuple(point) for point in value]
+            elif key in COLOR_PROPERTIES:
+                match = re.match(r'#([0-9a-f]{2})([0-9a-f]{2})([0-9a-f]{2})$', value)
+                if match is None:
+                    raise ValueError("'%s' is not a valid color hexcode." % value)
+                shape[key] = Color(tuple(int(match.group(i), 16) for i in range(1, 4)))
+            elif key in I18N_TEXT_PROPERTIES:
+                shape[key] = self.__decode_i18n_text(value)
+            elif key in BYTES_PROPERTIES or (key.startswith('_Reserved') and isinstance(value, str)):
+                shape[key] = base64.b64decode(value)
+            else:
+                shape[key] = value
+        return shape
+    
+    def load(self, f, path):
+        lines = (line for line in f if line.strip() != '')
+        header = next(lines, None)
+        if header is None:
+            raise ValueError('missing shape library header line')
+        sl = self.decode_header(json.loads(header))
+        ShapeLibraryWriter().write(path, sl, (self.decode_entry(json.loads(line)) for line in lines))
+    
+    def __decode_i18n_text(self, obj):
+        return I18nText(dict((Locale(name), text) for name, text in obj.items()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert LabaNotator shape libraries to and from JSON Lines.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help='write a .lib file as JSON Lines')
+    export_parser.add_argument('library')
+    export_parser.add_argument('jsonl', help="output file, or '-' for standard output")
+    import_parser = subparsers.add_parser('import', help='write a .lib file from JSON Lines')
+    import_parser.add_argument('jsonl', help="input file, or '-' for standard input")
+    import_parser.add_argument('library')
+    args = parser.parse_args()
+    
+    # JSON Lines are UTF-8 on standard input and output too, whatever the console's code page is
+    if args.command == 'export':
+        if args.jsonl == '-':
+            sys.stdout.reconfigure(encoding='utf-8')
+            ShapeLibraryJSONEncoder().dump(args.library, sys.stdout)
+        else:
+            with open(args.jsonl, 'w', encoding='utf-8') as f:
+                ShapeLibraryJSONEncoder().dump(args.library, f)
+    else:
+        if args.jsonl == '-':
+            sys.stdin.reconfigure(encoding='utf-8')
+            ShapeLibraryJSONDecoder().load(sys.stdin, args.library)
+        else:
+            with open(args.jsonl, 'r', encoding='utf-8') as f:
+                ShapeLibraryJSONDecoder().load(f, args.library)
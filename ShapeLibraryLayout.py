@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ShapeLibraryIO import ShapeLibraryFormatError, ShapeLibraryScanner
+import struct
+
+# bytes that follow the common fields, per ShapeType; None means a length-prefixed payload
+TAIL_LENGTHS = {
+    'TMyText': None,
+    'TMyLine': 7,
+    'TMyPolygon': 7,
+    'TMyPolyLine': 7,
+    'TMyFreeLine': 7,
+    'TMyImage': None,
+    'TMyGroup': 16,
+    'TMyCombine': 16,
+    'TMyElliArc': 2,
+    'TMySpiral': 8,
+    'TMySinusLine': 4,
+}
+CONTAINER_TYPES = ['TMyGroup', 'TMyCombine']
+
+class RawShape(object):
+    # field offsets of one encoded shape; the *_offset bases follow each variable-length part
+    __slots__ = ['offset', 'type', 'auto_number', 'shape_ref', 'parent_ref', 'child_refs', 'points_offset', 'points_count',
+        'style_offset', 'font_offset', 'flags_offset', 'options_offset', 'tail_offset', 'end', 'parent', 'depth']
+    
+    def rotation(self, buffer):
+        return struct.unpack_from('<f', buffer, self.style_offset + 16)[0]
+    
+    def fill_color(self, buffer):
+        return struct.unpack_from('BBB', buffer, self.style_offset + 28)
+    
+    def font_color(self, buffer):
+        return struct.unpack_from('BBB', buffer, self.font_offset + 1)
+    
+    def font_size(self, buffer):
+        return struct.unpack_from('<l', buffer, self.font_offset + 9)[0]
+    
+    def text_style(self, buffer):
+        return struct.unpack_from('b', buffer, self.font_offset + 18)[0]
+    
+    def stroke_color(self, buffer):
+        return struct.unpack_from('BBB', buffer, self.font_offset + 32)
+    
+    def stroke_type(self, buffer):
+        return struct.unpack_from('b', buffer, self.font_offset + 37)[0]
+    
+    def stroke_width(self, buffer):
+        return struct.unpack_from('<l', buffer, self.font_offset + 38)[0]
+    
+    def flips(self, buffer):
+        flip_horizontal, flip_vertical = struct.unpack_from('bb', buffer, self.flags_offset)
+        return flip_horizontal != 0, flip_vertical != 0
+    
+    def options(self, buffer):
+        locked, = struct.unpack_from('b', buffer, self.options_offset + 10)
+        rotatable, resizable, parent_center = struct.unpack_from('bbb', buffer, self.options_offset + 14)
+        return locked != 0, rotatable != 0, resizable != 0, parent_center != 0
+
+class RawEntry(object):
+    def __init__(self, width, height, shape_count, shapes, end):
+        self.width = width
+        self.height = height
+        self.shape_count = shape_count
+        self.shapes = shapes
+        self.end = end
+
+class ShapeLayoutParser(object):
+    # walks encoded shapes directly on a buffer, without building Shape objects
+    def __init__(self):
+        self.__scanner = ShapeLibraryScanner(digests=False)
+    
+    def parse_entry(self, buffer, offset, length):
+        end = offset + length
+        width, height = self.__unpack('<ll', buffer, offset, end)
+        position = self.__scanner.skip_i18n_text(buffer, offset + 8, end)
+        shape_count, = self.__unpack('<l', buffer, position, end)
+        shapes = []
+        position = self.__parse_shape(buffer, position + 4, end, -1, 0, shapes)
+        stack = self.__children(shapes, 0)
+        while len(stack) > 0:
+            parent, remaining = stack[-1]
+            if remaining == 0:
+                stack.pop()
+                continue
+            stack[-1] = (parent, remaining - 1)
+            position = self.__parse_shape(buffer, position, end, parent, shapes[parent].depth + 1, shapes)
+            stack.extend(self.__children(shapes, len(shapes) - 1))
+        return RawEntry(width, height, shape_count, shapes, position)
+    
+    def __children(self, shapes, index):
+        shape = shapes[index]
+        if shape.type in CONTAINER_TYPES and len(shape.child_refs) > 0:
+            return [(index, len(shape.child_refs))]
+        return []
+    
+    def __parse_shape(self, buffer, position, end, parent, depth, shapes):
+        shape = RawShape()
+        shape.offset = position
+        shape.parent = parent
+        shape.depth = depth
+        shape.type = bytes(self.__bytes(buffer, position, 16, end)).decode('iso-8859-1').rstrip()
+        if shape.type not in TAIL_LENGTHS:
+            raise ShapeLibraryFormatError('unknown ShapeType "%s"' % shape.type, position)
+        shape.auto_number, shape.shape_ref = self.__unpack('<ll', buffer, position + 20, end)
+        shape.parent_ref, child_count = self.__unpack('<ll', buffer, position + 32, end)
+        if child_count < 0:
+            raise ShapeLibraryFormatError('negative child shape count', position + 36)
+        shape.child_refs = self.__unpack('<%dl' % child_count, buffer, position + 40, end)
+        position += 40 + 4 * child_count
+        shape.points_count, = self.__unpack('<l', buffer, position + 4, end)
+        if shape.points_count < 0:
+            raise ShapeLibraryFormatError('negative point count', position + 4)
+        shape.points_offset = position + 8
+        self.__bytes(buffer, shape.points_offset, 8 * shape.points_count, end)
+        shape.style_offset = position + 8 + 8 * shape.points_count
+        position = self.__skip_pascal32(buffer, shape.style_offset + 33, end)  # ShapeName
+        position = self.__skip_pascal32(buffer, position + 8, end)  # FontName
+        shape.font_offset = position
+        shape.flags_offset = self.__scanner.skip_i18n_text(buffer, position + 42, end)
+        comment_count, = self.__unpack('<l', buffer, shape.flags_offset + 3, end)
+        position = shape.flags_offset + 7
+        for i in range(comment_count):
+            position = self.__skip_pascal32(buffer, position, end)
+        shape.options_offset = position
+        shape.tail_offset = position + 17
+        shape.end = self.__skip_tail(buffer, shape.type, shape.tail_offset, end)
+        shapes.append(shape)
+        return shape.end
+    
+    def __skip_tail(self, buffer, type, position, end):
+        if type == 'TMyText':
+            position = self.__skip_pascal32(buffer, position + 6, end)  # Text
+            self.__bytes(buffer, position, 3, end)
+            return position + 3
+        if type == 'TMyImage':
+            length, = self.__unpack('<q', buffer, position, end)
+            if length < 0:
+                raise ShapeLibraryFormatError('negative bitmap length', position)
+            self.__bytes(buffer, position + 8, length, end)
+            return position + 8 + length
+        self.__bytes(buffer, position, TAIL_LENGTHS[type], end)
+        return position + TAIL_LENGTHS[type]
+    
+    def __skip_pascal32(self, buffer, position, end):
+        length, = self.__unpack('<l', buffer, position, end)
+        if length < 0:
+            raise ShapeLibraryFormatError('negative string length', position)
+        self.__bytes(buffer, position + 4, length, end)
+        return position + 4 + length
+    
+    def __unpack(self, format, buffer, position, end):
+        if position + struct.calcsize(format) > end:
+            raise ShapeLibraryFormatError('record is truncated', position)
+        return struct.unpack_from(format, buffer, position)
+    
+    def __bytes(self, buffer, position, length, end):
+        if position + length > end:
+            raise ShapeLibraryFormatError('field of %d bytes is truncated' % length, position)
+        return memoryview(buffer)[position:position + length]
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ShapeLibraryIO import ShapeLibraryScanner
+import argparse
+import os
+import os.path
+import struct
+
+class ShapeLibraryMerger(object):
+    KEEP_FIRST = 'first'
+    KEEP_LAST = 'last'
+    RENAME = 'rename'
+    SOURCE_ORDER = 'source'
+    NAME_ORDER = 'name'
+    CHUNK_SIZE = 1 << 20
+    
+    def __init__(self, conflict=KEEP_FIRST, skip_identical=True, order=SOURCE_ORDER):
+        self.__conflict = conflict
+        self.__skip_identical = skip_identical
+        self.__order = order
+    
+    def plan(self, indexes):
+        # returns [(record, output name)]; nothing is decoded, records are only compared by name and digest
+        merged = []
+        positions = {}  # output name: position in merged
+        kept = {}  # name: positions of the records kept for it, renamed ones included
+        skipped = []
+        for index in indexes:
+            for record in index.records:
+                if record.name not in positions:
+                    positions[record.name] = len(merged)
+                    kept[record.name] = [len(merged)]
+                    merged.append((record, record.name))
+                    continue
+                existing = merged[positions[record.name]][0]
+                candidates = kept.setdefault(record.name, [positions[record.name]])
+                if self.__skip_identical and any(merged[position][0].digest == record.digest for position in candidates):
+                    skipped.append(record)
+                elif self.__conflict == self.KEEP_FIRST:
+                    skipped.append(record)
+                elif self.__conflict == self.KEEP_LAST:
+                    skipped.append(existing)
+                    merged[positions[record.name]] = (record, record.name)
+                else:
+                    name = self.__unique_name(record.name, positions)
+                    positions[name] = len(merged)
+                    candidates.append(len(merged))
+                    merged.append((record, name))
+        if self.__order == self.NAME_ORDER:
+            merged.sort(key=lambda item: item[1])
+        return merged, skipped
+    
+    def merge(self, paths, output):
+        scanner = ShapeLibraryScanner()
+        indexes = [scanner.scan(path) for path in paths]
+        merged, skipped = self.plan(indexes)
+        temporary = output + '.tmp'
+        sources = {}
+        try:
+            with open(temporary, 'wb') as f:
+                self.__copy(self.__source(sources, indexes[0].path), 0, indexes[0].header_length, f)
+                for record, name in merged:
+                    source = self.__source(sources, record.path)
+                    if name == record.name:
+                        self.__copy(source, record.offset, record.end - record.offset, f)
+                    else:
+                        encoded = name.encode('iso-8859-1')
+                        f.write(struct.pack('<b', len(encoded)) + encoded + struct.pack('<l', record.length))
+                        self.__copy(source, record.contents_offset, record.length, f)
+        except:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+            raise
+        finally:
+            for source in sources.values():
+                source.close()
+        # as ShapeLibraryWriter does: the old output becomes the backup
+        if os.path.exists(output):
+            os.replace(output, output + '.bak')
+        os.replace(temporary, output)
+        return merged, skipped
+    
+    def __unique_name(self, name, positions):
+        number = 2
+        while True:
+            suffix = ' (%d)' % number
+            candidate = name.encode('iso-8859-1')[:127 - len(suffix)].decode('iso-8859-1') + suffix
+            if candidate not in positions:
+                return candidate
+            number += 1
+    
+    def __source(self, sources, path):
+        if path not in sources:
+            sources[path] = open(path, 'rb')
+        return sources[path]
+    
+    def __copy(self, source, offset, length, f):
+        source.seek(offset)
+        while length > 0:
+            data = source.read(min(self.CHUNK_SIZE, length))
+            if data == b'':
+                raise IOError('%s is truncated' % source.name)
+            f.write(data)
+            length -= len(data)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merge LabaNotator shape libraries by copying entry records byte for byte. The library name and read-only flag are taken from the first source.')
+    parser.add_argument('output')
+    parser.add_argument('sources', nargs='+', metavar='source')
+    parser.add_argument('--conflict', choices=[ShapeLibraryMerger.KEEP_FIRST, ShapeLibraryMerger.KEEP_LAST, ShapeLibraryMerger.RENAME], default=ShapeLibraryMerger.KEEP_FIRST, help='what to do with entries whose name is already taken (default: first)')
+    parser.add_argument('--keep-identical', action='store_true', help='apply the conflict policy even to byte-identical entries instead of dropping them')
+    parser.add_argument('--order', choices=[ShapeLibraryMerger.SOURCE_ORDER, ShapeLibraryMerger.NAME_ORDER], default=ShapeLibraryMerger.SOURCE_ORDER, help='entry order of the output (default: source)')
+    args = parser.parse_args()
+    
+    merger = ShapeLibraryMerger(args.conflict, not args.keep_identical, args.order)
+    merged, skipped = merger.merge(args.sources, args.output)
+    print('%d entries written, %d skipped' % (len(merged), len(skipped)))
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ShapeLibraryIO import BufferFile, ShapeLibraryFormatError, ShapeLibraryIndex, ShapeLibraryReader, ShapeLibraryRecord, ShapeLibraryScanner, find_libraries
+import argparse
+import mmap
+import os
+import os.path
+import struct
+
+class PackedLibrary(object):
+    def __init__(self, name, offset, length, index):
+        self.__name = name
+        self.__offset = offset
+        self.__length = length
+        self.__index = index
+    
+    @property
+    def name(self):
+        return self.__name
+    
+    @property
+    def offset(self):
+        return self.__offset
+    
+    @property
+    def length(self):
+        return self.__length
+    
+    @property
+    def index(self):
+        # records point into the pack file, so ShapeLibraryPack.read_record (or ShapeLibraryReader.read_record) and record.read work on them unchanged
+        return self.__index
+    
+    @property
+    def records(self):
+        return self.__index.records
+    
+    def __repr__(self):
+        return 'PackedLibrary(%r, %d, %d)' % (self.__name, self.__offset, self.__length)
+
+def export_path(directory, name):
+    # names come from the pack file, so one must not lead out of directory
+    parts = name.split('/')
+    for part in parts:
+        if part in ['', '.', '..'] or os.path.isabs(part) or os.path.splitdrive(part)[0] != '' or os.sep in part or (os.altsep is not None and os.altsep in part):
+            raise ValueError('unsafe library name "%s"' % name)
+    return os.path.join(directory, *parts)
+
+class ShapeLibraryPack(object):
+    # layout: magic, int64 index offset, int64 index length, the .lib files byte for byte, then the index
+    #   index:   int32 library count, then per library
+    #            pascal32 name (utf-8), int64 offset, int64 length, int32 header length, sha1 (20) of the header, int32 entry count
+    #            and per entry: pascal8 name, int64 record offset, int32 contents length, sha1 (20) of the contents
+    MAGIC = b'SLPACK01'
+    HEADER = struct.Struct('<8sqq')
+    LIBRARY = struct.Struct('<qql20sl')
+    ENTRY = struct.Struct('<ql20s')
+    CHUNK_SIZE = 1 << 20
+    
+    def __init__(self, path):
+        self.__path = path
+        self.__buffer = None
+        self.__file = open(path, 'rb')
+        try:
+            self.__buffer = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.__libraries = self.__read_index()
+        except:
+            self.close()
+            raise
+        self.__names = dict((library.name, library) for library in self.__libraries)
+    
+    @classmethod
+    def create(cls, output, paths, scanner=None):
+        # paths are .lib files or directories; libraries are named by their path relative to the directory given
+        scanner = ShapeLibraryScanner() if scanner is None else scanner
+        libraries = []
+        for root in paths:
+            for path in find_libraries([root]):
+                name = os.path.relpath(path, root) if os.path.isdir(root) else os.path.basename(path)
+                libraries.append((name.replace(os.sep, '/'), path))
+        names = [name for name, path in libraries]
+        if len(set(names)) != len(names):
+            raise ValueError('library names are not unique: %s' % ', '.join(sorted(set(name for name in names if names.count(name) > 1))))
+        temporary = output + '.tmp'
+        try:
+            with open(temporary, 'wb') as f:
+                f.write(cls.HEADER.pack(cls.MAGIC, 0, 0))
+                index = [struct.pack('<l', len(libraries))]
+                for name, path in libraries:
+                    library = scanner.scan(path)
+                    offset = f.tell()
+                    with open(path, 'rb') as source:
+                        for data in iter(lambda: source.read(cls.CHUNK_SIZE), b''):
+                            f.write(data)
+                    if f.tell() - offset != library.size:
+                        raise IOError('%s changed while it was packed' % path)
+                    encoded = name.encode('utf-8')
+                    index.append(struct.pack('<l', len(encoded)) + encoded)
+                    index.append(cls.LIBRARY.pack(offset, library.size, library.header_length, bytes.fromhex(library.header_digest), len(library.records)))
+                    for record in library.records:
+                        encoded = record.name.encode('iso-8859-1')
+                        index.append(struct.pack('<b', len(encoded)) + encoded)
+                        index.append(cls.ENTRY.pack(offset + record.offset, record.length, bytes.fromhex(record.digest)))
+                index_offset = f.tell()
+                f.write(b''.join(index))
+                index_length = f.tell() - index_offset
+                f.seek(0)
+                f.write(cls.HEADER.pack(cls.MAGIC, index_offset, index_length))
+        except:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+            raise
+        os.replace(temporary, output)
+        return cls(output)
+    
+    @property
+    def path(self):
+        return self.__path
+    
+    @property
+    def libraries(self):
+        return self.__libraries
+    
+    def __getitem__(self, name):
+        return self.__names[name]
+    
+    def __contains__(self, name):
+        return name in self.__names
+    
+    def library_bytes(self, name):
+        # the .lib file exactly as it was packed
+        library = self.__names[name]
+        return self.__buffer[library.offset:library.offset + library.length]
+    
+    def read(self, name, reader=None):
+        # from the mapping, like open and read_record; only lazy bitmaps open the pack file when they are loaded
+        library = self.__names[name]
+        reader = ShapeLibraryReader() if reader is None else reader
+        return reader.read(self.__path, library.offset, library.length, BufferFile(self.__buffer))
+    
+    def open(self, name, reader=None):
+        library = self.__names[name]
+        reader = ShapeLibraryReader() if reader is None else reader
+        return reader.open(self.__path, library.offset, library.length, BufferFile(self.__buffer))
+    
+    def read_record(self, record, reader=None):
+        # record is one of the records of the pack's libraries
+        reader = ShapeLibraryReader() if reader is None else reader
+        return reader.read_record(record, BufferFile(self.__buffer))
+    
+    def export(self, name, path):
+        library = self.__names[name]
+        temporary = path + '.tmp'
+        try:
+            with open(temporary, 'wb') as f:
+                for position in range(library.offset, library.offset + library.length, self.CHUNK_SIZE):
+                    f.write(self.__buffer[position:min(position + self.CHUNK_SIZE, library.offset + library.length)])
+        except:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+            raise
+        os.replace(temporary, path)
+    
+    def close(self):
+        if self.__buffer is not None:
+            self.__buffer.close()
+            self.__buffer = None
+        self.__file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, type, value, traceback):
+        self.close()
+    
+    def __read_index(self):
+        size = len(self.__buffer)
+        if size < self.HEADER.size:
+            raise ShapeLibraryFormatError('bad pack magic', 0)
+        magic, position, index_length = self.HEADER.unpack_from(self.__buffer, 0)
+        if magic != self.MAGIC:
+            raise ShapeLibraryFormatError('bad pack magic', 0)
+        end = position + index_length
+        if position < self.HEADER.size or end > size:
+            raise ShapeLibraryFormatError('pack index is out of range', 8)
+        try:
+            count, = struct.unpack_from('<l', self.__buffer, position)
+            position += 4
+            libraries = []
+            for i in range(count):
+                length, = struct.unpack_from('<l', self.__buffer, position)
+                name = self.__buffer[position + 4:position + 4 + length].decode('utf-8')
+                position += 4 + length
+                offset, library_length, header_length, header_digest, entry_count = self.LIBRARY.unpack_from(self.__buffer, position)
+                position += self.LIBRARY.size
+                records = []
+                for j in range(entry_count):
+                    length, = struct.unpack_from('<b', self.__buffer, position)
+                    entry_name = self.__buffer[position + 1:position + 1 + length].decode('iso-8859-1')
+                    position += 1 + length
+                    record_offset, contents_length, digest = self.ENTRY.unpack_from(self.__buffer, position)
+                    position += self.ENTRY.size
+                    records.append(ShapeLibraryRecord(self.__path, entry_name, record_offset, record_offset + 5 + length, contents_length, digest.hex()))
+                index = ShapeLibraryIndex(self.__path, library_length, header_length, header_digest.hex(), records)
+                libraries.append(PackedLibrary(name, offset, library_length, index))
+        except struct.error:
+            raise ShapeLibraryFormatError('pack index is truncated', position)
+        if position != end:
+            raise ShapeLibraryFormatError('pack index has %d unexpected bytes' % (end - position), position)
+        return libraries
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bundle LabaNotator shape libraries into one indexed pack file, and get them back out.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    create_parser = subparsers.add_parser('create', help='pack .lib files (or the .lib files under directories)')
+    create_parser.add_argument('pack')
+    create_parser.add_argument('paths', nargs='+', metavar='path')
+    list_parser = subparsers.add_parser('list', help='list the libraries and entries of a pack')
+    list_parser.add_argument('pack')
+    export_parser = subparsers.add_parser('export', help='write packed libraries back to .lib files')
+    export_parser.add_argument('pack')
+    export_parser.add_argument('directory')
+    export_parser.add_argument('names', nargs='*', metavar='name', help='libraries to export (default: all)')
+    args = parser.parse_args()
+    
+    if args.command == 'create':
+        with ShapeLibraryPack.create(args.pack, args.paths) as pack:
+            print('%d libraries, %d entries' % (len(pack.libraries), sum(len(library.records) for library in pack.libraries)))
+    elif args.command == 'list':
+        with ShapeLibraryPack(args.pack) as pack:
+            for library in pack.libraries:
+                print('%s (%d bytes, %d entries)' % (library.name, library.length, len(library.records)))
+                for record in library.records:
+                    print('    %s (%d bytes, %s)' % (record.name, record.length, record.digest))
+    else:
+        with ShapeLibraryPack(args.pack) as pack:
+            names = args.names or [library.name for library in pack.libraries]
+            try:
+                paths = [export_path(args.directory, name) for name in names]
+            except ValueError as e:
+                parser.error(str(e))
+            for name, path in zip(names, paths):
+                if os.path.dirname(path) != '':
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                pack.export(name, path)
+                print(path)
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ShapeLibrary import RawShapeLibraryEntry
+from ShapeLibraryIO import ShapeLibraryReader, ShapeLibraryScanner, find_libraries
+from ShapeLibraryEntryCache import ShapeLibraryEntryCache
+from ShapeLibraryJSON import ShapeLibraryJSONEncoder
+import argparse
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import os
+import os.path
+import re
+import urllib.parse
+
+class HTTPError(Exception):
+    def __init__(self, status, reason, message=None):
+        # message, if given, is the error of the response body instead of reason
+        Exception.__init__(self, '%d %s' % (status, reason))
+        self.status = status
+        self.reason = reason
+        self.message = reason if message is None else message
+
+class ShapeLibraryServer(object):
+    # read-only; libraries are the .lib files under the root directories, addressed by their quoted relative path
+    #   GET /libraries                                   all libraries
+    #   GET /libraries/<library>                         library header and entry list
+    #   GET /libraries/<library>/entries/<index>         one entry as JSON (ShapeLibraryJSONEncoder); 422 if it cannot be decoded
+    #   GET /libraries/<library>/entries/<index>/raw     one entry record, exactly as stored in the file
+    def __init__(self, roots, max_entries=256, workers=None, max_bytes=None):
+        self.__roots = [os.path.abspath(root) for root in roots]
+        self.__executor = concurrent.futures.ThreadPoolExecutor(workers)
+        self.__reader = ShapeLibraryReader(tolerant=True)  # an undecodable entry fails its own request only
+        self.__scanner = ShapeLibraryScanner()
+        self.__encoder = ShapeLibraryJSONEncoder()
+        self.__libraries = {}
+        self.__indexes = {}
+        self.__entries = ShapeLibraryEntryCache(max_entries, max_bytes, self.__reader)
+    
+    async def serve(self, host='127.0.0.1', port=8080):
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+    
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if request_line.strip() == b'':
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line.strip() == b'':
+                        break
+                    key, _, value = line.decode('iso-8859-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                parts = request_line.decode('iso-8859-1').split()
+                if len(parts) != 3:
+                    self.__respond(writer, 400, 'Bad Request', self.__error_body(400, 'Bad Request'))
+                    break
+                method, target, version = parts
+                await self.__dispatch(writer, method, target, headers)
+                await writer.drain()
+                if version == 'HTTP/1.0' or headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+    
+    async def __dispatch(self, writer, method, target, headers):
+        try:
+            if method not in ['GET', 'HEAD']:
+                raise HTTPError(405, 'Method Not Allowed')
+            status, content_type, etag, body = await self.__route(urllib.parse.urlsplit(target).path)
+            if etag is not None and self.__matches(headers.get('if-none-match'), etag):
+                self.__respond(writer, 304, 'Not Modified', None, etag=etag)
+            else:
+                self.__respond(writer, status, 'OK', body, content_type, etag, method == 'HEAD')
+        except HTTPError as e:
+            self.__respond(writer, e.status, e.reason, self.__error_body(e.status, e.message), head=method == 'HEAD')
+        except Exception as e:
+            self.__respond(writer, 500, 'Internal Server Error', self.__error_body(500, str(e)), head=method == 'HEAD')
+    
+    async def __route(self, path):
+        segments = path.strip('/').split('/')
+        if segments[0] != 'libraries' or len(segments) > 5:
+            raise HTTPError(404, 'Not Found')
+        if len(segments) == 1:
+            return await self.__library_list()
+        library = urllib.parse.unquote(segments[1])
+        index = await self.__index(library)
+        if len(segments) == 2:
+            return await self.__library(library, index)
+        if segments[2] != 'entries' or len(segments) < 4 or re.fullmatch('[0-9]+', segments[3]) is None or int(segments[3]) >= len(index.records):
+            raise HTTPError(404, 'Not Found')
+        record = index.records[int(segments[3])]
+        if len(segments) == 4:
+            return await self.__entry(record)
+        if segments[4] == 'raw':
+            data = await self.__run(record.read)
+            return 200, 'application/octet-stream', self.__digest([record.name, record.digest]), data
+        raise HTTPError(404, 'Not Found')
+    
+    async def __library_list(self):
+        self.__libraries = await self.__run(self.__find_libraries)
+        libraries = []
+        for library in sorted(self.__libraries):
+            try:
+                index = await self.__index(library)
+            except (IOError, OSError) as e:
+                libraries.append({'id': library, 'error': str(e), 'etag': self.__digest([str(e)])})
+                continue
+            libraries.append({'id': library, 'entries': len(index.records), 'size': index.size, 'etag': self.__library_etag(index)})
+        return self.__json(libraries, self.__digest(library['etag'] for library in libraries))
+    
+    async def __library(self, library, index):
+        header = self.__indexes[self.__libraries[library]][2]
+        records = [{'index': i, 'name': record.name, 'length': record.length, 'sha1': record.digest} for i, record in enumerate(index.records)]
+        return self.__json({'id': library, 'header': header, 'entries': records}, self.__library_etag(index))
+    
+    async def __entry(self, record):
+        entry = await self.__run(self.__entries.get, record)
+        if isinstance(entry, RawShapeLibraryEntry):
+            self.__reader.diagnostics.clear()  # reported here; nothing else reads them, so they must not pile up
+            raise HTTPError(422, 'Unprocessable Entity', 'entry "%s" cannot be decoded: %s' % (entry.name, entry.error))
+        obj = await self.__run(self.__encoder.encode_entry, entry)
+        return self.__json(obj, self.__digest([record.name, record.digest, 'json']))
+    
+    async def __index(self, library):
+        if library not in self.__libraries:
+            self.__libraries = await self.__run(self.__find_libraries)
+            if library not in self.__libraries:
+                raise HTTPError(404, 'Not Found')
+        path = self.__libraries[library]
+        try:
+            stat = os.stat(path)
+        except OSError:
+            raise HTTPError(404, 'Not Found')
+        cached = self.__indexes.get(path)
+        if cached is None or cached[0] != (stat.st_size, stat.st_mtime_ns):
+            index, header = await self.__run(self.__scan, path)
+            cached = self.__indexes[path] = ((stat.st_size, stat.st_mtime_ns), index, header)
+        return cached[1]
+    
+    def __scan(self, path):
+        with self.__reader.open(path) as stream:
+            header = self.__encoder.encode_header(stream.library)
+        return self.__scanner.scan(path), header
+    
+    def __find_libraries(self):
+        libraries = {}
+        for root in self.__roots:
+            for path in find_libraries([root]):
+                library = os.path.relpath(path, root).replace(os.sep, '/')
+                libraries.setdefault(library, os.path.abspath(path))
+        return libraries
+    
+    async def __run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.__executor, function, *args)
+    
+    def __library_etag(self, index):
+        # digests cover the contents only; names and positions are part of the listing too
+        values = [index.header_digest]
+        for i, record in enumerate(index.records):
+            values.extend([str(i), record.name, record.digest])
+        return self.__digest(values)
+    
+    def __digest(self, values):
+        # every ETag is a hash of everything its body depends on
+        sha1 = hashlib.sha1()
+        for value in values:
+            sha1.update(value.encode('utf-8') + b'\0')
+        return '"%s"' % sha1.hexdigest()
+    
+    def __json(self, obj, etag):
+        if not etag.startswith('"'):
+            etag = '"%s"' % etag
+        return 200, 'application/json; charset=utf-8', etag, json.dumps(obj, ensure_ascii=False).encode('utf-8')
+    
+    def __error_body(self, status, reason):
+        return json.dumps({'status': status, 'error': reason}).encode('utf-8')
+    
+    def __matches(self, if_none_match, etag):
+        if if_none_match is None:
+            return False
+        candidates = [candidate.strip() for candidate in if_none_match.split(',')]
+        return '*' in candidates or etag in candidates or 'W/' + etag in candidates
+    
+    def __respond(self, writer, status, reason, body, content_type='application/json; charset=utf-8', etag=None, head=False):
+        lines = ['HTTP/1.1 %d %s' % (status, reason)]
+        if etag is not None:
+            lines.append('ETag: %s' % etag)
+            lines.append('Cache-Control: no-cache')
+        if body is not None:
+            lines.append('Content-Type: %s' % content_type)
+            lines.append('Content-Length: %d' % len(body))
+        else:
+            lines.append('Content-Length: 0')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('iso-8859-1'))
+        if body is not None and not head:
+            writer.write(body)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve LabaNotator shape libraries read-only over HTTP (JSON and raw entry records, with ETags).')
+    parser.add_argument('roots', nargs='+', metavar='directory', help='directory to serve .lib files from')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--cache-entries', type=int, default=256, help='number of decoded entries kept in memory (default: 256)')
+    parser.add_argument('--cache-megabytes', type=float, default=None, help='estimated memory of the decoded entries kept in memory (default: no limit)')
+    parser.add_argument('--workers', type=int, default=None, help='threads used for reading and decoding')
+    args = parser.parse_args()
+    
+    server = ShapeLibraryServer(args.roots, args.cache_entries, args.workers, None if args.cache_megabytes is None else int(args.cache_megabytes * (1 << 20)))
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import cProfile
+import json
+import pstats
+import sys
+import tracemalloc
+
+class ShapeLibraryStats(object):
+    # filled by ShapeLibraryReader(stats=...) and ShapeLibraryWriter(stats=...)
+    def __init__(self):
+        self.entries = 0
+        self.raw_entries = 0
+        self.copied_entries = 0
+        self.shapes = {}
+        self.bytes = {}
+        self.i18n_strings = 0
+        self.bitmaps = 0
+        self.bitmap_bytes = 0
+        self.times = {}
+        self.__pending_shape_bytes = 0
+    
+    def add_time(self, phase, seconds):
+        self.times[phase] = self.times.get(phase, 0.0) + seconds
+    
+    def add_bytes(self, group, count):
+        self.bytes[group] = self.bytes.get(group, 0) + count
+    
+    def count_library(self, sl, size):
+        self.i18n_strings += len(list(sl.name))
+        self.add_bytes('header', size)
+    
+    def count_entry(self, entry, size):
+        self.entries += 1
+        self.i18n_strings += len(list(entry.i18n_name))
+        self.add_bytes('entry', size - self.__pending_shape_bytes)
+        self.__pending_shape_bytes = 0
+    
+    def count_copied_entry(self, entry, size):
+        # written by copying its record, so its shapes are not counted
+        self.entries += 1
+        self.copied_entries += 1
+        self.i18n_strings += len(list(entry.i18n_name))
+        self.add_bytes('copied', size)
+    
+    def count_raw_entry(self, entry, size):
+        self.raw_entries += 1
+        self.add_bytes('raw', size)
+    
+    def checkpoint(self):
+        return (dict(self.shapes), dict(self.bytes), self.i18n_strings, self.bitmaps, self.bitmap_bytes, self.__pending_shape_bytes)
+    
+    def rollback(self, checkpoint):
+        # forgets what a partly decoded entry counted before it was kept as a raw record
+        shapes, bytes, self.i18n_strings, self.bitmaps, self.bitmap_bytes, self.__pending_shape_bytes = checkpoint
+        self.shapes = dict(shapes)
+        self.bytes = dict(bytes)
+    
+    def count_shape(self, shape, size):
+        # size covers the fields of the shape, not its children
+        self.shapes[shape.type] = self.shapes.get(shape.type, 0) + 1
+        groups = {
+            'references': 4 + 4 * len(shape['ChildShapeRefs'] or []),
+            'points': 4 + 8 * len(shape.points),
+            'strings': 12 + len(shape.name) + len(shape['FontName'] or '') + sum(4 + len(comment) for comment in shape['Comments'] or []),
+            'i18n': 0,
+        }
+        if shape['Text'] is not None:
+            groups['strings'] += 4 + len(shape['Text'])
+        if shape['_Reserved23'] is not None:
+            self.i18n_strings += len(list(shape['_Reserved23']))
+            groups['i18n'] = 4 + sum(8 + len('Caption%04d' % locale.lcid) + len(shape['_Reserved23'][locale].encode(locale.encoding)) for locale in shape['_Reserved23'])
+        if shape['Bitmap'] is not None:
+            self.bitmaps += 1
+            self.bitmap_bytes += len(shape['Bitmap'])
+            groups['bitmap'] = 8 + len(shape['Bitmap'])
+        groups['fields'] = size - sum(groups.values())
+        for group, count in groups.items():
+            self.add_bytes(group, count)
+        self.__pending_shape_bytes += size
+    
+    def to_dict(self):
+        return {
+            'entries': self.entries,
+            'raw_entries': self.raw_entries,
+            'copied_entries': self.copied_entries,
+            'shapes': dict(self.shapes),
+            'bytes': dict(self.bytes),
+            'i18n_strings': self.i18n_strings,
+            'bitmaps': self.bitmaps,
+            'bitmap_bytes': self.bitmap_bytes,
+            'times': dict(self.times),
+        }
+    
+    def dump_json(self, f):
+        json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+    
+    def __str__(self):
+        lines = ['entries: %d' % self.entries, 'undecoded entries: %d' % self.raw_entries, 'copied entries: %d' % self.copied_entries, 'i18n strings: %d' % self.i18n_strings, 'bitmaps: %d (%d bytes)' % (self.bitmaps, self.bitmap_bytes)]
+        lines.extend('shapes %-16s %d' % item for item in sorted(self.shapes.items()))
+        lines.extend('bytes  %-16s %d' % item for item in sorted(self.bytes.items()))
+        lines.extend('time   %-16s %.6f s' % item for item in sorted(self.times.items()))
+        return '\n'.join(lines)
+
+def profile(function, *args, memory=False, limit=25, stream=None):
+    # runs function(*args) under cProfile (and tracemalloc if memory is set) and prints the report
+    stream = sys.stderr if stream is None else stream
+    profiler = cProfile.Profile()
+    if memory:
+        tracemalloc.start()
+    try:
+        result = profiler.runcall(function, *args)
+        if memory:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+    finally:
+        if memory:
+            tracemalloc.stop()
+    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(limit)
+    if memory:
+        print('memory: %d bytes allocated, %d bytes peak' % (current, peak), file=stream)
+        for statistic in snapshot.statistics('lineno')[:limit]:
+            print(statistic, file=stream)
+    return result
+
+
+if __name__ == '__main__':
+    from ShapeLibraryIO import ShapeLibraryReader, ShapeLibraryWriter
+    
+    parser = argparse.ArgumentParser(description='Read (and optionally write) a LabaNotator shape library and report what it contains and where time goes.')
+    parser.add_argument('library')
+    parser.add_argument('--write', metavar='PATH', help='also write the library to PATH and report the write')
+    parser.add_argument('--json', metavar='PATH', help="write the statistics as JSON to PATH ('-' for standard output)")
+    parser.add_argument('--tolerant', action='store_true', help='keep entries that cannot be decoded as raw records and list them')
+    parser.add_argument('--profile', action='store_true', help='profile with cProfile')
+    parser.add_argument('--memory', action='store_true', help='trace allocations with tracemalloc (implies --profile)')
+    args = parser.parse_args()
+    
+    def run(function, *function_args):
+        if args.profile or args.memory:
+            return profile(function, *function_args, memory=args.memory)
+        return function(*function_args)
+    
+    results = {}
+    read_stats = ShapeLibraryStats()
+    reader = ShapeLibraryReader(read_stats, args.tolerant)
+    sl = run(reader.read, args.library)
+    results['read'] = read_stats
+    for diagnostic in reader.diagnostics:
+        print(diagnostic, file=sys.stderr)
+    if args.write is not None:
+        write_stats = ShapeLibraryStats()
+        run(ShapeLibraryWriter(write_stats).write, args.write, sl)
+        results['write'] = write_stats
+    if args.json is None:
+        for name, stats in results.items():
+            print('[%s]' % name)
+            print(stats)
+    else:
+        document = dict((name, stats.to_dict()) for name, stats in results.items())
+        if args.json == '-':
+            json.dump(document, sys.stdout, indent=2, sort_keys=True)
+        else:
+            with open(args.json, 'w') as f:
+                json.dump(document, f, indent=2, sort_keys=True)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ShapeLibraryIO import ShapeLibraryFormatError, ShapeLibraryScanner, find_libraries
+from ShapeLibraryLayout import ShapeLayoutParser, CONTAINER_TYPES
+import argparse
+import concurrent.futures
+import mmap
+import os
+import sys
+
+class ValidationIssue(object):
+    def __init__(self, path, offset, message, entry=None):
+        self.path = path
+        self.offset = offset
+        self.message = message
+        self.entry = entry
+    
+    def __str__(self):
+        location = '%s:%d' % (self.path, self.offset) if self.offset is not None else self.path
+        if self.entry is not None:
+            return '%s: entry "%s": %s' % (location, self.entry, self.message)
+        return '%s: %s' % (location, self.message)
+
+class ShapeLibraryValidator(object):
+    # checks the structure of .lib files on the raw bytes; nothing is decoded into Shape objects
+    def __init__(self):
+        self.__scanner = ShapeLibraryScanner(digests=False)
+        self.__parser = ShapeLayoutParser()
+    
+    def validate(self, path):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return [ValidationIssue(path, 0, 'file is empty')]
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                return self.validate_buffer(path, buffer)
+    
+    def validate_buffer(self, path, buffer):
+        try:
+            index = self.__scanner.scan_buffer(path, buffer)
+        except ShapeLibraryFormatError as e:
+            return [ValidationIssue(path, e.offset, e.reason)]
+        issues = []
+        for record in index.records:
+            self.__validate_record(buffer, record, issues)
+        return issues
+    
+    def __validate_record(self, buffer, record, issues):
+        def report(offset, message):
+            issues.append(ValidationIssue(record.path, offset, message, record.name))
+        
+        try:
+            entry = self.__parser.parse_entry(buffer, record.contents_offset, record.length)
+        except ShapeLibraryFormatError as e:
+            report(e.offset, e.reason)
+            return
+        if entry.end != record.end:
+            report(entry.end, '%d bytes after the shapes of the entry' % (record.end - entry.end))
+        if entry.shape_count != len(entry.shapes):
+            report(record.contents_offset, 'shape count is %d, but the entry has %d shapes' % (entry.shape_count, len(entry.shapes)))
+        children = dict((i, []) for i in range(len(entry.shapes)))
+        auto_numbers, shape_refs = {}, {}
+        for i, shape in enumerate(entry.shapes):
+            if shape.parent >= 0:
+                children[shape.parent].append(shape)
+            if shape.auto_number in auto_numbers:
+                report(shape.offset, 'ShapeAutoNumber %d is also used by the shape at offset %d' % (shape.auto_number, auto_numbers[shape.auto_number]))
+            auto_numbers.setdefault(shape.auto_number, shape.offset)
+            if shape.shape_ref in shape_refs:
+                report(shape.offset, 'ShapeRef %d is also used by the shape at offset %d' % (shape.shape_ref, shape_refs[shape.shape_ref]))
+            shape_refs.setdefault(shape.shape_ref, shape.offset)
+        for i, shape in enumerate(entry.shapes):
+            parent_ref = entry.shapes[shape.parent].shape_ref if shape.parent >= 0 else -1
+            if shape.parent_ref != parent_ref:
+                report(shape.offset, 'ParentShapeRef is %d, expected %d' % (shape.parent_ref, parent_ref))
+            if shape.type not in CONTAINER_TYPES and len(shape.child_refs) > 0:
+                report(shape.offset, '%s has %d ChildShapeRefs but cannot have children' % (shape.type, len(shape.child_refs)))
+            elif list(shape.child_refs) != [child.shape_ref for child in children[i]]:
+                report(shape.offset, 'ChildShapeRefs %s do not match the ShapeRefs of the children %s' % (list(shape.child_refs), [child.shape_ref for child in children[i]]))
+
+def validate_library(path):
+    try:
+        return ShapeLibraryValidator().validate(path)
+    except (IOError, OSError) as e:
+        return [ValidationIssue(path, None, str(e))]
+
+def validate_libraries(paths, workers=None):
+    # yields (path, issues) in the order of the paths; files are validated in parallel processes
+    paths = list(find_libraries(paths))
+    if workers == 1 or len(paths) < 2:
+        for path in paths:
+            yield path, validate_library(path)
+        return
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        for path, issues in zip(paths, executor.map(validate_library, paths, chunksize=4)):
+            yield path, issues
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the structure of LabaNotator shape libraries without decoding them.')
+    parser.add_argument('paths', nargs='+', metavar='path', help='.lib file or directory to search for .lib files')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes (default: one per CPU)')
+    parser.add_argument('-q', '--quiet', action='store_true', help='only print the files with issues')
+    args = parser.parse_args()
+    
+    invalid = 0
+    for path, issues in validate_libraries(args.paths, args.jobs):
+        if len(issues) > 0:
+            invalid += 1
+            for issue in issues:
+                print(issue)
+        elif not args.quiet:
+            print('%s: OK' % path)
+    sys.exit(1 if invalid > 0 else 0)
@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ShapeLibraryIO import ShapeLibraryScanner, find_libraries
+from ShapeLibraryDiff import record_keys
+import argparse
+import ctypes
+import os
+import os.path
+import select
+import struct
+import sys
+import time
+
+class LibraryEvent(object):
+    ADDED = 'added'
+    REMOVED = 'removed'
+    CHANGED = 'changed'
+    ERROR = 'error'
+    
+    def __init__(self, kind, path, name=None, index=None, record=None, message=None):
+        self.__kind = kind
+        self.__path = path
+        self.__name = name
+        self.__index = index
+        self.__record = record
+        self.__message = message
+    
+    @property
+    def kind(self):
+        return self.__kind
+    
+    @property
+    def path(self):
+        return self.__path
+    
+    @property
+    def name(self):
+        # None for events about the whole file (an unreadable library)
+        return self.__name
+    
+    @property
+    def index(self):
+        return self.__index
+    
+    @property
+    def record(self):
+        # the new record; the old one for removed entries
+        return self.__record
+    
+    @property
+    def message(self):
+        return self.__message
+    
+    def __repr__(self):
+        return 'LibraryEvent(%r, %r, %r, %r)' % (self.__kind, self.__path, self.__name, self.__index)
+
+class PollingNotifier(object):
+    def update(self, directories, flat_directories=()):
+        # directories are watched with their subdirectories, flat_directories (those of single watched files) without
+        pass
+    
+    def wait(self, timeout):
+        time.sleep(timeout)
+        return False
+    
+    def close(self):
+        pass
+
+class WindowsChangeNotifier(PollingNotifier):
+    FILE_NOTIFY_CHANGE_FILE_NAME = 0x01
+    FILE_NOTIFY_CHANGE_DIR_NAME = 0x02
+    FILE_NOTIFY_CHANGE_SIZE = 0x08
+    FILE_NOTIFY_CHANGE_LAST_WRITE = 0x10
+    MAXIMUM_WAIT_OBJECTS = 64
+    
+    def __init__(self):
+        self.__kernel32 = ctypes.windll.kernel32
+        self.__kernel32.FindFirstChangeNotificationW.restype = ctypes.c_void_p
+        self.__handles = {}  # (directory, recursive): handle
+    
+    def update(self, directories, flat_directories=()):
+        watches = [(directory, True) for directory in directories] + [(directory, False) for directory in flat_directories if directory not in directories]
+        for watch in set(self.__handles) - set(watches):
+            self.__kernel32.FindCloseChangeNotification(ctypes.c_void_p(self.__handles.pop(watch)))
+        flags = self.FILE_NOTIFY_CHANGE_FILE_NAME | self.FILE_NOTIFY_CHANGE_DIR_NAME | self.FILE_NOTIFY_CHANGE_SIZE | self.FILE_NOTIFY_CHANGE_LAST_WRITE
+        for directory, recursive in watches:
+            if (directory, recursive) not in self.__handles and len(self.__handles) < self.MAXIMUM_WAIT_OBJECTS:
+                handle = self.__kernel32.FindFirstChangeNotificationW(directory, recursive, flags)
+                if handle is not None and handle != ctypes.c_void_p(-1).value:
+                    self.__handles[(directory, recursive)] = handle
+    
+    def wait(self, timeout):
+        if len(self.__handles) == 0:
+            return PollingNotifier.wait(self, timeout)
+        handles = list(self.__handles.values())
+        array = (ctypes.c_void_p * len(handles))(*handles)
+        result = self.__kernel32.WaitForMultipleObjects(len(handles), array, False, int(timeout * 1000))
+        if 0 <= result < len(handles):
+            self.__kernel32.FindNextChangeNotification(ctypes.c_void_p(handles[result]))
+            return True
+        return False
+    
+    def close(self):
+        self.update([])
+
+class InotifyNotifier(PollingNotifier):
+    IN_MODIFY = 0x002
+    IN_ATTRIB = 0x004
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    EVENT = struct.Struct('iIII')  # wd, mask, cookie, name length; the name follows
+    
+    def __init__(self):
+        self.__libc = ctypes.CDLL(None, use_errno=True)
+        self.__fd = self.__libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.__fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.__watched = {}  # directory: watch descriptor
+        self.__directories = {}  # watch descriptor: directory
+        self.__flat = set()  # watched directories whose subdirectories are not
+    
+    def update(self, directories, flat_directories=()):
+        # inotify is not recursive, so every subdirectory gets its own watch; a root is walked once, and
+        # directories created or moved in later are added by wait from the events
+        for root in directories:
+            if root not in self.__watched or root in self.__flat:
+                self.__add_tree(root)
+        for directory in flat_directories:
+            if directory not in self.__watched:
+                self.__add_watch(directory)
+                self.__flat.add(directory)
+    
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.__fd], [], [], timeout)
+        if len(readable) == 0:
+            return False
+        data = []
+        try:
+            for chunk in iter(lambda: os.read(self.__fd, 65536), b''):
+                data.append(chunk)
+        except BlockingIOError:
+            pass
+        self.__handle_events(b''.join(data))
+        return True
+    
+    def close(self):
+        os.close(self.__fd)
+    
+    def __add_tree(self, root):
+        for directory, subdirectories, filenames in os.walk(root):
+            self.__flat.discard(directory)
+            if directory not in self.__watched:
+                self.__add_watch(directory)
+    
+    def __add_watch(self, directory):
+        mask = self.IN_MODIFY | self.IN_ATTRIB | self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+        wd = self.__libc.inotify_add_watch(self.__fd, os.fsencode(directory), mask)
+        if wd >= 0:
+            self.__watched[directory] = wd
+            self.__directories[wd] = directory
+    
+    def __handle_events(self, data):
+        position = 0
+        while position + self.EVENT.size <= len(data):
+            wd, mask, cookie, length = self.EVENT.unpack_from(data, position)
+            name = os.fsdecode(data[position + self.EVENT.size:position + self.EVENT.size + length].split(b'\0', 1)[0])
+            position += self.EVENT.size + length
+            directory = self.__directories.get(wd)
+            if directory is None:
+                continue
+            if mask & self.IN_IGNORED:
+                # the directory is gone; it is watched again if it comes back
+                del self.__directories[wd]
+                if self.__watched.get(directory) == wd:
+                    del self.__watched[directory]
+                    self.__flat.discard(directory)
+            elif directory in self.__flat:
+                pass  # only the files of a flat directory matter
+            elif mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                self.__add_tree(os.path.join(directory, name))
+            elif mask & self.IN_ISDIR and mask & self.IN_MOVED_FROM:
+                # the watches follow the moved directory, not its old path
+                moved = os.path.join(directory, name)
+                for path in [path for path in self.__watched if path == moved or path.startswith(moved + os.sep)]:
+                    self.__libc.inotify_rm_watch(self.__fd, self.__watched.pop(path))
+                    self.__flat.discard(path)
+
+def change_notifier():
+    # the platform's change notification if there is one; the watcher still compares size and mtime either way
+    try:
+        if sys.platform == 'win32':
+            return WindowsChangeNotifier()
+        if sys.platform.startswith('linux'):
+            return InotifyNotifier()
+    except (OSError, AttributeError):
+        pass
+    return PollingNotifier()
+
+class ShapeLibraryWatcher(object):
+    def __init__(self, paths, interval=1.0, notifier=None, report_existing=False):
+        self.__paths = [os.path.abspath(path) for path in paths]
+        self.__interval = interval
+        self.__notifier = change_notifier() if notifier is None else notifier
+        self.__scanner = ShapeLibraryScanner()
+        self.__libraries = {}
+        self.__failures = {}  # path: signature of the last scan that failed, so that an error is reported once
+        self.__pending = self.poll()
+        if not report_existing:
+            self.__pending = []
+    
+    def poll(self):
+        # stats every library and rescans only those whose size or mtime changed
+        directories = [path for path in self.__paths if os.path.isdir(path)]
+        self.__notifier.update(directories, [os.path.dirname(path) for path in self.__paths if path not in directories])
+        events = []
+        seen = set()
+        for path in find_libraries(self.__paths):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # not seen, so a watched file that is gone is reported as removed
+            seen.add(path)
+            signature = (stat.st_size, stat.st_mtime_ns)
+            old_signature, old_records = self.__libraries.get(path, (None, []))
+            if signature == old_signature:
+                continue
+            try:
+                records = self.__scanner.scan(path).records
+            except (IOError, OSError) as e:
+                # the file may be in the middle of being written; the old signature stays, so it is scanned again on every poll until it reads
+                if self.__failures.get(path) != signature:
+                    events.append(LibraryEvent(LibraryEvent.ERROR, path, message=str(e)))
+                    self.__failures[path] = signature
+                self.__libraries[path] = (old_signature, old_records)
+                continue
+            self.__failures.pop(path, None)
+            events.extend(self.__diff(path, old_records, records))
+            self.__libraries[path] = (signature, records)
+        for path in list(self.__libraries):
+            if path not in seen:
+                self.__failures.pop(path, None)
+                events.extend(self.__diff(path, self.__libraries.pop(path)[1], []))
+        return events
+    
+    def wait(self, timeout=None):
+        # blocks until there are events or the timeout (None for no timeout) runs out
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while len(self.__pending) == 0:
+            remaining = self.__interval if deadline is None else min(self.__interval, deadline - time.monotonic())
+            if remaining <= 0:
+                break
+            self.__notifier.wait(remaining)
+            self.__pending = self.poll()
+        events, self.__pending = self.__pending, []
+        return events
+    
+    def watch(self):
+        while True:
+            for event in self.wait():
+                yield event
+    
+    def close(self):
+        self.__notifier.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, type, value, traceback):
+        self.close()
+    
+    def __diff(self, path, old_records, new_records):
+        # entries are matched by name (and occurrence, for repeated names) and compared by digest
+        old = dict((key, (index, record)) for index, (key, record) in enumerate(zip(record_keys(old_records), old_records)))
+        events = []
+        for index, (key, record) in enumerate(zip(record_keys(new_records), new_records)):
+            old_index, old_record = old.pop(key, (None, None))
+            if old_record is None:
+                events.append(LibraryEvent(LibraryEvent.ADDED, path, record.name, index, record))
+            elif old_record.digest != record.digest:
+                events.append(LibraryEvent(LibraryEvent.CHANGED, path, record.name, index, record))
+        for old_index, record in sorted(old.values(), key=lambda item: item[0]):
+            events.append(LibraryEvent(LibraryEvent.REMOVED, path, record.name, old_index, record))
+        return events
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print entry-level changes of LabaNotator shape libraries as they happen.')
+    parser.add_argument('paths', nargs='+', metavar='path', help='.lib file or directory to watch')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between checks (default: 1)')
+    parser.add_argument('--existing', action='store_true', help='report the entries of the libraries that already exist as added')
+    args = parser.parse_args()
+    
+    with ShapeLibraryWatcher(args.paths, args.interval, report_existing=args.existing) as watcher:
+        try:
+            for event in watcher.watch():
+                if event.kind == LibraryEvent.ERROR:
+                    print('! %s: %s' % (event.path, event.message))
+                else:
+                    print('%s %s: %s (#%d)' % ({'added': '+', 'removed': '-', 'changed': '*'}[event.kind], event.path, event.name, event.index))
+                sys.stdout.flush()
+        except KeyboardInterrupt:
+            pass
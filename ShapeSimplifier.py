@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ShapeLibrary import RawShapeLibraryEntry
+import argparse
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SIMPLIFIABLE_TYPES = ['TMyFreeLine', 'TMyPolyLine', 'TMyPolygon']
+CLOSED_TYPES = ['TMyPolygon']
+POINT_SIZE = 8  # two float32 in the file
+
+class SimplificationResult(object):
+    def __init__(self):
+        self.shapes = 0
+        self.points_before = 0
+        self.points_after = 0
+        self.max_deviation = 0.0
+    
+    @property
+    def points_removed(self):
+        return self.points_before - self.points_after
+    
+    @property
+    def bytes_saved(self):
+        return POINT_SIZE * self.points_removed
+    
+    def add(self, other):
+        self.shapes += other.shapes
+        self.points_before += other.points_before
+        self.points_after += other.points_after
+        self.max_deviation = max(self.max_deviation, other.max_deviation)
+    
+    def __str__(self):
+        return '%d shapes, %d -> %d points (%d removed, %d bytes saved), max deviation %.4f' % (self.shapes, self.points_before, self.points_after, self.points_removed, self.bytes_saved, self.max_deviation)
+
+class ShapeSimplifier(object):
+    DOUGLAS_PEUCKER = 'douglas-peucker'
+    RADIAL = 'radial'
+    
+    def __init__(self, tolerance=1.0, method=DOUGLAS_PEUCKER):
+        self.__tolerance = tolerance
+        self.__method = method
+    
+    def simplify_points(self, points, closed=False):
+        # returns (kept points, maximum distance of a dropped point to the simplified outline)
+        minimum = 3 if closed else 2
+        if len(points) <= minimum:
+            return list(points), 0.0
+        packed = self.__pack(list(points) + [points[0]] if closed else points)
+        if self.__method == self.RADIAL:
+            kept = self.__radial(packed, len(points), closed)
+        else:
+            kept = self.__douglas_peucker(packed, len(packed) - 1)
+        if closed and kept[-1] == len(points):
+            kept.pop()  # the repeated first point
+        if len(kept) < minimum:
+            return list(points), 0.0
+        return [points[i] for i in kept], self.__deviation(packed, kept, len(points), closed)
+    
+    def simplify_shape(self, shape, dry_run=False):
+        result = SimplificationResult()
+        if shape.type not in SIMPLIFIABLE_TYPES:
+            return result
+        points = shape.points
+        simplified, deviation = self.simplify_points(points, shape.type in CLOSED_TYPES)
+        result.shapes = 1
+        result.points_before = len(points)
+        result.points_after = len(simplified)
+        result.max_deviation = deviation
+        if not dry_run and len(simplified) < len(points):
+            shape['Points'] = simplified
+        return result
+    
+    def simplify_entry(self, entry, dry_run=False):
+        result = SimplificationResult()
+        if isinstance(entry, RawShapeLibraryEntry):
+            return result  # undecoded, left as it is
+        for shape in entry.shape.walk():
+            result.add(self.simplify_shape(shape, dry_run))
+        return result
+    
+    def simplify_library(self, sl, dry_run=False):
+        result = SimplificationResult()
+        for entry in sl.entries:
+            result.add(self.simplify_entry(entry, dry_run))
+        return result
+    
+    def __pack(self, points):
+        if numpy is not None:
+            return numpy.array(points, dtype=numpy.float64).reshape(-1, 2)
+        return [(float(x), float(y)) for x, y in points]
+    
+    def __douglas_peucker(self, packed, last):
+        # explicit stack; each step measures a whole run of points against its chord at once
+        keep = [False] * (last + 1)
+        keep[0] = keep[last] = True
+        stack = [(0, last)]
+        while len(stack) > 0:
+            first, last = stack.pop()
+            if last - first < 2:
+                continue
+            distances = self.__segment_distances(packed, first, last)
+            if numpy is not None:
+                i = int(numpy.argmax(distances))
+            else:
+                i = max(range(len(distances)), key=distances.__getitem__)
+            if distances[i] > self.__tolerance:
+                keep[first + 1 + i] = True
+                stack.append((first, first + 1 + i))
+                stack.append((first + 1 + i, last))
+        return [i for i, kept in enumerate(keep) if kept]
+    
+    def __radial(self, packed, count, closed):
+        # sequential by nature: a point is kept when it is far enough from the last kept one
+        kept = [0]
+        x0, y0 = packed[0][0], packed[0][1]
+        for i in range(1, count):
+            x, y = packed[i][0], packed[i][1]
+            if math.hypot(x - x0, y - y0) > self.__tolerance:
+                kept.append(i)
+                x0, y0 = x, y
+        if not closed and kept[-1] != count - 1:
+            kept.append(count - 1)
+        return kept
+    
+    def __deviation(self, packed, kept, count, closed):
+        ends = kept + [count] if closed else kept
+        deviation = 0.0
+        for first, last in zip(ends, ends[1:]):
+            if last - first >= 2:
+                deviation = max(deviation, float(max(self.__segment_distances(packed, first, last))))
+        return deviation
+    
+    def __segment_distances(self, packed, first, last):
+        # distances of the points strictly between first and last to the segment joining them
+        if numpy is not None:
+            a, b = packed[first], packed[last]
+            points = packed[first + 1:last]
+            ab = b - a
+            length2 = float(ab.dot(ab))
+            if length2 == 0.0:
+                return numpy.hypot(points[:, 0] - a[0], points[:, 1] - a[1])
+            t = numpy.clip((points - a).dot(ab) / length2, 0.0, 1.0)
+            projections = a + t[:, None] * ab
+            return numpy.hypot(points[:, 0] - projections[:, 0], points[:, 1] - projections[:, 1])
+        (ax, ay), (bx, by) = packed[first], packed[last]
+        dx, dy = bx - ax, by - ay
+        length2 = dx * dx + dy * dy
+        distances = []
+        for x, y in packed[first + 1:last]:
+            t = 0.0 if length2 == 0.0 else min(1.0, max(0.0, ((x - ax) * dx + (y - ay) * dy) / length2))
+            distances.append(math.hypot(x - ax - t * dx, y - ay - t * dy))
+        return distances
+
+
+if __name__ == '__main__':
+    from ShapeLibraryIO import ShapeLibraryReader, ShapeLibraryWriter
+    
+    parser = argparse.ArgumentParser(description='Drop redundant points of TMyFreeLine, TMyPolyLine and TMyPolygon shapes.')
+    parser.add_argument('library')
+    parser.add_argument('--tolerance', type=float, default=1.0, help='largest allowed distance of a dropped point to the simplified outline (default: 1)')
+    parser.add_argument('--method', choices=[ShapeSimplifier.DOUGLAS_PEUCKER, ShapeSimplifier.RADIAL], default=ShapeSimplifier.DOUGLAS_PEUCKER)
+    parser.add_argument('--entry', action='append', metavar='NAME', help='only simplify this entry (may be repeated)')
+    parser.add_argument('--dry-run', action='store_true', help='report what would change without writing')
+    parser.add_argument('--output', metavar='PATH', help='write to PATH instead of overwriting the library')
+    args = parser.parse_args()
+    
+    sl = ShapeLibraryReader().read(args.library)
+    simplifier = ShapeSimplifier(args.tolerance, args.method)
+    total = SimplificationResult()
+    for entry in sl.entries:
+        if args.entry is not None and entry.name not in args.entry:
+            continue
+        result = simplifier.simplify_entry(entry, args.dry_run)
+        if result.points_removed > 0:
+            print('%s: %s' % (entry.name, result))
+        total.add(result)
+    print('total: %s' % total)
+    if not args.dry_run and total.points_removed > 0:
+        ShapeLibraryWriter().write(args.library if args.output is None else args.output, sl)
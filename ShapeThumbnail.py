@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from ShapeLibrary import *
+from ShapeLibraryIO import ShapeLibraryReader, ShapeLibraryRecord, ShapeLibraryWriter
+from Color import Color
+from ShapeGeometry import children_corners, transform_points
+from UserCache import user_cache_directory
+import hashlib
+import math
+import os
+import os.path
+import queue
+import struct
+import threading
+import zlib
+
+class Raster(object):
+    def __init__(self, width, height, background=(255, 255, 255)):
+        self.__width = width
+        self.__height = height
+        self.__pixels = bytearray(bytes(background) * (width * height))
+    
+    @property
+    def width(self):
+        return self.__width
+    
+    @property
+    def height(self):
+        return self.__height
+    
+    def fill_polygon(self, points, rgb):
+        if len(points) < 3:
+            return
+        color = bytes(rgb)
+        ymin = max(0, int(math.floor(min(y for x, y in points))))
+        ymax = min(self.__height - 1, int(math.ceil(max(y for x, y in points))))
+        edges = list(zip(points, points[1:] + points[:1]))
+        for y in range(ymin, ymax + 1):
+            cy = y + 0.5
+            xs = sorted(x0 + (cy - y0) * (x1 - x0) / (y1 - y0) for (x0, y0), (x1, y1) in edges if (y0 <= cy) != (y1 <= cy))
+            for i in range(0, len(xs) - 1, 2):
+                start = max(0, int(math.ceil(xs[i] - 0.5)))
+                end = min(self.__width - 1, int(math.floor(xs[i + 1] - 0.5)))
+                if start <= end:
+                    offset = (y * self.__width + start) * 3
+                    self.__pixels[offset:offset + (end - start + 1) * 3] = color * (end - start + 1)
+    
+    def draw_line(self, p0, p1, rgb, width=1.0):
+        (x0, y0), (x1, y1) = p0, p1
+        half = max(width, 1.0) / 2
+        length = math.hypot(x1 - x0, y1 - y0)
+        if length == 0:
+            self.fill_polygon([(x0 - half, y0 - half), (x0 + half, y0 - half), (x0 + half, y0 + half), (x0 - half, y0 + half)], rgb)
+            return
+        ex, ey = (x1 - x0) / length * half, (y1 - y0) / length * half  # square caps hide gaps between segments
+        self.fill_polygon([(x0 - ex - ey, y0 - ey + ex), (x1 + ex - ey, y1 + ey + ex), (x1 + ex + ey, y1 + ey - ex), (x0 - ex + ey, y0 - ey - ex)], rgb)
+    
+    def draw_polyline(self, points, rgb, width=1.0, closed=False):
+        if closed and len(points) > 2:
+            points = points + points[:1]
+        if len(points) == 1:
+            self.draw_line(points[0], points[0], rgb, width)
+        for p0, p1 in zip(points, points[1:]):
+            self.draw_line(p0, p1, rgb, width)
+    
+    def png(self):
+        stride = self.__width * 3
+        rows = b''.join(b'\x00' + bytes(self.__pixels[y * stride:(y + 1) * stride]) for y in range(self.__height))
+        def chunk(tag, data):
+            return struct.pack('>L', len(data)) + tag + data + struct.pack('>L', zlib.crc32(tag + data) & 0xffffffff)
+        header = struct.pack('>LLBBBBB', self.__width, self.__height, 8, 2, 0, 0, 0)  # 8-bit RGB
+        return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(rows, 9)) + chunk(b'IEND', b'')
+
+class ShapeRasterizer(object):
+    CLEAR_STROKE = 5
+    
+    def __init__(self, size=48, margin=2):
+        self.__size = size
+        self.__margin = margin
+    
+    def render(self, entry):
+        raster = Raster(self.__size, self.__size)
+        primitives = []
+        self.__collect(entry.shape, primitives)
+        points = [point for primitive in primitives for point in primitive[0]]
+        if len(points) == 0:
+            return raster
+        x0, y0 = min(x for x, y in points), min(y for x, y in points)
+        x1, y1 = max(x for x, y in points), max(y for x, y in points)
+        extent = max(x1 - x0, y1 - y0, 1e-6)
+        scale = (self.__size - 2 * self.__margin) / extent
+        ox = self.__margin + ((self.__size - 2 * self.__margin) - (x1 - x0) * scale) / 2 - x0 * scale
+        oy = self.__margin + ((self.__size - 2 * self.__margin) - (y1 - y0) * scale) / 2 - y0 * scale
+        for points, closed, fill, stroke, width in primitives:
+            points = [(ox + x * scale, oy + y * scale) for x, y in points]
+            if fill is not None:
+                raster.fill_polygon(points, fill.components())
+            if stroke is not None:
+                raster.draw_polyline(points, stroke.components(), width * scale, closed)
+        return raster
+    
+    def __collect(self, root, primitives):
+        # without recursing, in drawing order; ancestors is a linked (group, its children's corners, ancestors) chain,
+        # the corners being the points shape_bounds turns a group without points of its own around
+        stack = [(root, None)]
+        while len(stack) > 0:
+            shape, ancestors = stack.pop()
+            if shape.type in ['TMyGroup', 'TMyCombine']:
+                chain = (shape, children_corners(shape), ancestors)
+                stack.extend((subshape, chain) for subshape in reversed(shape.children))
+                continue
+            self.__collect_shape(shape, ancestors, primitives)
+    
+    def __collect_shape(self, shape, ancestors, primitives):
+        points, closed, filled = self.__outline(shape)
+        if len(points) == 0:
+            return
+        points = transform_points(shape, points)
+        while ancestors is not None:
+            group, corners, ancestors = ancestors
+            points = transform_points(group, points, corners)
+        stroke = shape['StrokeColor']
+        if shape['StrokeType'] == self.CLEAR_STROKE:
+            stroke = None
+        if shape.type in ['TMyText', 'TMyImage']:
+            stroke = shape['FontColor'] if shape.type == 'TMyText' else Color((128, 128, 128))
+        fill = shape['FillColor'] if filled else None
+        primitives.append((points, closed, fill, stroke, max(shape['StrokeWidth'] or 1, 1)))
+    
+    def __outline(self, shape):
+        points = list(shape.points)
+        if shape.type in ['TMyLine', 'TMyPolyLine', 'TMyFreeLine']:
+            return points, False, False
+        if shape.type == 'TMyPolygon':
+            return points, True, True
+        if len(points) < 2:
+            return points, False, False
+        x0, y0 = min(x for x, y in points), min(y for x, y in points)
+        x1, y1 = max(x for x, y in points), max(y for x, y in points)
+        cx, cy, rx, ry = (x0 + x1) / 2, (y0 + y1) / 2, (x1 - x0) / 2, (y1 - y0) / 2
+        if shape.type == 'TMyElliArc':
+            return [(cx + rx * math.cos(t * math.pi / 24), cy + ry * math.sin(t * math.pi / 24)) for t in range(48)], True, True
+        if shape.type == 'TMySpiral':
+            turns = min(max(min(rx, ry) / max(shape['Distance'] or 1.0, 1e-6), 1.0), 16.0)
+            steps = int(turns * 24)
+            return [(cx + rx * i / steps * math.cos(i * math.pi / 12), cy + ry * i / steps * math.sin(i * math.pi / 12)) for i in range(steps + 1)], False, False
+        if shape.type == 'TMySinusLine':
+            (px, py), (qx, qy) = points[0], points[-1]
+            length = math.hypot(qx - px, qy - py)
+            if length == 0:
+                return points, False, False
+            period = max(shape['Period'] or 1, 1)
+            amplitude = length / period / 4
+            nx, ny = -(qy - py) / length, (qx - px) / length
+            steps = period * 16
+            return [(px + (qx - px) * i / steps + nx * amplitude * math.sin(i * 2 * math.pi / 16), py + (qy - py) * i / steps + ny * amplitude * math.sin(i * 2 * math.pi / 16)) for i in range(steps + 1)], False, False
+        return [(x0, y0), (x1, y0), (x1, y1), (x0, y1)], True, False
+
+class ThumbnailCache(object):
+    def __init__(self, directory=None, size=48):
+        self.__directory = user_cache_directory('thumbnails') if directory is None else directory
+        self.__size = size
+        self.__rasterizer = ShapeRasterizer(size)
+        self.__writer = ShapeLibraryWriter()
+        self.__reader = ShapeLibraryReader()  # used by the worker only
+        self.__requests = queue.Queue()
+        self.__results = queue.Queue()
+        self.__thread = None
+    
+    def key(self, entry):
+        key = self.__source_key(entry)
+        if key is None:
+            key = '%s-%d' % (hashlib.sha1(self.__writer.encode_entry(entry)).hexdigest(), self.__size)
+        return key
+    
+    def path(self, key):
+        return os.path.join(self.__directory, key[:2], key + '.png')
+    
+    def get(self, entry):
+        path = self.path(self.key(entry))
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+    
+    def render(self, entry):
+        png = self.__rasterizer.render(entry).png()
+        self.__store(self.key(entry), png)
+        return png
+    
+    def request(self, entry, callback=None):
+        if isinstance(entry, RawShapeLibraryEntry):
+            return  # undecoded, nothing to render
+        key = self.__source_key(entry)  # None for edited entries, whose key is encoded on the worker
+        if key is not None and os.path.exists(self.path(key)):
+            if callback is not None:
+                with open(self.path(key), 'rb') as f:
+                    callback(f.read())
+            return
+        self.__requests.put((key, entry, callback))
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__work, daemon=True)
+            self.__thread.start()
+    
+    def request_record(self, record, callback=None):
+        # like request, for an entry that is not decoded; the worker decodes the record if there is no thumbnail yet
+        key = '%s-%d' % (record.digest, self.__size)
+        if os.path.exists(self.path(key)):
+            if callback is not None:
+                with open(self.path(key), 'rb') as f:
+                    callback(f.read())
+            return
+        self.__requests.put((key, record, callback))
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__work, daemon=True)
+            self.__thread.start()
+    
+    def dispatch(self):
+        # call from the GUI thread; callbacks of finished background renders run here
+        while True:
+            try:
+                callback, png = self.__results.get_nowait()
+            except queue.Empty:
+                return
+            callback(png)
+    
+    def __source_key(self, entry):
+        # a clean entry encodes to its source record, whose digest was taken when it was read
+        source = entry.source
+        if entry.dirty or source is None or source.digest is None:
+            return None
+        return '%s-%d' % (source.digest, self.__size)
+    
+    def __work(self):
+        while True:
+            key, entry, callback = self.__requests.get()
+            try:
+                png = self.__thumbnail(key, entry)
+            except Exception:
+                continue  # no preview for this entry (broken geometry, unwritable cache, ...); the thread serves the next one
+            if callback is not None:
+                self.__results.put((callback, png))
+    
+    def __thumbnail(self, key, entry):
+        if key is None:
+            key = self.key(entry)
+        path = self.path(key)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                return f.read()
+        if isinstance(entry, ShapeLibraryRecord):
+            entry = self.__reader.read_record(entry)
+        png = self.__rasterizer.render(entry).png()
+        self.__store(key, png)
+        return png
+    
+    def __store(self, key, png):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = '%s.%d.tmp' % (path, threading.get_ident())
+        with open(temporary, 'wb') as f:
+            f.write(png)
+        os.replace(temporary, path)
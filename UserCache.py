@@ -0,0 +1,13 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import os.path
+
+def user_cache_directory(name):
+    base = os.environ.get('LOCALAPPDATA')
+    if base is None:
+        base = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    path = os.path.join(base, 'LabaNotatorShapeLibraryInspector', name)
+    os.makedirs(path, exist_ok=True)
+    return path
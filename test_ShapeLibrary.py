@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# round trips of a small synthetic library; run with python -m unittest (or pytest)
+# Locale.all() is patched to be empty and every I18nText is left empty, so nothing calls into Windows
+
+from ShapeLibrary import ShapeLibrary, ShapeLibraryEntry, RawShapeLibraryEntry, Shape
+from ShapeLibraryIO import ShapeLibraryReader, ShapeLibraryWriter
+from ShapeLibraryStats import ShapeLibraryStats
+from ShapeLibraryDiff import EntryChange, diff_libraries
+from ShapeLibraryValidator import validate_library
+from ShapeLibraryJSON import ShapeLibraryJSONEncoder, ShapeLibraryJSONDecoder
+from ShapeLibraryServer import ShapeLibraryServer
+from ShapeLibraryWatcher import LibraryEvent, PollingNotifier, ShapeLibraryWatcher
+from ShapeThumbnail import ShapeRasterizer, ThumbnailCache
+from MicrosoftLocale import Locale, I18nText
+from Color import Color
+import asyncio
+import io
+import os
+import os.path
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+import unittest.mock
+import zlib
+
+def setUpModule():
+    global locale_patch
+    locale_patch = unittest.mock.patch.object(Locale, 'all', classmethod(lambda cls: []))
+    locale_patch.start()
+
+def tearDownModule():
+    locale_patch.stop()
+
+def make_shape(type, ref, parent_ref, points, children=None):
+    # every field the writer needs, with the values LabaNotator writes for a plain shape
+    shape = Shape()
+    shape['ShapeType'] = type
+    shape['_Reserved01'] = bytes(4)
+    shape['ShapeAutoNumber'] = ref
+    shape['ShapeRef'] = ref
+    shape['_Reserved02'] = bytes(4)
+    shape['ParentShapeRef'] = parent_ref
+    shape['ChildShapeRefs'] = [] if children is None else [child['ShapeRef'] for child in children]
+    shape['_Reserved03'] = bytes(4)
+    shape['Points'] = points
+    shape['_Reserved04'] = bytes(4)
+    shape['_Reserved05'] = 0.0
+    shape['_Reserved06'] = 0.0
+    shape['_Reserved07'] = bytes(4)
+    shape['Rotation'] = 0.0
+    shape['_Reserved08'] = bytes(8)
+    shape['FillColor'] = Color((255, 255, 255))
+    shape['_Reserved10'] = b'\x00\x01'
+    shape['ShapeName'] = 'shape%d' % ref
+    shape['_Reserved12'] = b'\xff\xff\xff\x00\x00\x00\x00\x00'
+    shape['FontName'] = 'Arial'
+    shape['_Reserved13'] = b'\x01'
+    shape['FontColor'] = Color((0, 0, 0))
+    shape['_Reserved14'] = b'\xff\xf0\xff\xff\xff'
+    shape['FontSize'] = 10
+    shape['_Reserved15'] = b'\x00\x60\x00\x00\x00'
+    shape['TextBold'] = False
+    shape['TextItalic'] = False
+    shape['TextUnderline'] = False
+    shape['TextStrikethrough'] = False
+    shape['_Reserved17'] = b'\x00' * 8 + b'\x17' + b'\x00' * 4
+    shape['StrokeColor'] = Color((0, 0, 0))
+    shape['_Reserved21'] = b'\x00\x04'
+    shape['StrokeType'] = 0
+    shape['StrokeWidth'] = 1
+    shape['_Reserved23'] = I18nText()
+    shape['FlipHorizontal'] = False
+    shape['FlipVertical'] = False
+    shape['_Reserved24'] = b'\x01'
+    shape['Comments'] = []
+    shape['_Reserved25'] = b'\x00\x0a\x00\x00\x00\x00\x0a\x00\x00\x00'
+    shape['Locked'] = False
+    shape['_Reserved29'] = b'\x00\x00\x01'
+    shape['Rotatable'] = True
+    shape['Resizable'] = True
+    shape['ParentCenter'] = False
+    if type == 'TMyText':
+        shape['_Reserved36(TMyText)'] = b'\x00\x01\x01\x00\x00\x00'
+        shape['Text'] = 'text'
+        shape['_Reserved42(TMyText)'] = b'\x00'
+        shape['TextAlign'] = 0
+        shape['TextWrap'] = 0
+    if type in ['TMyLine', 'TMyPolygon', 'TMyPolyLine', 'TMyFreeLine']:
+        shape['ArrowDegree'] = 30
+        shape['ArrowLength'] = 0
+        shape['ArrowOffset'] = 0
+        shape['ArrowStyle'] = 0
+    if type == 'TMyImage':
+        shape['Bitmap'] = b'BM' + bytes(range(64))
+    if type == 'TMyGroup':
+        shape['_Reserved36(TMyGroup)'] = bytes(16)
+        shape['ChildShapes'] = children
+    if type == 'TMyElliArc':
+        shape['_Reserved36(TMyElliArc)'] = bytes(2)
+    if type == 'TMySpiral':
+        shape['_Reserved36(TMySpiral)'] = bytes(4)
+        shape['Distance'] = 2.0
+    if type == 'TMySinusLine':
+        shape['Period'] = 3
+    return shape
+
+def make_library():
+    sl = ShapeLibrary()
+    sl.add(ShapeLibraryEntry('polygon', 32, 32, I18nText(), make_shape('TMyPolygon', 1, -1, [(0.0, 0.0), (10.0, 0.0), (5.0, 8.0)])))
+    children = [
+        make_shape('TMyText', 2, 1, [(0.0, 0.0), (20.0, 10.0)]),
+        make_shape('TMyImage', 3, 1, [(0.0, 0.0), (8.0, 8.0)]),
+        make_shape('TMyElliArc', 4, 1, [(2.0, 2.0), (6.0, 4.0)]),
+    ]
+    sl.add(ShapeLibraryEntry('group', 48, 24, I18nText(), make_shape('TMyGroup', 1, -1, [], children)))
+    sl.add(ShapeLibraryEntry('spiral', 16, 16, I18nText(), make_shape('TMySpiral', 1, -1, [(0.0, 0.0), (16.0, 16.0)])))
+    sl.add(ShapeLibraryEntry('sinus', 40, 8, I18nText(), make_shape('TMySinusLine', 1, -1, [(0.0, 4.0), (40.0, 4.0)])))
+    return sl
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def png_painted(png):
+    # (x, y) of the pixels that are not white; Raster.png writes a single IDAT and no row filters
+    width, height = struct.unpack('>LL', png[16:24])
+    length, = struct.unpack('>L', png[33:37])
+    rows = zlib.decompress(png[41:41 + length])
+    stride = 1 + width * 3
+    return [(x, y) for y in range(height) for x in range(width) if rows[y * stride + 1 + x * 3:y * stride + 4 + x * 3] != b'\xff\xff\xff']
+
+class ShapeLibraryRoundTripTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = self.file('synthetic.lib')
+        ShapeLibraryWriter().write(self.path, make_library())
+        self.data = read_bytes(self.path)
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def file(self, name):
+        return os.path.join(self.directory, name)
+    
+    def corrupt(self):
+        # an unknown shape type leaves the rest of the spiral entry undecodable
+        path = self.file('corrupt.lib')
+        with open(path, 'wb') as f:
+            f.write(self.data.replace(b'TMySpiral', b'TMyXpiral'))
+        return path
+    
+    def test_read_write_identity(self):
+        sl = ShapeLibraryReader().read(self.path)
+        self.assertEqual([entry.name for entry in sl.entries], ['polygon', 'group', 'spiral', 'sinus'])
+        for entry in sl.entries:
+            entry.mark_dirty()  # encoded, not copied
+        ShapeLibraryWriter().write(self.file('encoded.lib'), sl)
+        self.assertEqual(read_bytes(self.file('encoded.lib')), self.data)
+    
+    def test_clean_copy(self):
+        sl = ShapeLibraryReader().read(self.path)
+        stats = ShapeLibraryStats()
+        ShapeLibraryWriter(stats).write(self.file('copied.lib'), sl)
+        self.assertEqual(stats.copied_entries, 4)
+        self.assertEqual(read_bytes(self.file('copied.lib')), self.data)
+        self.assertFalse(any(entry.dirty for entry in sl.entries))
+        
+        sl.entries[1].width = 50
+        stats = ShapeLibraryStats()
+        ShapeLibraryWriter(stats).write(self.file('copied.lib'), sl)
+        self.assertEqual(stats.copied_entries, 3)
+        self.assertEqual(ShapeLibraryReader().read(self.file('copied.lib')).entries[1].width, 50)
+    
+    def test_tolerant_round_trip(self):
+        path = self.corrupt()
+        reader = ShapeLibraryReader(tolerant=True)
+        sl = reader.read(path)
+        self.assertIsInstance(sl.entries[2], RawShapeLibraryEntry)
+        self.assertEqual(sl.entries[2].name, 'spiral')
+        self.assertEqual(len(reader.diagnostics), 1)
+        self.assertFalse(any(isinstance(entry, RawShapeLibraryEntry) for i, entry in enumerate(sl.entries) if i != 2))
+        ShapeLibraryWriter().write(self.file('tolerant.lib'), sl)
+        self.assertEqual(read_bytes(self.file('tolerant.lib')), read_bytes(path))
+    
+    def test_diff(self):
+        self.assertEqual(diff_libraries(self.path, self.path), [])
+        sl = ShapeLibraryReader().read(self.path)
+        sl.entries[0].height = 33
+        sl.remove(3)
+        ShapeLibraryWriter().write(self.file('changed.lib'), sl)
+        changes = diff_libraries(self.path, self.file('changed.lib'))
+        self.assertEqual([(change.kind, change.name) for change in changes], [(EntryChange.CHANGED, 'polygon'), (EntryChange.REMOVED, 'sinus')])
+        self.assertEqual(changes[0].differences, [('Height', 32, 33)])
+    
+    def test_validator(self):
+        self.assertEqual(validate_library(self.path), [])
+        issues = validate_library(self.corrupt())
+        self.assertGreater(len(issues), 0)
+        self.assertEqual(issues[0].entry, 'spiral')
+    
+    def test_bitmap_moved_between_libraries(self):
+        # the image stays a handle on synthetic.lib until synthetic.lib is replaced with the group moved out of it
+        other = self.file('other.lib')
+        ShapeLibraryWriter().write(other, make_library())
+        bitmap = ShapeLibraryReader().read(self.path).entries[1].shape.children[1]['Bitmap'].read()
+        source, target = ShapeLibraryReader().read(self.path), ShapeLibraryReader().read(other)
+        group = source.entries[1]
+        source.remove(1)
+        target.add(group)
+        source.entries[0].width = 99
+        ShapeLibraryWriter().write(self.path, source)
+        ShapeLibraryWriter().write(other, target)
+        entry = ShapeLibraryReader().read(other).entries[-1]
+        self.assertEqual(entry.name, 'group')
+        self.assertEqual(entry.shape.children[1]['Bitmap'].read(), bitmap)
+    
+    def test_conditional_get_after_rename(self):
+        # a renamed entry keeps its contents and digest, but its raw record, JSON and the library listing change
+        server = ShapeLibraryServer([self.directory])
+        paths = ['/libraries/synthetic.lib/entries/0/raw', '/libraries/synthetic.lib/entries/0', '/libraries/synthetic.lib']
+        async def get(port, path, etag):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(('GET %s HTTP/1.1\r\nIf-None-Match: %s\r\nConnection: close\r\n\r\n' % (path, etag)).encode('iso-8859-1'))
+            response = await reader.read()
+            writer.close()
+            head, _, body = response.partition(b'\r\n\r\n')
+            headers = dict(line.split(': ', 1) for line in head.decode('iso-8859-1').split('\r\n')[1:])
+            return int(head.split()[1]), headers.get('ETag'), body
+        async def run():
+            listener = await asyncio.start_server(server.handle, '127.0.0.1', 0)
+            port = listener.sockets[0].getsockname()[1]
+            try:
+                etags = [(await get(port, path, '-'))[1] for path in paths]
+                self.assertEqual([(await get(port, path, etag))[0] for path, etag in zip(paths, etags)], [304] * 3)
+                sl = ShapeLibraryReader().read(self.path)
+                sl.entries[0].name = 'polygoN'
+                ShapeLibraryWriter().write(self.path, sl)
+                os.utime(self.path, ns=(0, 0))  # same size; the signature must change even on coarse clocks
+                responses = [await get(port, path, etag) for path, etag in zip(paths, etags)]
+                self.assertEqual([status for status, etag, body in responses], [200] * 3)
+                self.assertIn(b'polygoN', responses[0][2])
+            finally:
+                listener.close()
+                await listener.wait_closed()
+        asyncio.run(run())
+    
+    def test_watched_file_deleted(self):
+        # a library given as a file, not found through a directory, is reported as removed entry by entry
+        watcher = ShapeLibraryWatcher([self.path], notifier=PollingNotifier())
+        self.assertEqual(watcher.poll(), [])
+        os.unlink(self.path)
+        events = watcher.poll()
+        self.assertEqual([(event.kind, event.name, event.index) for event in events], [(LibraryEvent.REMOVED, name, i) for i, name in enumerate(['polygon', 'group', 'spiral', 'sinus'])])
+        self.assertEqual(watcher.poll(), [])
+        watcher.close()
+    
+    def test_json_round_trip(self):
+        f = io.StringIO()
+        ShapeLibraryJSONEncoder().dump(self.path, f)
+        f.seek(0)
+        ShapeLibraryJSONDecoder().load(f, self.file('json.lib'))
+        self.assertEqual(read_bytes(self.file('json.lib')), self.data)
+
+class ShapeRasterizerTest(unittest.TestCase):
+    def square(self, ref, x, y):
+        shape = make_shape('TMyPolygon', ref, 1, [(x, y), (x + 10.0, y), (x + 10.0, y + 10.0), (x, y + 10.0)])
+        shape['FillColor'] = Color((255, 0, 0))
+        return shape
+    
+    def test_group_rotation(self):
+        # a group has no points of its own and turns around the center of its children's bounds, as in shape_bounds
+        group = make_shape('TMyGroup', 1, -1, [], [self.square(2, 0.0, 0.0), self.square(3, 20.0, 0.0)])
+        group['Rotation'] = 90.0
+        entry = ShapeLibraryEntry('group', 32, 32, I18nText(), group)
+        self.assertAlmostEqual(entry.bounds.width, 10.0)
+        self.assertAlmostEqual(entry.bounds.height, 30.0)
+        painted = png_painted(ShapeRasterizer(48).render(entry).png())
+        xs, ys = [x for x, y in painted], [y for x, y in painted]
+        self.assertLess(max(xs) - min(xs), max(ys) - min(ys))
+        self.assertNotIn((24, 24), painted)  # the gap between the squares, now one above the other
+    
+    def test_deep_group(self):
+        shape = self.square(1, 0.0, 0.0)
+        for depth in range(sys.getrecursionlimit() + 100):
+            shape = make_shape('TMyGroup', 1, -1, [], [shape])
+        entry = ShapeLibraryEntry('deep', 16, 16, I18nText(), shape)
+        self.assertIn((24, 24), png_painted(ShapeRasterizer(48).render(entry).png()))
+    
+    def test_thumbnail_cache(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = ThumbnailCache(directory, 32)
+            entry = make_library().entries[1]
+            self.assertIsNone(cache.get(entry))
+            png = cache.render(entry)
+            self.assertEqual(cache.get(entry), png)
+            self.assertEqual(struct.unpack('>LL', png[16:24]), (32, 32))
+            self.assertGreater(len(png_painted(png)), 0)
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()